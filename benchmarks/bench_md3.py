@@ -0,0 +1,246 @@
+'''
+Benchmarks of MD3 encoding and decoding, run with plain python, Blender is not needed.
+
+    python -m benchmarks.bench_md3 --output results.json
+    python -m benchmarks.bench_md3 --output new.json --compare results.json
+
+Every benchmark is repeated, minimum and median times are saved to JSON
+together with interpreter, numpy and git commit information.
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy
+
+from io_scene_md3 import fmt_md3 as fmt
+from io_scene_md3.cache import DecodeCache, load_model
+from io_scene_md3.cli import info, reencode
+from io_scene_md3.md3file import MD3File
+from io_scene_md3.utils import loop_vertex_keys, unique_first_seen
+
+from .synthetic import random_normals, write_synthetic_md3
+
+SIZES = {
+    'small': dict(surfaces=2, verts=500, tris=800, frames=10, tags=2),
+    'large': dict(surfaces=8, verts=2000, tris=3500, frames=60, tags=4),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(func, repeat, number=1):
+    'Returns (min, median) seconds per call'
+    times = numpy.array(timeit.repeat(func, repeat=repeat, number=number)) / number
+    return float(times.min()), float(numpy.median(times))
+
+
+def dict_dedup(vertex_index, normals, uvs):
+    'Per-loop dictionary, as gather_vertices did it before'
+    md3vert_to_loop = []
+    loop_to_md3vert = []
+    known = {}
+    for i, key in enumerate(zip(vertex_index.tolist(), map(tuple, normals.tolist()), map(tuple, uvs.tolist()))):
+        if key not in known:
+            known[key] = len(md3vert_to_loop)
+            md3vert_to_loop.append(i)
+        loop_to_md3vert.append(known[key])
+    return md3vert_to_loop, loop_to_md3vert
+
+
+def generic_unpack(rtype, bs):
+    'Field-by-field interpreter, as AnyStruct.unpack was before code generation'
+    t = []
+    pti = iter(rtype.struct.unpack(bs))
+    for sz, conv_func in zip(rtype.tupling, rtype.frombin):
+        if sz == 1:
+            value = next(pti)
+        else:
+            value = tuple(next(pti) for i in range(sz))
+        t.append(conv_func(value))
+    return rtype.ntuple_cls._make(t)
+
+
+def generic_pack(rtype, *a, **kw):
+    'Field-by-field interpreter, as AnyStruct.pack was before code generation'
+    t = rtype.ntuple_cls(*a, **kw)
+    pt = []
+    for value, sz, conv_func in zip(t, rtype.tupling, rtype.tobin):
+        value = conv_func(value)
+        if sz == 1:
+            pt.append(value)
+        else:
+            assert len(value) == sz
+            pt.extend(value)
+    return rtype.struct.pack(*pt)
+
+
+def loop_data(nLoops, nVerts, seed=0):
+    'Loops sharing vertices, split by normals and uv seams on some of them'
+    rnd = numpy.random.RandomState(seed)
+    vertex_index = rnd.randint(0, nVerts, size=nLoops).astype(numpy.int32)
+    vertex_normals = random_normals(rnd, nVerts)
+    vertex_uvs = rnd.uniform(0.0, 1.0, size=(nVerts, 2)).astype(numpy.float32)
+    normals = vertex_normals[vertex_index]
+    uvs = vertex_uvs[vertex_index]
+    seams = rnd.uniform(size=nLoops) < 0.1
+    uvs[seams] = rnd.uniform(0.0, 1.0, size=(seams.sum(), 2))
+    return vertex_index, normals, uvs
+
+
+def struct_benchmarks(n):
+    rnd = numpy.random.RandomState(1)
+    co = rnd.uniform(-500.0, 500.0, size=(n, 3))
+    normals = random_normals(rnd, n)
+    columns = (co[:, 0], co[:, 1], co[:, 2])
+    rows = [(tuple(c), tuple(nm)) for c, nm in zip(co.tolist(), normals.tolist())]
+    data = fmt.Vertex.pack_array(*columns, normal=normals)
+    tri_data = fmt.Triangle.pack_array(*rnd.randint(0, 1000, size=(3, n)))
+    normal_bytes = [data[i * fmt.Vertex.size + 6:(i + 1) * fmt.Vertex.size] for i in range(n)]
+    return {
+        'vertex_pack_scalar': lambda: b''.join(fmt.Vertex.pack(c[0], c[1], c[2], nm) for c, nm in rows),
+        'vertex_pack_array': lambda: fmt.Vertex.pack_array(*columns, normal=normals),
+        'vertex_unpack_scalar': lambda: [fmt.Vertex.unpack_from(data, i * fmt.Vertex.size) for i in range(n)],
+        'vertex_unpack_array': lambda: fmt.Vertex.unpack_array(data),
+        'triangle_unpack_scalar': lambda: [fmt.Triangle.unpack_from(tri_data, i * fmt.Triangle.size)
+                                           for i in range(n)],
+        'triangle_unpack_array': lambda: fmt.Triangle.unpack_array(tri_data),
+        'normal_encode_scalar': lambda: [fmt.encode_normal(nm) for _, nm in rows],
+        'normal_encode_array': lambda: fmt.encode_normals(normals),
+        'normal_decode_scalar': lambda: [fmt.decode_normal(b) for b in normal_bytes],
+        'normal_decode_array': lambda: fmt.decode_normals(numpy.frombuffer(b''.join(normal_bytes), numpy.uint8)
+                                                          .reshape((-1, 2))),
+    }
+
+
+def scalar_benchmarks(n):
+    'Headers and small lumps are still packed record by record'
+    header = fmt.Header.pack(
+        magic=fmt.MAGIC, version=fmt.VERSION, modelname='model', flags=0, nFrames=1, nTags=1,
+        nSurfaces=1, nSkins=0, offFrames=108, offTags=164, offSurfaces=276, offEnd=1000)
+    tags = [fmt.Tag.unpack(fmt.Tag.pack('tag_{}'.format(i), (i, 0.5, -i), range(9))) for i in range(n)]
+    tags_bin = b''.join(fmt.Tag.pack(*tag) for tag in tags)
+    return {
+        'header_unpack_generic': lambda: [generic_unpack(fmt.Header, header) for i in range(n)],
+        'header_unpack_generated': lambda: [fmt.Header.unpack(header) for i in range(n)],
+        'tag_pack_generic': lambda: [generic_pack(fmt.Tag, *tag) for tag in tags],
+        'tag_pack_generated': lambda: [fmt.Tag.pack(*tag) for tag in tags],
+        'tag_unpack_loop': lambda: [fmt.Tag.unpack_from(tags_bin, i * fmt.Tag.size) for i in range(n)],
+        'tag_iter_unpack': lambda: list(fmt.Tag.iter_unpack(tags_bin)),
+    }
+
+
+def dedup_benchmarks(n):
+    vertex_index, normals, uvs = loop_data(n, n // 4)
+    return {
+        'dedup_dict': lambda: dict_dedup(vertex_index, normals, uvs),
+        'dedup_array': lambda: unique_first_seen(loop_vertex_keys(vertex_index, normals, uvs)),
+    }
+
+
+def read_all(path):
+    with MD3File(path) as md3:
+        md3.frames.array()
+        md3.tags.array()
+        for surface in md3.surfaces:
+            surface.shaders.array()
+            surface.triangles.array()
+            surface.texcoords.array()
+            surface.positions()
+
+
+def file_benchmarks(directory):
+    result = {}
+    for size, params in sorted(SIZES.items()):
+        path = os.path.join(directory, size + '.md3')
+        output = os.path.join(directory, size + '.out.md3')
+        result['generate_' + size] = lambda p=path, kw=params: write_synthetic_md3(p, **kw)
+        result['generate_' + size]()
+        result['info_' + size] = lambda p=path: info(p)
+        result['parse_' + size] = lambda p=path: read_all(p)
+        result['reencode_' + size] = lambda p=path, o=output: reencode(p, o)
+        result['load_decoded_' + size] = lambda p=path: load_model(p)
+        cache = DecodeCache(os.path.join(directory, 'cache'))
+        load_model(path, cache)
+        result['load_cached_' + size] = lambda p=path, c=cache: load_model(p, c)
+    return result
+
+
+def run(repeat, n, names=None):
+    directory = tempfile.mkdtemp(prefix='md3bench')
+    try:
+        benchmarks = {}
+        benchmarks.update(struct_benchmarks(n))
+        benchmarks.update(scalar_benchmarks(n))
+        benchmarks.update(dedup_benchmarks(n))
+        benchmarks.update(file_benchmarks(directory))
+        results = {}
+        for name in sorted(benchmarks):
+            if names and not any(part in name for part in names):
+                continue
+            best, median = measure(benchmarks[name], repeat)
+            results[name] = {'min': best, 'median': median}
+            sys.stderr.write('{:<28} min {:10.6f}s  median {:10.6f}s\n'.format(name, best, median))
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def compare(results, base):
+    for name in sorted(results):
+        if name in base:
+            ratio = base[name]['min'] / results[name]['min']
+            sys.stderr.write('{:<28} {:6.2f}x {}\n'.format(name, ratio, 'faster' if ratio >= 1 else 'slower'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_md3',
+                                     description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-o', '--output', help='save results as JSON')
+    parser.add_argument('-c', '--compare', help='JSON results of other run to compare with')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-n', '--records', type=int, default=20000, help='records in struct and dedup benchmarks')
+    parser.add_argument('-k', '--filter', nargs='*', help='run only benchmarks with names containing these')
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.records, args.filter)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'repeat': args.repeat,
+            'records': args.records,
+            'sizes': SIZES,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
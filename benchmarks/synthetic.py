@@ -0,0 +1,78 @@
+'''
+Synthetic MD3 models of arbitrary size, generated with fmt_md3 only (no Blender).
+'''
+
+import numpy
+
+from io_scene_md3 import fmt_md3 as fmt
+from io_scene_md3.utils import StreamingWriter
+
+
+def random_normals(rnd, n):
+    v = rnd.normal(size=(n, 3))
+    v /= numpy.sqrt((v ** 2).sum(axis=1))[:, numpy.newaxis]
+    return v.astype(numpy.float32)
+
+
+def random_rotations(rnd, n):
+    'Orthonormal (n, 3, 3) matrices, rows are axes'
+    q, r = numpy.linalg.qr(rnd.normal(size=(n, 3, 3)))
+    return q * numpy.sign(numpy.linalg.det(q))[:, numpy.newaxis, numpy.newaxis]
+
+
+def surface_lumps(rnd, index, nFrames, nVerts, nTris):
+    base = rnd.uniform(-100.0, 100.0, size=(nVerts, 3))
+    phase = rnd.uniform(0.0, 6.28, size=(nVerts, 1))
+    frames = numpy.arange(nFrames)[:, numpy.newaxis, numpy.newaxis]
+    co = (base + numpy.sin(frames * 0.1 + phase) * 5.0).reshape((-1, 3))
+    tris = rnd.randint(0, nVerts, size=(nTris, 3))
+    st = rnd.uniform(0.0, 1.0, size=(nVerts, 2))
+    lumps = (
+        fmt.Shader.pack_array(name=['models/synthetic/skin{}'.format(index)], index=[0]),
+        fmt.Triangle.pack_array(tris[:, 0], tris[:, 1], tris[:, 2]),
+        fmt.TexCoord.pack_array(st[:, 0], st[:, 1]),
+        fmt.Vertex.pack_array(co[:, 0], co[:, 1], co[:, 2], normal=random_normals(rnd, nFrames * nVerts)),
+    )
+    return lumps
+
+
+def write_synthetic_md3(filename, surfaces=1, verts=1000, tris=2000, frames=10, tags=1, seed=0):
+    '''
+    Writes a valid MD3 model with given number of surfaces, each with verts and tris,
+    animated over frames, with tags moving along
+    '''
+    rnd = numpy.random.RandomState(seed)
+    with StreamingWriter(filename) as f:
+        f.reserve(fmt.Header.size)
+        offsets = {}
+        offsets['offFrames'] = f.write(fmt.Frame.pack_array(
+            minBounds=numpy.full((frames, 3), -110.0),
+            maxBounds=numpy.full((frames, 3), 110.0),
+            localOrigin=numpy.zeros((frames, 3)),
+            radius=numpy.full(frames, 191.0),
+            name=['frame{}'.format(i) for i in range(frames)],
+        )) if frames else f.tell()
+        n = frames * tags
+        offsets['offTags'] = f.write(fmt.Tag.pack_array(
+            name=['tag_{}'.format(i % tags) for i in range(n)],
+            origin=rnd.uniform(-50.0, 50.0, size=(n, 3)),
+            axis=random_rotations(rnd, n).reshape((n, 9)),
+        )) if n else f.tell()
+        offsets['offSurfaces'] = f.tell()
+        for i in range(surfaces):
+            start = f.reserve(fmt.Surface.size)
+            shaders, triangles, st, vertices = surface_lumps(rnd, i, frames, verts, tris)
+            s_offsets = {
+                'offShaders': f.write(shaders) - start,
+                'offTris': f.write(triangles) - start,
+                'offST': f.write(st) - start,
+                'offVerts': f.write(vertices) - start,
+            }
+            s_offsets['offEnd'] = f.tell() - start
+            f.write_at(start, fmt.Surface.pack(
+                magic=fmt.MAGIC, name='surface{}'.format(i), flags=0,
+                nFrames=frames, nShaders=1, nVerts=verts, nTris=tris, **s_offsets))
+        offsets['offEnd'] = f.tell()
+        f.write_at(0, fmt.Header.pack(
+            magic=fmt.MAGIC, version=fmt.VERSION, modelname='synthetic', flags=0,
+            nFrames=frames, nTags=tags, nSurfaces=surfaces, nSkins=0, **offsets))
@@ -0,0 +1,94 @@
+'''
+Frame selection for import: frame ranges, strides and named sequences of player models
+from animation.cfg, which is next to head.md3, upper.md3 and lower.md3.
+'''
+
+import os.path
+from collections import namedtuple
+
+# animations in order of animation.cfg lines, like animNumber_t of the game
+ANIMATION_NAMES = (
+    'BOTH_DEATH1', 'BOTH_DEAD1', 'BOTH_DEATH2', 'BOTH_DEAD2', 'BOTH_DEATH3', 'BOTH_DEAD3',
+    'TORSO_GESTURE', 'TORSO_ATTACK', 'TORSO_ATTACK2', 'TORSO_DROP', 'TORSO_RAISE', 'TORSO_STAND', 'TORSO_STAND2',
+    'LEGS_WALKCR', 'LEGS_WALK', 'LEGS_RUN', 'LEGS_BACK', 'LEGS_SWIM', 'LEGS_JUMP', 'LEGS_LAND',
+    'LEGS_JUMPB', 'LEGS_LANDB', 'LEGS_IDLE', 'LEGS_IDLECR', 'LEGS_TURN',
+    # Team Arena
+    'TORSO_GETFLAG', 'TORSO_GUARDBASE', 'TORSO_PATROL', 'TORSO_FOLLOWME', 'TORSO_AFFIRMATIVE', 'TORSO_NEGATIVE',
+)
+ANIMATION_CFG = 'animation.cfg'
+
+Sequence = namedtuple('Sequence', 'name first count looping fps')
+
+
+def parse_animation_cfg(text):
+    '''
+    Returns sequences in file order, frame numbers are as in the file,
+    where legs frames are counted after torso frames. Keyword lines (sex, footsteps...) are skipped.
+    '''
+    sequences = []
+    for line in text.splitlines():
+        tokens = line.split('//', 1)[0].split()
+        if not tokens or not tokens[0].lstrip('-').isdigit():
+            continue
+        if len(tokens) < 4:
+            raise ValueError('Bad animation line: {}'.format(line.strip()))
+        if len(sequences) >= len(ANIMATION_NAMES):
+            break
+        first, count, looping, fps = (int(float(t)) for t in tokens[:4])
+        sequences.append(Sequence(ANIMATION_NAMES[len(sequences)], first, count, looping, fps))
+    return sequences
+
+
+def model_sequences(sequences, model_name):
+    '''
+    Sequences with frames of the model part, by its file name.
+    lower.md3 has no torso frames, so legs frames are shifted back like the game does.
+    '''
+    part = os.path.splitext(os.path.basename(model_name))[0].lower()
+    by_name = {s.name: s for s in sequences}
+    if part.startswith('lower') and 'LEGS_WALKCR' in by_name and 'TORSO_GESTURE' in by_name:
+        skip = by_name['LEGS_WALKCR'].first - by_name['TORSO_GESTURE'].first
+        return [
+            s._replace(first=s.first - skip) if s.name.startswith('LEGS_') else s
+            for s in sequences if not s.name.startswith('TORSO_')]
+    if part.startswith('upper'):
+        return [s for s in sequences if not s.name.startswith('LEGS_')]
+    return sequences
+
+
+def select_frames(nFrames, start=0, end=-1, stride=1, sequences=()):
+    '''
+    Frame numbers to import, sorted: frames of given sequences (all frames when there are none),
+    limited to start..end (negative end counts from the last frame), every stride-th of them.
+    '''
+    if stride < 1:
+        raise ValueError('Frame stride must be positive')
+    if end < 0:
+        end += nFrames
+    end = min(end, nFrames - 1)
+    if sequences:
+        frames = set()
+        for s in sequences:
+            frames.update(range(s.first, s.first + max(s.count, 1)))
+        frames = sorted(f for f in frames if start <= f <= end)
+    else:
+        frames = list(range(max(start, 0), end + 1))
+    if not frames:
+        raise ValueError('No frames selected, the model has {} frames'.format(nFrames))
+    return frames[::stride]
+
+
+def find_sequences(sequences, names):
+    'Sequences by comma separated names, case-insensitive'
+    by_name = {s.name.lower(): s for s in sequences}
+    result = []
+    for name in names.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        s = by_name.get(name.lower())
+        if s is None:
+            raise ValueError('Unknown animation sequence {}, known are: {}'.format(
+                name, ', '.join(s.name for s in sequences)))
+        result.append(s)
+    return result
@@ -0,0 +1,86 @@
+'''
+Frame bounds, all functions take points of many frames at once: (nFrames, nPoints, 3)
+'''
+
+import numpy
+
+
+def aabb(points):
+    'Returns (mins, maxs), each is (nFrames, 3) array'
+    points = numpy.asarray(points)
+    if points.shape[1] == 0:
+        zeros = numpy.zeros((points.shape[0], 3))
+        return zeros, zeros.copy()
+    return points.min(axis=1), points.max(axis=1)
+
+
+def sphere_radius(points, centers):
+    '''
+    Smallest radius for every frame, so that sphere around given center encloses all points.
+    Radius is rounded up to float32, center is expected to be float32 representable.
+    '''
+    points = numpy.asarray(points, dtype=numpy.float64)
+    centers = numpy.asarray(centers, dtype=numpy.float64).reshape((-1, 1, 3))
+    if points.shape[1] == 0:
+        return numpy.zeros(points.shape[0], dtype=numpy.float32)
+    radius = numpy.sqrt(((points - centers) ** 2).sum(axis=2).max(axis=1))
+    radius32 = radius.astype(numpy.float32)
+    short = radius32 < radius
+    radius32[short] = numpy.nextafter(radius32[short], numpy.float32(numpy.inf))
+    return radius32
+
+
+def ritter_spheres(points):
+    '''
+    Bounding sphere for every frame by Ritter's algorithm, processed for all frames simultaneously.
+    Starts from the sphere over two distant points, then grows it towards the farthest
+    outside point until everything is enclosed.
+    Returns (centers, radii), centers are float32, radii enclose all points.
+    '''
+    p = numpy.asarray(points, dtype=numpy.float64)
+    nFrames = p.shape[0]
+    if p.shape[1] == 0:
+        return numpy.zeros((nFrames, 3), dtype=numpy.float32), numpy.zeros(nFrames, dtype=numpy.float32)
+    fi = numpy.arange(nFrames)
+
+    x = p[fi, ((p - p[:, :1]) ** 2).sum(axis=2).argmax(axis=1)]
+    y = p[fi, ((p - x[:, numpy.newaxis]) ** 2).sum(axis=2).argmax(axis=1)]
+    center = (x + y) / 2.0
+    radius = numpy.sqrt(((y - x) ** 2).sum(axis=1)) / 2.0
+
+    while True:
+        dist = numpy.sqrt(((p - center[:, numpy.newaxis]) ** 2).sum(axis=2))
+        far = dist.argmax(axis=1)
+        dmax = dist[fi, far]
+        out = dmax > radius * (1.0 + 1e-9)
+        if not out.any():
+            break
+        # new sphere touches the old one on the opposite side and the farthest point
+        shift = (dmax[out] - radius[out]) / (2.0 * dmax[out])
+        center[out] += (p[fi[out], far[out]] - center[out]) * shift[:, numpy.newaxis]
+        radius[out] = (radius[out] + dmax[out]) / 2.0
+
+    center = center.astype(numpy.float32)
+    return center, sphere_radius(p, center)
+
+
+def frame_bounds(points, local_origin=None):
+    '''
+    Returns dict of arrays: minBounds, maxBounds, localOrigin, radius.
+    When local_origin is None, it's taken from the tight bounding sphere,
+    otherwise radius is measured from given point.
+    Quake 3 culls models by the sphere of radius around localOrigin.
+    '''
+    points = numpy.asarray(points)
+    mins, maxs = aabb(points)
+    if local_origin is None:
+        origins, radii = ritter_spheres(points)
+    else:
+        origins = numpy.tile(numpy.asarray(local_origin, dtype=numpy.float32), (points.shape[0], 1))
+        radii = sphere_radius(points, origins)
+    return {
+        'minBounds': mins,
+        'maxBounds': maxs,
+        'localOrigin': origins,
+        'radius': radii,
+    }
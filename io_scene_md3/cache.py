@@ -0,0 +1,327 @@
+'''
+Decoded MD3 models and their persistent on-disk cache.
+
+Every entry is a directory named by hash of the file contents and cache version,
+it contains decoded columns in one file, which is memory-mapped on load,
+so repeated imports of the same file skip fmt_md3 decoding entirely.
+Least recently used entries are evicted when total size exceeds the limit.
+
+    MD3_CACHE_DIR   cache location, ~/.cache/io_scene_md3 by default
+    MD3_CACHE_SIZE  size limit in MiB, 512 by default, 0 disables the cache
+'''
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from struct import error as struct_error
+
+import numpy
+
+from . import bl_info
+from . import fmt_md3 as fmt
+from .md3file import MD3File
+from .normals import decode_normals
+
+# bump when decoding or entry layout changes, old entries are never hit again
+CACHE_FORMAT = 3
+CACHE_VERSION = '{}-{}'.format('.'.join(map(str, bl_info['version'])), CACHE_FORMAT)
+DEFAULT_SIZE = 512
+ARRAY_ALIGNMENT = 16
+
+
+class DecodedSurface:
+    'Decoded surface, same interface as md3file.MD3Surface, but lumps are already columns'
+
+    def __init__(self, header, shaders, triangles, texcoords, positions, normal_bytes):
+        self.header = header
+        self.shaders = shaders  # list of records
+        self.triangles = triangles  # columns
+        self.texcoords = texcoords  # columns
+        self._positions = positions  # (nFrames, nVerts, 3)
+        self.normal_bytes = normal_bytes  # (nFrames, nVerts, 2) stored (lat, lon), 6 times smaller than decoded
+
+    @property
+    def name(self):
+        return self.header.name
+
+    @property
+    def normals(self):
+        'Decoded on access, (nFrames, nVerts, 3)'
+        shape = self.normal_bytes.shape[:2] + (3,)
+        return decode_normals(self.normal_bytes.reshape((-1, 2))).astype(numpy.float32).reshape(shape)
+
+    def positions(self, frames=None):
+        return self._positions if frames is None else self._positions[frames]
+
+    def select_frames(self, frames):
+        return DecodedSurface(self.header, self.shaders, self.triangles, self.texcoords,
+                              self._positions[frames], self.normal_bytes[frames])
+
+
+class DecodedModel:
+    '''
+    Decoded model, same interface as md3file.MD3File, but lumps are already columns.
+    It may contain only some frames of the file, frame_numbers are their numbers in the file,
+    header stays as it is in the file.
+    '''
+
+    def __init__(self, header, frames, tags, surfaces, frame_numbers=None):
+        self.header = header
+        self.frames = frames  # list of records
+        self.tags = tags  # columns of all frames
+        self.surfaces = surfaces
+        self.frame_numbers = list(range(header.nFrames)) if frame_numbers is None else list(frame_numbers)
+
+    def frame_tags(self, frame):
+        'Records of the frame, same as MD3File gives them'
+        n = self.header.nTags
+        return [
+            fmt.Tag.ntuple_cls(*(tuple(column[i].tolist()) if column.ndim > 1 else column[i].item()
+                                 for column in self.tags))
+            for i in range(frame * n, (frame + 1) * n)]
+
+    def select_frames(self, frames):
+        'Model of given frames of this one, memory-mapped arrays are read only for them'
+        frames = numpy.asarray(frames, dtype=numpy.int64)
+        n = self.header.nTags
+        rows = (frames[:, numpy.newaxis] * n + numpy.arange(n)).ravel()
+        return DecodedModel(
+            self.header,
+            [self.frames[f] for f in frames],
+            self.tags._make(column[rows] for column in self.tags),
+            [surface.select_frames(frames) for surface in self.surfaces],
+            [self.frame_numbers[f] for f in frames],
+        )
+
+
+def decode_surface(surface, frames=None):
+    h = surface.header
+    # raw values, normals are kept encoded
+    if frames is None:
+        verts = surface.vertices.array(convert=False)
+        count = h.nFrames
+    else:
+        verts = surface.frames_vertices(frames, convert=False)
+        count = len(frames)
+    positions = fmt.decode_vertex(numpy.column_stack((verts.x, verts.y, verts.z))).astype(numpy.float32)  # exact
+    return DecodedSurface(
+        header=h,
+        shaders=list(surface.shaders),
+        triangles=surface.triangles.array(),
+        texcoords=surface.texcoords.array(),
+        positions=positions.reshape((count, h.nVerts, 3)),
+        normal_bytes=verts.normal.reshape((count, h.nVerts, 2)),
+    )
+
+
+def decode_model(md3, frames=None):
+    '''
+    Decodes everything needed for import from MD3File.
+    When frames are given, vertices and tags of other frames are not even read.
+    '''
+    if frames is None:
+        return DecodedModel(
+            header=md3.header,
+            frames=list(md3.frames),
+            tags=md3.tags.array(),
+            surfaces=[decode_surface(surface) for surface in md3.surfaces],
+        )
+    return DecodedModel(
+        header=md3.header,
+        frames=[md3.frames[f] for f in frames],
+        tags=md3.frames_tags(frames),
+        surfaces=[decode_surface(surface, frames) for surface in md3.surfaces],
+        frame_numbers=frames,
+    )
+
+
+def file_key(filename, buffer=None):
+    'Hash of file contents (or given buffer) and cache version'
+    h = hashlib.sha1(CACHE_VERSION.encode('ascii') + b'\0')
+    if buffer is not None:
+        h.update(buffer)
+        return h.hexdigest()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'io_scene_md3')
+
+
+class DecodeCache:
+    '''
+    Directory of decoded models keyed by file_key.
+    Broken or incomplete entries are treated as missing.
+    '''
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_SIZE << 20):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_environ(cls, environ=os.environ):
+        'Returns None when the cache is disabled'
+        size = int(environ.get('MD3_CACHE_SIZE', DEFAULT_SIZE))
+        if size <= 0:
+            return None
+        return cls(environ.get('MD3_CACHE_DIR') or None, size << 20)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            model = self.read_entry(path)
+            os.utime(os.path.join(path, 'meta.json'))  # marks as recently used
+        except (OSError, ValueError, KeyError, IndexError, struct_error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return model
+
+    def put(self, key, model):
+        os.makedirs(self.directory, exist_ok=True)
+        # entry is complete before it appears under its name
+        temp = tempfile.mkdtemp(prefix='.tmp', dir=self.directory)
+        try:
+            self.write_entry(temp, model)
+            os.rename(temp, self.entry_path(key))
+        except OSError:
+            # other process has just put the same entry, or disk problems, cache is optional anyway
+            shutil.rmtree(temp, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        'Returns list of (last use time, size, path)'
+        result = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return result
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                used = os.stat(os.path.join(path, 'meta.json')).st_mtime
+                size = sum(os.stat(os.path.join(path, f)).st_size for f in os.listdir(path))
+            except OSError:
+                continue  # not an entry, or is being written
+            result.append((used, size, path))
+        return result
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        'Removes least recently used entries until the cache fits into max_bytes'
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for used, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    def write_entry(self, path, model):
+        records = [fmt.Header.pack(*model.header)]
+        records.extend(fmt.Frame.pack(*frame) for frame in model.frames)
+        arrays = [('records', None)]
+        arrays.extend(('tags.' + field, column) for field, column in zip(model.tags._fields, model.tags))
+        for i, surface in enumerate(model.surfaces):
+            records.append(fmt.Surface.pack(*surface.header))
+            records.extend(fmt.Shader.pack(*shader) for shader in surface.shaders)
+            prefix = 'surface{}.'.format(i)
+            for lump in (surface.triangles, surface.texcoords):
+                arrays.extend((prefix + field, column) for field, column in zip(lump._fields, lump))
+            arrays.append((prefix + 'positions', surface.positions()))
+            arrays.append((prefix + 'normal_bytes', surface.normal_bytes))
+        arrays[0] = ('records', numpy.frombuffer(b''.join(records), dtype=numpy.uint8))
+
+        # all arrays are in one file, aligned, index is kept in meta.json
+        index = {}
+        with open(os.path.join(path, 'arrays.bin'), 'wb') as f:
+            for name, array in arrays:
+                array = numpy.ascontiguousarray(array)
+                f.write(bytes(-f.tell() % ARRAY_ALIGNMENT))
+                index[name] = (f.tell(), array.dtype.str, array.shape)
+                f.write(array.tobytes())
+        # written last, entry without it is incomplete
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'arrays': index}, f)
+
+    def read_entry(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != CACHE_VERSION:
+            raise ValueError('Cache entry version mismatch')
+        with open(os.path.join(path, 'arrays.bin'), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        def get(name):
+            offset, dtype, shape = meta['arrays'][name]
+            dtype = numpy.dtype(dtype)
+            count = int(numpy.prod(shape))
+            return numpy.frombuffer(buffer, dtype, count, offset).reshape(shape)
+
+        def columns(prefix, rtype):
+            return rtype.ntuple_cls._make(get(prefix + field) for field in rtype.ntuple_cls._fields)
+
+        records = get('records')
+        header = fmt.Header.unpack_from(records)
+        offset = fmt.Header.size
+        frames = list(fmt.Frame.iter_unpack(records, offset, header.nFrames))
+        offset += header.nFrames * fmt.Frame.size
+        surfaces = []
+        for i in range(header.nSurfaces):
+            h = fmt.Surface.unpack_from(records, offset)
+            offset += fmt.Surface.size
+            shaders = list(fmt.Shader.iter_unpack(records, offset, h.nShaders))
+            offset += h.nShaders * fmt.Shader.size
+            prefix = 'surface{}.'.format(i)
+            surfaces.append(DecodedSurface(
+                header=h,
+                shaders=shaders,
+                triangles=columns(prefix, fmt.Triangle),
+                texcoords=columns(prefix, fmt.TexCoord),
+                positions=get(prefix + 'positions'),
+                normal_bytes=get(prefix + 'normal_bytes'),
+            ))
+        if offset != len(records):
+            raise ValueError('Cache entry records are damaged')
+        return DecodedModel(header, frames, columns('tags.', fmt.Tag), surfaces)
+
+
+def load_model(filename, cache=None, buffer=None, frames=None):
+    '''
+    Decoded model from cache if possible, otherwise decodes the file and puts it into cache.
+    buffer is contents of the file, when it's not a plain file on disk.
+    frames are numbers of needed frames, None means all. Model with some frames only
+    is not put into cache, the file is decoded partially instead.
+    '''
+    if cache is None:
+        with MD3File(filename, buffer) as md3:
+            return decode_model(md3, frames)
+    key = file_key(filename, buffer)
+    model = cache.get(key)
+    if model is None:
+        with MD3File(filename, buffer) as md3:
+            model = decode_model(md3, frames)
+        if frames is None:
+            cache.put(key, model)
+    elif frames is not None:
+        model = model.select_frames(frames)
+    return model
@@ -0,0 +1,250 @@
+'''
+Command line tool for inspecting, validating and re-encoding MD3 files without Blender.
+
+    python -m io_scene_md3.cli info models/
+    python -m io_scene_md3.cli validate --jobs 8 models/ other.md3
+    python -m io_scene_md3.cli reencode --output-dir out/ models/
+
+Directories are searched recursively for *.md3 files.
+Every file produces one JSON line on stdout.
+'''
+
+import argparse
+import json
+import os
+import struct
+import sys
+from multiprocessing import Pool
+
+from . import fmt_md3 as fmt
+from .md3file import MD3File
+from .utils import StreamingWriter
+
+
+def find_md3_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.md3'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def common_base(paths):
+    'Deepest directory containing all paths (os.path.commonpath is missing in Python 3.4)'
+    dirs = [os.path.join(os.path.abspath(os.path.dirname(p)), '') for p in paths]
+    # prefix may end in the middle of a name, dirname cuts it back to whole directories
+    return os.path.dirname(os.path.commonprefix(dirs)) if dirs else ''
+
+
+def bounds_summary(frames):
+    if len(frames) == 0:
+        return None
+    return {
+        'minBounds': frames.minBounds.min(axis=0).tolist(),
+        'maxBounds': frames.maxBounds.max(axis=0).tolist(),
+        'maxRadius': float(frames.radius.max()),
+    }
+
+
+def info(path):
+    with MD3File(path) as md3:
+        header = md3.header
+        frames = md3.frames.array()
+        return {
+            'path': path,
+            'size': len(md3.buffer),
+            'modelname': header.modelname,
+            'nFrames': header.nFrames,
+            'nTags': header.nTags,
+            'nSurfaces': header.nSurfaces,
+            'nSkins': header.nSkins,
+            'frames': frames.name.tolist(),
+            'bounds': bounds_summary(frames),
+            'tags': [tag.name for tag in md3.frame_tags(0)] if header.nFrames else [],
+            'surfaces': [{
+                'name': surface.name,
+                'nVerts': surface.header.nVerts,
+                'nTris': surface.header.nTris,
+                'shaders': [shader.name for shader in surface.shaders],
+            } for surface in md3.surfaces],
+        }
+
+
+def check_lump(errors, what, offset, count, rtype, start, end):
+    if count < 0:
+        errors.append('{}: negative count {}'.format(what, count))
+    elif offset < start or offset + count * rtype.size > end:
+        errors.append('{}: range {}..{} is outside of {}..{}'.format(
+            what, offset, offset + count * rtype.size, start, end))
+    else:
+        return True
+    return False
+
+
+def check_limit(warnings, what, value, limit):
+    if value > limit:
+        warnings.append('{} {} exceeds engine limit {}'.format(what, value, limit))
+
+
+def validate(path):
+    errors = []
+    warnings = []
+    result = {
+        'path': path,
+        'valid': False,
+        'errors': errors,
+        'warnings': warnings,
+    }
+    try:
+        md3 = MD3File(path)
+    except (ValueError, struct.error) as e:
+        # truncated header or garbage is a validation result, not a failure of the tool
+        errors.append(str(e))
+        return result
+    with md3:
+        size = len(md3.buffer)
+        header = md3.header
+        if header.offEnd != size:
+            errors.append('offEnd {} does not match file size {}'.format(header.offEnd, size))
+        end = min(header.offEnd, size)
+        check_lump(errors, 'frames', header.offFrames, header.nFrames, fmt.Frame, fmt.Header.size, end)
+        check_lump(errors, 'tags', header.offTags, header.nFrames * header.nTags, fmt.Tag, fmt.Header.size, end)
+        check_limit(warnings, 'nFrames', header.nFrames, fmt.MAX_FRAMES)
+        check_limit(warnings, 'nTags', header.nTags, fmt.MAX_TAGS)
+        check_limit(warnings, 'nSurfaces', header.nSurfaces, fmt.MAX_SURFACES)
+
+        offset = header.offSurfaces
+        for i in range(header.nSurfaces):
+            what = 'surface {}'.format(i)
+            if not check_lump(errors, what, offset, 1, fmt.Surface, fmt.Header.size, end):
+                break
+            surface = fmt.Surface.unpack_from(md3.buffer, offset)
+            if surface.magic != fmt.MAGIC:
+                errors.append('{}: wrong magic'.format(what))
+                break
+            what = 'surface {} ({})'.format(i, surface.name)
+            s_end = offset + surface.offEnd
+            if not fmt.Surface.size <= surface.offEnd or s_end > end:
+                errors.append('{}: offEnd {} is out of file'.format(what, surface.offEnd))
+                break
+            if surface.nFrames != header.nFrames:
+                errors.append('{}: nFrames {} differs from header {}'.format(what, surface.nFrames, header.nFrames))
+            check_limit(warnings, what + ' nVerts', surface.nVerts, fmt.MAX_VERTS)
+            check_limit(warnings, what + ' nTris', surface.nTris, fmt.MAX_TRIANGLES)
+            check_limit(warnings, what + ' nShaders', surface.nShaders, fmt.MAX_SHADERS)
+            check_lump(errors, what + ' shaders', offset + surface.offShaders, surface.nShaders, fmt.Shader,
+                       offset, s_end)
+            check_lump(errors, what + ' texcoords', offset + surface.offST, surface.nVerts, fmt.TexCoord,
+                       offset, s_end)
+            check_lump(errors, what + ' vertices', offset + surface.offVerts, surface.nVerts * surface.nFrames,
+                       fmt.Vertex, offset, s_end)
+            if check_lump(errors, what + ' triangles', offset + surface.offTris, surface.nTris, fmt.Triangle,
+                          offset, s_end):
+                tris = fmt.Triangle.unpack_array(md3.buffer, offset + surface.offTris, surface.nTris)
+                for index in (tris.a, tris.b, tris.c):
+                    if len(index) and (index.min() < 0 or index.max() >= surface.nVerts):
+                        errors.append('{}: triangle refers to vertex out of range'.format(what))
+                        break
+            offset = s_end
+        else:
+            if offset != header.offEnd:
+                errors.append('surfaces end at {}, header offEnd is {}'.format(offset, header.offEnd))
+
+    result['valid'] = not errors
+    return result
+
+
+def write_lump(f, lump):
+    'Copies lump through its record type, without lossy conversions'
+    if len(lump):
+        columns = lump.array(convert=False)
+        return f.write(lump.rtype.pack_array(*columns, convert=False))
+    return f.tell()
+
+
+def reencode(path, output):
+    '''
+    Rewrites the model with canonical layout: header, frames, tags, surfaces,
+    every surface is header, shaders, triangles, texcoords, vertices.
+    All records are decoded and encoded back by fmt_md3 structures.
+    '''
+    with MD3File(path) as md3, StreamingWriter(output) as f:
+        header = md3.header
+        f.reserve(fmt.Header.size)
+        offsets = {
+            'offFrames': write_lump(f, md3.frames),
+            'offTags': write_lump(f, md3.tags),
+            'offSurfaces': f.tell(),
+        }
+        for surface in md3.surfaces:
+            start = f.reserve(fmt.Surface.size)
+            s_offsets = {
+                'offShaders': write_lump(f, surface.shaders) - start,
+                'offTris': write_lump(f, surface.triangles) - start,
+                'offST': write_lump(f, surface.texcoords) - start,
+                'offVerts': write_lump(f, surface.vertices) - start,
+            }
+            s_offsets['offEnd'] = f.tell() - start
+            f.write_at(start, fmt.Surface.pack(**dict(surface.header._asdict(), **s_offsets)))
+        offsets['offEnd'] = f.tell()
+        f.write_at(0, fmt.Header.pack(**dict(header._asdict(), **offsets)))
+        size = offsets['offEnd']
+    return {
+        'path': path,
+        'output': output,
+        'size': size,
+    }
+
+
+def run_command(args):
+    command, path, options = args
+    try:
+        if command == 'info':
+            return info(path)
+        elif command == 'validate':
+            return validate(path)
+        elif command == 'reencode':
+            output = os.path.join(options['output_dir'], os.path.relpath(path, options['base']))
+            os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+            return reencode(path, output)
+    except Exception as e:
+        return {'path': path, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m io_scene_md3.cli', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('command', choices=('info', 'validate', 'reencode'))
+    parser.add_argument('paths', nargs='+', help='md3 files or directories')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, CPU count by default')
+    parser.add_argument('-o', '--output-dir', help='where to put re-encoded files')
+    args = parser.parse_args(argv)
+    if args.command == 'reencode' and not args.output_dir:
+        parser.error('reencode requires --output-dir')
+
+    paths = list(find_md3_files(args.paths))
+    options = {
+        'output_dir': args.output_dir,
+        # re-encoded files keep their position relative to common base
+        'base': common_base(paths),
+    }
+    tasks = [(args.command, os.path.abspath(p) if args.command == 'reencode' else p, options) for p in paths]
+
+    failed = 0
+    pool = Pool(args.jobs)
+    try:
+        for result in pool.imap(run_command, tasks, chunksize=8):
+            if 'error' in result or not result.get('valid', True):
+                failed += 1
+            sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+    finally:
+        pool.close()
+        pool.join()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
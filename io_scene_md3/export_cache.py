@@ -0,0 +1,198 @@
+'''
+Packed surfaces of previous exports, for incremental re-export.
+
+Every mesh object is fingerprinted by its inputs before the export. Entry keeps md3 topology
+of the object and, for every frame, its evaluated state (world matrices, pose, shape key values),
+world space vertex positions and packed vertex block. Frames with the same state are taken
+from the entry, only the rest are evaluated again.
+
+Entries are kept in memory during the session, and on disk when a directory is given.
+
+    MD3_EXPORT_CACHE_DIR   keeps entries on disk too, so they survive restarts
+    MD3_EXPORT_CACHE_SIZE  size limit in MiB of memory and of disk, 256 by default
+'''
+
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy
+
+from . import bl_info
+
+# bump when fingerprints or entry layout change, old entries are never hit again
+ENTRY_FORMAT = 2
+ENTRY_VERSION = '{}-{}'.format('.'.join(map(str, bl_info['version'])), ENTRY_FORMAT)
+DEFAULT_SIZE = 256
+ENTRY_EXTENSION = '.npz'
+
+
+class SurfaceEntry:
+    'Export results of one mesh object, frames are appended while the export goes'
+
+    def __init__(self, shader_list, tris, uv, md3vert_to_loop, states=None, co=None, blocks=None):
+        self.shader_list = shader_list
+        self.tris = tris  # (nTris, 3) md3 vertex indices
+        self.uv = uv  # (nVerts, 2)
+        self.md3vert_to_loop = md3vert_to_loop
+        self.states = [] if states is None else states  # per frame
+        self.co = [] if co is None else co  # per frame world space (nVerts, 3)
+        self.blocks = [] if blocks is None else blocks  # per frame packed vertices
+
+    @property
+    def nFrames(self):
+        return len(self.blocks)
+
+    @property
+    def nbytes(self):
+        arrays = [self.tris, self.uv, self.md3vert_to_loop] + list(self.states) + list(self.co)
+        return sum(numpy.asarray(a).nbytes for a in arrays) + sum(len(b) for b in self.blocks)
+
+    def complete(self, nFrames):
+        return len(self.states) == len(self.co) == len(self.blocks) == nFrames
+
+
+def write_entry(f, entry):
+    meta = json.dumps({'version': ENTRY_VERSION, 'shader_list': list(entry.shader_list)}).encode('utf-8')
+    numpy.savez(
+        f,
+        meta=numpy.frombuffer(meta, dtype=numpy.uint8),
+        tris=numpy.asarray(entry.tris, dtype=numpy.int32),
+        uv=numpy.asarray(entry.uv, dtype=numpy.float32),
+        md3vert_to_loop=numpy.asarray(entry.md3vert_to_loop, dtype=numpy.int32),
+        states=numpy.array(entry.states, dtype=numpy.float64),
+        co=numpy.array(entry.co, dtype=numpy.float32),
+        blocks=numpy.frombuffer(b''.join(entry.blocks), dtype=numpy.uint8).reshape((entry.nFrames, -1)),
+    )
+
+
+def read_entry(f):
+    # entries hold plain arrays only, they never need pickle
+    with numpy.load(f) as data:
+        meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+        if meta['version'] != ENTRY_VERSION:
+            raise ValueError('Export cache entry version mismatch')
+        return SurfaceEntry(
+            shader_list=meta['shader_list'],
+            tris=data['tris'],
+            uv=data['uv'],
+            md3vert_to_loop=data['md3vert_to_loop'].tolist(),
+            states=list(data['states']),
+            co=data['co'],
+            blocks=[row.tobytes() for row in data['blocks']],
+        )
+
+
+class ExportCache:
+    'Surface entries by fingerprint, least recently used ones are evicted over max_bytes'
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_SIZE << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_environ(cls, environ=os.environ):
+        size = int(environ.get('MD3_EXPORT_CACHE_SIZE', DEFAULT_SIZE))
+        return cls(environ.get('MD3_EXPORT_CACHE_DIR') or None, size << 20)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + ENTRY_EXTENSION)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.directory is not None:
+            path = self.entry_path(key)
+            try:
+                entry = read_entry(path)
+                os.utime(path)  # marks as recently used
+            except (OSError, ValueError, KeyError):
+                entry = None
+            if entry is not None:
+                self.remember(key, entry)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        total = sum(e.nbytes for e in self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            total -= evicted.nbytes
+
+    def put(self, key, entry):
+        self.remember(key, entry)
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # entry is complete before it appears under its name
+            fd, temp = tempfile.mkstemp(prefix='.tmp', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    write_entry(f, entry)
+                os.replace(temp, self.entry_path(key))
+            except BaseException:
+                os.remove(temp)
+                raise
+        except OSError as e:
+            print('Warning: export cache entry is not saved: {}'.format(e))
+        self.evict_disk()
+
+    def disk_entries(self):
+        'Returns list of (last use time, size, path)'
+        result = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return result
+        for name in names:
+            if name.endswith(ENTRY_EXTENSION) and not name.startswith('.'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                result.append((st.st_mtime, st.st_size, path))
+        return result
+
+    def evict_disk(self):
+        entries = sorted(self.disk_entries())
+        total = sum(size for _, size, _ in entries)
+        for used, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        self.entries.clear()
+        if self.directory is not None:
+            for _, _, path in self.disk_entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+_session_cache = None
+
+
+def session_cache():
+    'Cache shared between exports during the session, configured from environment on first use'
+    global _session_cache
+    if _session_cache is None:
+        _session_cache = ExportCache.from_environ()
+    return _session_cache
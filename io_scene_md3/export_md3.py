@@ -1,17 +1,22 @@
 # grouping to surfaces must done by UV maps also, not only normals
-# TODO: merge surfaces with same uv maps and texture
-# TODO: check bounding sphere calculation
 
 
+import hashlib
 import re
-from collections import defaultdict
-from math import sqrt
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import bpy
-import mathutils
+import numpy
 
 from . import fmt_md3 as fmt
-from .utils import OffsetBytesIO
+from .bounds import frame_bounds
+from .export_cache import ENTRY_VERSION, SurfaceEntry
+from .instrument import Instrumentation
+from .surfaces import fits_limits, group_by_shaders, merge_triangles, part_names, split_triangles
+from .utils import StreamingWriter, loop_vertex_keys, unique_first_seen
+from .vcache import cache_stats, forsyth_order, renumber_vertices
 
 nums = re.compile(r'\.\d{3}$')
 
@@ -52,29 +57,123 @@ def gather_shader_info(mesh):
 
 
 def gather_vertices(mesh, uvmap_data=None):
-    md3vert_to_loop_map = []
-    loop_to_md3vert_map = []
-    index = {}
-    for i, loop in enumerate(mesh.loops):
-        key = (
-            loop.vertex_index,
-            tuple(loop.normal),
-            None if uvmap_data is None else tuple(uvmap_data[i].uv),
-        )
-        md3id = index.get(key, None)
-        if md3id is None:
-            md3id = len(md3vert_to_loop_map)
-            index[key] = md3id
-            md3vert_to_loop_map.append(i)
-        loop_to_md3vert_map.append(md3id)
-
-    return md3vert_to_loop_map, loop_to_md3vert_map
+    '''
+    Every unique (vertex index, split normal, uv) loop combination becomes md3 vertex,
+    numbered in order of first appearance
+    '''
+    n = len(mesh.loops)
+    vertex_index = numpy.empty(n, dtype=numpy.int32)
+    mesh.loops.foreach_get('vertex_index', vertex_index)
+    normals = numpy.empty(n * 3, dtype=numpy.float32)
+    mesh.loops.foreach_get('normal', normals)
+    uvs = None
+    if uvmap_data is not None:
+        uvs = numpy.empty(n * 2, dtype=numpy.float32)
+        uvmap_data.foreach_get('uv', uvs)
+
+    md3vert_to_loop_map, loop_to_md3vert_map = unique_first_seen(loop_vertex_keys(vertex_index, normals, uvs))
+    return md3vert_to_loop_map.tolist(), loop_to_md3vert_map.tolist()
 
 
 def interp(a, b, t):
     return (b - a) * t + a
 
 
+def get_co_array(data):
+    'Coordinates of mesh vertices or shape key points as (N, 3) float32 array'
+    co = numpy.empty(len(data) * 3, dtype=numpy.float32)
+    data.foreach_get('co', co)
+    return co.reshape((-1, 3))
+
+
+def get_loop_normals(mesh):
+    normals = numpy.empty(len(mesh.loops) * 3, dtype=numpy.float32)
+    mesh.loops.foreach_get('normal', normals)
+    return normals.reshape((-1, 3))
+
+
+def transform_points(matrix, co):
+    '''
+    Same as matrix * Vector(p) for every point p, including rounding:
+    mathutils multiplies in float and sums products in double
+    '''
+    m = numpy.array(matrix, dtype=numpy.float32)
+    result = numpy.empty_like(co)
+    for row in range(3):
+        dot = (m[row, 0] * co[:, 0]).astype(numpy.float64)
+        dot += m[row, 1] * co[:, 1]
+        dot += m[row, 2] * co[:, 2]
+        dot += m[row, 3]
+        result[:, row] = dot
+    return result
+
+
+VERTEX_RECORD = numpy.dtype((numpy.void, fmt.Vertex.size))
+
+
+def pack_vertices(co, normals):
+    return fmt.Vertex.pack_array(co[:, 0], co[:, 1], co[:, 2], normal=normals)
+
+
+def encode_frame(verts, layout):
+    '''
+    CPU-only part of the export of one frame, safe to run in worker threads.
+    verts is (world co, normals, reused, block) for every mesh object, block is given
+    when vertices are packed already (cached), otherwise they're packed unless reused.
+    layout is (source objects, vertex ids) for every output surface, ids number vertices
+    of all objects together, None means all vertices of the only source.
+    Returns vertex blocks of objects and of output surfaces (None for reused ones) and all points of the frame.
+    '''
+    object_blocks = [
+        block if block is not None or reused else pack_vertices(co, normals)
+        for co, normals, reused, block in verts]
+    records = None
+    blocks = []
+    for sources, ids in layout:
+        if all(verts[i][2] for i in sources):
+            blocks.append(None)
+        elif ids is None:
+            blocks.append(object_blocks[sources[0]])
+        else:
+            # vertices are packed independently, so gathering records is the same as packing gathered vertices
+            if records is None:
+                records = numpy.frombuffer(b''.join(
+                    block if block is not None else pack_vertices(co, normals)
+                    for (co, normals, _, _), block in zip(verts, object_blocks)), dtype=VERTEX_RECORD)
+            blocks.append(records[ids].tobytes())
+    points = numpy.vstack([v[0] for v in verts]) if verts else numpy.zeros((0, 3))  # issue #9
+    return object_blocks, blocks, points
+
+
+def timed_call(func, *args):
+    '''
+    Returns (seconds, result) of func, worker threads time their jobs this way
+    since instrumentation is updated on the main thread only
+    '''
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+# frames whose bounds are computed together, the whole animation is never held in memory
+BOUNDS_BATCH = 64
+
+
+class SerialExecutor:
+    'Runs submitted functions right away, for serial mode'
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
 def find_interval(vs, t):
     a, b = 0, len(vs) - 1
     if t < vs[a]:
@@ -91,9 +190,305 @@ def find_interval(vs, t):
     return a, b
 
 
+# modifiers whose result depends only on the mesh and their own settings, so unless their
+# settings are animated they give the same result at every frame
+STATIC_MODIFIERS = {
+    'TRIANGULATE',  # splits faces by their shape only
+    'SUBSURF',  # refines topology with fixed levels
+    'MULTIRES',  # sculpted displacement is stored in the mesh
+    'SOLIDIFY',  # offsets along normals of the mesh, vertex group weights are mesh data too
+    'EDGE_SPLIT',  # splits by fixed angle and sharp edge flags
+    'BEVEL',  # fixed width, limit method uses angles, weights or vertex groups of the mesh
+    'DECIMATE',  # ratio and angles are settings, collapse order comes from the mesh
+    'REMESH',  # voxelizes the mesh itself
+    'SKIN',  # radii are stored in mesh vertices
+    'MIRROR',  # static unless mirror_object is set, checked in is_deforming
+    'ARRAY',  # static unless offset object, caps or curve are set, checked in is_deforming
+}
+DEFORMING_PARENTS = {'ARMATURE', 'LATTICE', 'CURVE'}
+
+
+def is_animated(id_data, path_prefixes=None):
+    'True when id_data has an action or drivers, optionally only on paths with given prefixes'
+    anim = getattr(id_data, 'animation_data', None)
+    if anim is None:
+        return False
+    fcurves = list(anim.drivers)
+    if anim.action is not None:
+        fcurves.extend(anim.action.fcurves)
+    if path_prefixes is None:
+        return bool(fcurves) or len(anim.nla_tracks) > 0
+    return any(fcurve.data_path.startswith(path_prefixes) for fcurve in fcurves)
+
+
+def is_deforming(obj):
+    '''
+    True when the mesh of obj may change in object space during animation.
+    Otherwise it's enough to evaluate the mesh once, only its matrix may change.
+    '''
+    mesh = obj.data
+    if obj.parent is not None and obj.parent_type in DEFORMING_PARENTS:
+        return True
+    if is_animated(mesh) or (mesh.shape_keys is not None and is_animated(mesh.shape_keys)):
+        return True
+    if is_animated(obj, ('modifiers', 'data', 'show_only_shape_key')):
+        return True
+    for modifier in obj.modifiers:
+        if modifier.type not in STATIC_MODIFIERS:
+            return True
+        # mirror and array may follow other objects
+        if getattr(modifier, 'mirror_object', None) is not None:
+            return True
+        if getattr(modifier, 'offset_object', None) is not None or getattr(modifier, 'curve', None) is not None:
+            return True
+        if getattr(modifier, 'start_cap', None) is not None or getattr(modifier, 'end_cap', None) is not None:
+            return True
+    return False
+
+
+def hash_value(h, value):
+    h.update(repr(value).encode('utf-8'))
+    h.update(b'\0')
+
+
+def hash_array(h, collection, attr, size=1, dtype=numpy.float32):
+    'Attribute of every item of RNA collection, size is number of values per item'
+    data = numpy.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, data)
+    h.update(data.tobytes())
+
+
+def hash_rna(h, struct):
+    '''
+    Plain properties of RNA struct, ID blocks by name.
+    Returns referenced ID blocks, the result may depend on them.
+    '''
+    ids = []
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == 'rna_type' or prop.type == 'COLLECTION':
+            continue
+        value = getattr(struct, prop.identifier)
+        if prop.type == 'POINTER':
+            if isinstance(value, bpy.types.ID):
+                ids.append(value)
+            value = getattr(value, 'name', None)
+        elif prop.type == 'ENUM' and prop.is_enum_flag:
+            value = sorted(value)  # set order changes between sessions
+        elif getattr(prop, 'array_length', 0):
+            value = tuple(value)
+        hash_value(h, (prop.identifier, value))
+    return ids
+
+
+def hash_animation(h, id_data):
+    '''
+    Actions, NLA strips and drivers of ID block.
+    Returns objects used by drivers.
+    '''
+    objects = []
+    anim = getattr(id_data, 'animation_data', None)
+    if anim is None:
+        hash_value(h, None)
+        return objects
+    fcurves = list(anim.drivers)
+    if anim.action is not None:
+        fcurves.extend(anim.action.fcurves)
+    for track in anim.nla_tracks:
+        hash_value(h, (track.name, track.mute, track.is_solo))
+        for strip in track.strips:
+            hash_rna(h, strip)
+            if strip.action is not None:
+                fcurves.extend(strip.action.fcurves)
+    for fcurve in fcurves:
+        keys = fcurve.keyframe_points
+        hash_value(h, (fcurve.data_path, fcurve.array_index, fcurve.extrapolation, fcurve.mute))
+        hash_value(h, [(k.interpolation, k.easing) for k in keys])
+        for attr in ('co', 'handle_left', 'handle_right'):
+            hash_array(h, keys, attr, 2)
+        for modifier in fcurve.modifiers:
+            hash_rna(h, modifier)
+        driver = fcurve.driver
+        if driver is None:
+            continue
+        hash_value(h, (driver.type, driver.expression, driver.use_self))
+        for variable in driver.variables:
+            hash_value(h, (variable.name, variable.type))
+            for target in variable.targets:
+                hash_value(h, (getattr(target.id, 'name', None), target.data_path, target.bone_target,
+                               target.transform_type, target.transform_space))
+                if isinstance(target.id, bpy.types.Object):
+                    objects.append(target.id)
+    return objects
+
+
+def hash_mesh(h, mesh):
+    'Geometry, split normals, UV maps, textures and shape keys of mesh data'
+    hash_array(h, mesh.vertices, 'co', 3)
+    hash_array(h, mesh.edges, 'vertices', 2, numpy.int32)
+    hash_array(h, mesh.edges, 'use_edge_sharp', 1, numpy.bool_)
+    hash_array(h, mesh.loops, 'vertex_index', 1, numpy.int32)
+    for attr in ('loop_start', 'loop_total', 'material_index'):
+        hash_array(h, mesh.polygons, attr, 1, numpy.int32)
+    hash_array(h, mesh.polygons, 'use_smooth', 1, numpy.bool_)
+    hash_value(h, (mesh.use_auto_smooth, mesh.auto_smooth_angle, mesh.has_custom_normals))
+    if mesh.has_custom_normals:
+        # split normals are computed on a copy, data of the scene is left as it is
+        copy = mesh.copy()
+        try:
+            copy.calc_normals_split()
+            hash_array(h, copy.loops, 'normal', 3)
+        finally:
+            bpy.data.meshes.remove(copy)
+    for layer in mesh.uv_layers:
+        hash_value(h, layer.name)
+        hash_array(h, layer.data, 'uv', 2)
+    for material in mesh.materials:
+        hash_value(h, getattr(material, 'name', None))
+        for slot in getattr(material, 'texture_slots', ()):
+            if slot is not None:
+                hash_value(h, (slot.use, slot.uv_layer, slot.texture_coords,
+                               getattr(slot.texture, 'name', None), getattr(slot.texture, 'type', None)))
+    key = mesh.shape_keys
+    if key is not None:
+        hash_value(h, (key.use_relative, key.eval_time))
+        for block in key.key_blocks:
+            hash_value(h, (block.name, block.relative_key.name, block.vertex_group, block.interpolation,
+                           block.slider_min, block.slider_max, block.mute, block.frame))
+            hash_array(h, block.data, 'co', 3)
+
+
+def hash_object(h, obj):
+    '''
+    Data of obj its evaluated mesh depends on, besides the state at every frame (see frame_state).
+    Returns other ID blocks it depends on.
+    '''
+    hash_value(h, (obj.name, obj.type, obj.parent_type, obj.parent_bone))
+    objects = [obj.parent] if obj.parent is not None else []
+    objects.extend(hash_animation(h, obj))
+    data = obj.data
+    if data is not None:
+        objects.extend(hash_animation(h, data))
+    if obj.type == 'MESH':
+        hash_mesh(h, data)
+        if data.shape_keys is not None:
+            objects.extend(hash_animation(h, data.shape_keys))
+        if len(obj.vertex_groups) > 0:
+            hash_value(h, [g.name for g in obj.vertex_groups])
+            hash_value(h, [[(g.group, g.weight) for g in v.groups] for v in data.vertices])
+    elif obj.type == 'LATTICE':
+        hash_array(h, data.points, 'co_deform', 3)
+    elif obj.type == 'ARMATURE':
+        hash_array(h, data.bones, 'head_local', 3)
+        hash_array(h, data.bones, 'tail_local', 3)
+        hash_value(h, [(bone.name, bone.use_deform, tuple(v for row in bone.matrix_local for v in row))
+                       for bone in data.bones])
+    elif obj.type == 'CURVE':
+        for spline in data.splines:
+            hash_array(h, spline.points, 'co', 4)
+            hash_array(h, spline.bezier_points, 'co', 3)
+    for modifier in obj.modifiers:
+        objects.extend(hash_rna(h, modifier))
+    for constraint in obj.constraints:
+        # constraints change only matrices and poses, which are compared at every frame
+        objects.extend(o for o in hash_rna(h, constraint) if isinstance(o, bpy.types.Object))
+    return objects
+
+
+def surface_fingerprint(obj, frame_range):
+    '''
+    Hash of everything the exported surface of obj depends on,
+    except the evaluated state at every frame, which is compared separately.
+    Returns (fingerprint, objects the state depends on). Fingerprint is None when the surface
+    depends on ID blocks other than objects, e.g. texture of Displace modifier, their contents are not hashed.
+    '''
+    h = hashlib.sha1(ENTRY_VERSION.encode('ascii'))
+    hash_value(h, frame_range)
+    dependencies = []
+    queue = [obj]
+    seen = set()
+    while queue:
+        o = queue.pop(0)
+        if not isinstance(o, bpy.types.Object):
+            return None, []
+        if o.name in seen:
+            continue
+        seen.add(o.name)
+        if o is not obj:
+            dependencies.append(o)
+        queue.extend(hash_object(h, o))
+    return h.hexdigest(), dependencies
+
+
+def frame_state(obj, dependencies):
+    'Evaluated values of the current frame the surface depends on: world matrices, poses, shape key values'
+    values = []
+    for o in [obj] + dependencies:
+        values.extend(v for row in o.matrix_world for v in row)
+        if o.pose is not None:
+            values.extend(v for bone in o.pose.bones for row in bone.matrix for v in row)
+    key = obj.data.shape_keys
+    if key is not None:
+        values.append(key.eval_time)
+        values.extend(block.value for block in key.key_blocks)
+    return numpy.array(values, dtype=numpy.float64)
+
+
+class ExportSurface:
+    'Per-object state, collected while stepping through the timeline'
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.name = prepare_name(obj.name)
+        self.modifier = None
+        self.mesh = None
+        self.matrix = None
+        self.sk_rel = None
+        self.sk_abs = None
+        self.deforming = True
+        self.rigid = None  # (co, normals, frame 0 matrix, world co) for non-deforming surfaces
+        self.fingerprint = None
+        self.dependencies = []
+        self.cached = None  # SurfaceEntry of previous export
+        self.entry = None  # SurfaceEntry of this export
+        self.evaluated = False  # some frames are not taken from cache
+
+
+class OutputSurface:
+    'Surface of the output file, made of md3 vertices of one or several mesh objects'
+
+    def __init__(self, name, shader_list, sources, ids, tris):
+        self.name = name
+        self.shader_list = shader_list
+        self.sources = sources  # indices of ExportSurface
+        self.ids = ids  # md3 vertices of all objects numbered together
+        self.tris = tris  # (nTris, 3) array indexing ids
+        self.whole = False  # all vertices of the only source in their order
+        self.offset = None  # surface position in the output file
+        self.first_block = None  # first frame vertex block
+
+
 class MD3Exporter:
-    def __init__(self, context):
+    def __init__(self, context, local_origin=None, instrument=None, workers=1, vertex_cache=False,
+                 merge_surfaces=False, cache=None):
+        '''
+        local_origin: frame localOrigin, None means center of tight bounding sphere
+        instrument: Instrumentation, by default configured from environment
+        workers: threads encoding frames, serial mode by default, a pool is used only for more than 1.
+            Scene data is read on the calling thread only, output does not depend on workers.
+        vertex_cache: reorder triangles and vertices for the post-transform vertex cache
+        merge_surfaces: objects with the same shaders become one surface, it's named after the first one.
+            Surfaces exceeding MD3 vertex or triangle limits are split regardless.
+        cache: export_cache.ExportCache for incremental export, objects whose inputs and state
+            at every frame are the same as in previous export are not evaluated again
+        '''
         self.context = context
+        self.local_origin = local_origin
+        self.vertex_cache = vertex_cache
+        self.merge_surfaces = merge_surfaces
+        self.cache = cache
+        self.vertex_cache_stats = []  # (surface name, nTris, (ACMR, ATVR) before, after)
+        self.instrument = instrument if instrument is not None else Instrumentation.from_environ()
+        self.workers = max(workers, 1)
 
     @property
     def scene(self):
@@ -108,216 +503,441 @@ class MD3Exporter:
             axis=sum([tuple(m[j].xyz) for j in range(3)], ()),
         )
 
-    def pack_animated_tags(self):
-        tags_bin = []
-        for frame in range(self.nFrames):
-            self.switch_frame(frame)
-            for name in self.tagNames:
-                tags_bin.append(self.pack_tag(name))
-        return b''.join(tags_bin)
-
-    def pack_surface_shader(self, i):
-        return fmt.Shader.pack(
-            name=prepare_name(self.mesh_shader_list[i]),
-            index=i,
-        )
+    def pack_surface_shaders(self, surface):
+        n = len(surface.shader_list)
+        return fmt.Shader.pack_array(
+            name=[prepare_name(name) for name in surface.shader_list],
+            index=numpy.arange(n),
+        ) if n else b''
+
+    def get_surface_triangles(self, surface):
+        'Returns (nTris, 3) array of md3 vertex indices, as they are written'
+        mesh = surface.mesh
+        loop_total = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get('loop_total', loop_total)
+        assert (loop_total == 3).all()
+        loop_start = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+        mesh.polygons.foreach_get('loop_start', loop_start)
+        loop_to_md3vert = numpy.array(surface.loop_to_md3vert, dtype=numpy.int32)
+        a, b, c = (loop_to_md3vert[loop_start + j] for j in range(3))
+        return numpy.column_stack((a, c, b))  # swapped c/b
+
+    def optimize_vertex_cache(self, surface):
+        '''
+        Reorders triangles of the output surface for the vertex cache
+        and renumbers its vertices in order of first use, all frames follow the new numbering
+        '''
+        nVerts = len(surface.ids)
+        before = cache_stats(surface.tris)
+        surface.tris, order = renumber_vertices(surface.tris[forsyth_order(surface.tris, nVerts)], nVerts)
+        surface.ids = surface.ids[order]
+        after = cache_stats(surface.tris)
+        self.vertex_cache_stats.append((surface.name, len(surface.tris), before, after))
+        print('Surface {}: ACMR {:.3f} -> {:.3f}, ATVR {:.3f} -> {:.3f}'.format(
+            surface.name, before[0], after[0], before[1], after[1]))
+
+    def get_surface_uv(self, surface):
+        'Texture coordinates of md3 vertices as (nVerts, 2) float32 array'
+        n = len(surface.md3vert_to_loop)
+        if surface.uvmap_name is None:
+            return numpy.zeros((n, 2), dtype=numpy.float32)
+        uvdata = surface.mesh.uv_layers[surface.uvmap_name].data
+        uv = numpy.empty(len(uvdata) * 2, dtype=numpy.float32)
+        uvdata.foreach_get('uv', uv)
+        return uv.reshape((-1, 2))[surface.md3vert_to_loop]
+
+    def get_evaluated_vertices_co(self, surface):
+        'Object space coordinates of all mesh vertices in current frame'
+        mesh = surface.mesh
+        co = get_co_array(mesh.vertices)
+
+        if surface.sk_rel is not None:
+            bco = co
+            for k, value in zip(mesh.shape_keys.key_blocks, surface.sk_rel):
+                co = co + (get_co_array(k.data) - bco) * numpy.float32(value)
+        elif surface.sk_abs is not None:
+            kbs = mesh.shape_keys.key_blocks
+            a, b, t = surface.sk_abs
+            co = interp(get_co_array(kbs[a].data), get_co_array(kbs[b].data), numpy.float32(t))
 
-    def pack_surface_triangle(self, i):
-        assert self.mesh.polygons[i].loop_total == 3
-        start = self.mesh.polygons[i].loop_start
-        a, b, c = (self.mesh_loop_to_md3vert[j] for j in range(start, start + 3))
-        return fmt.Triangle.pack(a, c, b)  # swapped c/b
-
-    def get_evaluated_vertex_co(self, frame, i):
-        co = self.mesh.vertices[i].co.copy()
-
-        if self.mesh_sk_rel is not None:
-            bco = co.copy()
-            for ki, k in enumerate(self.mesh.shape_keys.key_blocks):
-                co += (k.data[i].co - bco) * self.mesh_sk_rel[ki]
-        elif self.mesh_sk_abs is not None:
-            kbs = self.mesh.shape_keys.key_blocks
-            a, b, t = self.mesh_sk_abs
-            co = interp(kbs[a].data[i].co, kbs[b].data[i].co, t)
-
-        co = self.mesh_matrix * co
-        self.mesh_vco[frame].append(co)
         return co
 
-    def pack_surface_vert(self, frame, i):
-        loop_id = self.mesh_md3vert_to_loop[i]
-        vert_id = self.mesh.loops[loop_id].vertex_index
-        return fmt.Vertex.pack(
-            *self.get_evaluated_vertex_co(frame, vert_id),
-            normal=tuple(self.mesh.loops[loop_id].normal))
-
-    def pack_surface_ST(self, i):
-        if self.mesh_uvmap_name is None:
-            s, t = 0.0, 0.0
-        else:
-            loop_idx = self.mesh_md3vert_to_loop[i]
-            s, t = self.mesh.uv_layers[self.mesh_uvmap_name].data[loop_idx].uv
-        return fmt.TexCoord.pack(s, t)
+    def extract_surface_verts(self, surface):
+        '''
+        Returns (world co, normals, reused) of md3 vertices in current frame,
+        reused is True when the first frame vertex block fits as well
+        '''
+        mesh = surface.mesh
+        loop_ids = surface.md3vert_to_loop
+        vertex_index = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+        mesh.loops.foreach_get('vertex_index', vertex_index)
+        co = self.get_evaluated_vertices_co(surface)[vertex_index[loop_ids]]
+        normals = get_loop_normals(mesh)[loop_ids]
+        world_co = transform_points(surface.matrix, co)
+        if not surface.deforming:
+            surface.rigid = (co, normals, numpy.array(surface.matrix, dtype=numpy.float32), world_co)
+        return world_co, normals, False
+
+    def extract_rigid_surface_verts(self, surface):
+        '''
+        Mesh of the surface is the same as in the first frame, only its matrix may change.
+        When the matrix is the same too, the first frame vertex block is reused.
+        '''
+        co, normals, matrix0, world_co = surface.rigid
+        surface.matrix = surface.obj.matrix_world.copy()
+        self.instrument.count('rigid surface frames')
+        if numpy.array_equal(numpy.array(surface.matrix, dtype=numpy.float32), matrix0):
+            return world_co, normals, True
+        return transform_points(surface.matrix, co), normals, False
 
     def switch_frame(self, i):
-        self.scene.frame_set(self.scene.frame_start + i)
-
-    def surface_start_frame(self, i):
-        self.switch_frame(i)
-
-        obj = self.scene.objects.active
-        self.mesh_matrix = obj.matrix_world
-        self.mesh = obj.to_mesh(self.scene, True, 'PREVIEW')
-        self.mesh.calc_normals_split()
-
-        self.mesh_sk_rel = None
-        self.mesh_sk_abs = None
-
-        shape_keys = self.mesh.shape_keys
+        with self.instrument.phase('frame_set'):
+            self.scene.frame_set(self.scene.frame_start + i)
+        self.instrument.count('frames evaluated')
+
+    def surface_start_frame(self, surface):
+        obj = surface.obj
+        surface.matrix = obj.matrix_world.copy()
+        with self.instrument.phase('to_mesh'):
+            surface.mesh = obj.to_mesh(self.scene, True, 'PREVIEW')
+            surface.mesh.calc_normals_split()
+        self.instrument.count('meshes evaluated')
+
+        surface.sk_rel = None
+        surface.sk_abs = None
+
+        shape_keys = surface.mesh.shape_keys
         if shape_keys is not None:
             kblocks = shape_keys.key_blocks
             if shape_keys.use_relative:
-                self.mesh_sk_rel = [k.value for k in kblocks]
+                surface.sk_rel = [k.value for k in kblocks]
             else:
                 e = shape_keys.eval_time / 100.0
                 a, b = find_interval([k.frame for k in kblocks], e)
                 if a is None:
-                    self.mesh_sk_abs = (b, b, 0.0)
+                    surface.sk_abs = (b, b, 0.0)
                 elif b is None:
-                    self.mesh_sk_abs = (a, a, 0.0)
+                    surface.sk_abs = (a, a, 0.0)
                 else:
-                    self.mesh_sk_abs = (a, b, (e - kblocks[a].frame) / (kblocks[b].frame - kblocks[a].frame))
-
-    def pack_surface(self, surf_name):
-        obj = self.scene.objects[surf_name]
-        self.scene.objects.active = obj
-        bpy.ops.object.modifier_add(type='TRIANGULATE')  # no 4-gons or n-gons
-        self.mesh = obj.to_mesh(self.scene, True, 'PREVIEW')
-        self.mesh.calc_normals_split()
-
-        self.mesh_uvmap_name, self.mesh_shader_list = gather_shader_info(self.mesh)
-        self.mesh_md3vert_to_loop, self.mesh_loop_to_md3vert = gather_vertices(
-            self.mesh,
-            None if self.mesh_uvmap_name is None else self.mesh.uv_layers[self.mesh_uvmap_name].data)
-
-        nShaders = len(self.mesh_shader_list)
-        nVerts = len(self.mesh_md3vert_to_loop)
-        nTris = len(self.mesh.polygons)
-
-        self.scene.frame_set(self.scene.frame_start)
-
-        f = OffsetBytesIO(start_offset=fmt.Surface.size)
-        f.mark('offShaders')
-        f.write(b''.join([self.pack_surface_shader(i) for i in range(nShaders)]))
-        f.mark('offTris')
-        f.write(b''.join([self.pack_surface_triangle(i) for i in range(nTris)]))
-        f.mark('offST')
-        f.write(b''.join([self.pack_surface_ST(i) for i in range(nVerts)]))
-        f.mark('offVerts')
-
-        self.mesh.free_normals_split()
-
-        for frame in range(self.nFrames):
-            self.surface_start_frame(frame)
-            f.write(b''.join([self.pack_surface_vert(frame, i) for i in range(nVerts)]))
-            self.mesh.free_normals_split()
-
-        f.mark('offEnd')
+                    surface.sk_abs = (a, b, (e - kblocks[a].frame) / (kblocks[b].frame - kblocks[a].frame))
+
+    def surface_end_frame(self, surface):
+        surface.mesh.free_normals_split()
+        bpy.data.meshes.remove(surface.mesh)
+        surface.mesh = None
+
+    def gather_surface_topology(self, surface):
+        'Called for the first frame, md3 vertices and static lumps are taken from it'
+        mesh = surface.mesh
+        surface.uvmap_name, surface.shader_list = gather_shader_info(mesh)
+        with self.instrument.phase('gather_vertices'):
+            surface.md3vert_to_loop, surface.loop_to_md3vert = gather_vertices(
+                mesh,
+                None if surface.uvmap_name is None else mesh.uv_layers[surface.uvmap_name].data)
+        surface.nVerts = len(surface.md3vert_to_loop)
+        surface.tris = self.get_surface_triangles(surface)
+        surface.uv = self.get_surface_uv(surface)
+
+    def build_output_surfaces(self):
+        '''
+        Called after topology of all objects is gathered.
+        Objects are merged into output surfaces, which are split to fit MD3 limits.
+        '''
+        objects = self.surfaces
+        starts = numpy.cumsum([0] + [o.nVerts for o in objects])
+        if self.merge_surfaces:
+            groups = group_by_shaders([o.shader_list for o in objects])
+        else:
+            groups = [[i] for i in range(len(objects))]
+        self.output_surfaces = outputs = []
+        for group in groups:
+            first = objects[group[0]]
+            ids = numpy.concatenate([numpy.arange(starts[i], starts[i + 1]) for i in group])
+            if len(group) == 1:
+                tris = first.tris
+            else:
+                tris = merge_triangles([objects[i].tris for i in group], [objects[i].nVerts for i in group])
+                print('Surface {}: merged {}'.format(first.name, ', '.join(objects[i].obj.name for i in group)))
+            if fits_limits(tris, len(ids)):
+                parts = [(ids, tris)]
+                names = [first.name]
+            else:
+                parts = [(ids[chunk_ids], chunk_tris) for chunk_ids, chunk_tris in split_triangles(tris)]
+                names = part_names(first.name, len(parts))
+                print('Surface {}: split into {} to fit MD3 limits'.format(first.name, ', '.join(names)))
+            for name, (part_ids, part_tris) in zip(names, parts):
+                outputs.append(OutputSurface(name, first.shader_list, group, part_ids, part_tris))
+        if len(outputs) > fmt.MAX_SURFACES:
+            print('Warning: {} surfaces, more than {} are not loaded by the engine'.format(
+                len(outputs), fmt.MAX_SURFACES))
+
+        if self.vertex_cache:
+            with self.instrument.phase('vertex_cache'):
+                for surface in outputs:
+                    self.optimize_vertex_cache(surface)
+        with self.instrument.phase('pack_static'):
+            uv = numpy.vstack([o.uv for o in objects]) if objects else numpy.zeros((0, 2), dtype=numpy.float32)
+            for surface in outputs:
+                source = surface.sources[0]
+                surface.whole = len(surface.sources) == 1 and numpy.array_equal(
+                    surface.ids, numpy.arange(starts[source], starts[source + 1]))
+                tris = surface.tris
+                st = uv[surface.ids]
+                surface.shaders_bin = self.pack_surface_shaders(surface)
+                surface.tris_bin = fmt.Triangle.pack_array(tris[:, 0], tris[:, 1], tris[:, 2])
+                surface.st_bin = fmt.TexCoord.pack_array(st[:, 0], st[:, 1])
+        self.layout = [(s.sources, None if s.whole else s.ids) for s in outputs]
+
+    def capture_frame(self, frame):
+        '''
+        Everything that is needed from the scene at given frame.
+        Encoding is queued to the worker pool, finished frames are written in order.
+        '''
+        instrument = self.instrument
+        self.switch_frame(frame)
+        with instrument.phase('pack_tags'):
+            tags_bin = b''.join([self.pack_tag(name) for name in self.tagNames])
+        verts = [self.capture_surface(surface, frame) for surface in self.surfaces]
+        instrument.count('vertices packed', sum(len(v[0]) for v in verts if not v[2] and v[3] is None))
+
+        if frame == 0:
+            for surface in self.surfaces:
+                if surface.entry is not None:
+                    surface.entry.shader_list = surface.shader_list
+                    surface.entry.tris = surface.tris
+                    surface.entry.uv = surface.uv
+                    surface.entry.md3vert_to_loop = surface.md3vert_to_loop
+            self.build_output_surfaces()
+            with instrument.phase('write'):
+                self.write_layout()
+        future = self.executor.submit(timed_call, encode_frame, verts, self.layout)
+        self.pending.append((frame, tags_bin, future))
+        # bounded queue keeps memory usage independent from the number of frames
+        while len(self.pending) > self.max_pending:
+            self.write_frame(*self.pending.popleft())
+
+    def capture_surface(self, surface, frame):
+        'Returns (world co, normals, reused, block) of the surface in current frame'
+        instrument = self.instrument
+        entry = surface.entry
+        if entry is not None:
+            with instrument.phase('frame_state'):
+                state = frame_state(surface.obj, surface.dependencies)
+            entry.states.append(state)
+            cached = surface.cached
+            if cached is not None:
+                if numpy.array_equal(state, cached.states[frame]):
+                    instrument.count('cached surface frames')
+                    entry.co.append(cached.co[frame])
+                    return cached.co[frame], None, False, cached.blocks[frame]
+                if frame == 0:
+                    # evaluated from scratch
+                    surface.cached = None
+                    surface.deforming = is_deforming(surface.obj)
+            surface.evaluated = True
+
+        if surface.rigid is not None:
+            with instrument.phase('extract_verts'):
+                verts = self.extract_rigid_surface_verts(surface)
+        else:
+            self.surface_start_frame(surface)
+            if frame == 0:
+                self.gather_surface_topology(surface)
+            with instrument.phase('extract_verts'):
+                verts = self.extract_surface_verts(surface)
+            with instrument.phase('free_mesh'):
+                self.surface_end_frame(surface)
+        if entry is not None:
+            entry.co.append(verts[0])
+        return verts + (None,)
+
+    def lookup_cache(self):
+        'Called at the first frame before the export changes objects'
+        frame_range = (self.scene.frame_start, self.scene.frame_end)
+        for surface in self.surfaces:
+            with self.instrument.phase('fingerprint'):
+                surface.fingerprint, surface.dependencies = surface_fingerprint(surface.obj, frame_range)
+            if surface.fingerprint is None:
+                print('Export cache: {} depends on data that is not fingerprinted'.format(surface.obj.name))
+                continue
+            surface.entry = SurfaceEntry(None, None, None, None)
+            cached = self.cache.get(surface.fingerprint)
+            if cached is None or not cached.complete(self.nFrames):
+                continue
+            surface.cached = cached
+            surface.shader_list = cached.shader_list
+            surface.tris = numpy.asarray(cached.tris)
+            surface.uv = numpy.asarray(cached.uv)
+            surface.md3vert_to_loop = cached.md3vert_to_loop
+            surface.nVerts = len(cached.md3vert_to_loop)
+            # frames with different state are evaluated one by one, first frame can't be reused
+            surface.deforming = True
+
+    def store_cache(self):
+        'Entries of evaluated surfaces replace previous ones'
+        stored = 0
+        for surface in self.surfaces:
+            if surface.entry is not None and surface.evaluated and surface.entry.complete(self.nFrames):
+                self.cache.put(surface.fingerprint, surface.entry)
+                stored += 1
+        print('Export cache: {} of {} surfaces evaluated'.format(stored, len(self.surfaces)))
+
+    def write_frame(self, frame, tags_bin, future):
+        # blocked only while workers are behind, encoding itself is timed by the job
+        with self.instrument.phase('wait_encoding'):
+            seconds, (object_blocks, blocks, points) = future.result()
+        self.instrument.add_time('encode', seconds)
+        for surface, block in zip(self.surfaces, object_blocks):
+            if surface.entry is not None:
+                # reused block is the first frame one
+                surface.entry.blocks.append(block if block is not None else surface.entry.blocks[0])
+        with self.instrument.phase('write'):
+            self.file.write_at(self.offsets['offTags'] + frame * len(tags_bin), tags_bin)
+            for surface, data in zip(self.output_surfaces, blocks):
+                if data is None:
+                    data = surface.first_block
+                elif frame == 0:
+                    surface.first_block = data
+                self.file.write_at(surface.offset + surface.offsets['offVerts'] + frame * len(data), data)
+        self.bounds_points.append(points)
+        if len(self.bounds_points) == BOUNDS_BATCH:
+            self.flush_bounds()
+
+    def flush_bounds(self):
+        'Bounds of queued frames at once, vertex count is the same in every frame'
+        if not self.bounds_points:
+            return
+        with self.instrument.phase('bounds'):
+            data = frame_bounds(numpy.array(self.bounds_points), self.local_origin)
+        self.frames_data.extend(
+            dict(zip(data.keys(), values)) for values in zip(*(v.tolist() for v in data.values())))
+        self.bounds_points = []
+
+    def write_surface_layout(self, surface):
+        '''
+        Writes static lumps of the surface and reserves space for its header
+        and vertices, they are filled later
+        '''
+        f = self.file
+        nVerts = len(surface.ids)
+        surface.offset = start = f.reserve(fmt.Surface.size)
+        surface.offsets = {
+            'offShaders': f.write(surface.shaders_bin) - start,
+            'offTris': f.write(surface.tris_bin) - start,
+            'offST': f.write(surface.st_bin) - start,
+            'offVerts': f.reserve(self.nFrames * nVerts * fmt.Vertex.size) - start,
+        }
+        surface.offsets['offEnd'] = f.tell() - start
+
+    def write_layout(self):
+        '''
+        Sizes of all lumps are known after the first frame,
+        so the whole file layout is decided at that point
+        '''
+        f = self.file
+        f.reserve(fmt.Header.size)
+        self.offsets = {
+            'offFrames': f.reserve(self.nFrames * fmt.Frame.size),
+            'offTags': f.reserve(self.nFrames * len(self.tagNames) * fmt.Tag.size),
+            'offSurfaces': f.tell(),
+        }
+        for surface in self.output_surfaces:
+            self.write_surface_layout(surface)
+        self.offsets['offEnd'] = f.tell()
 
-        # release here, to_mesh used for every frame
-        bpy.ops.object.modifier_remove(modifier=obj.modifiers[-1].name)
+    def pack_surface_header(self, surface):
+        nShaders = len(surface.shader_list)
+        nVerts = len(surface.ids)
+        nTris = len(surface.tris)
 
         print('Surface {}: nVerts={}{} nTris={}{} nShaders={}{}'.format(
-            surf_name,
-            nVerts, ' (Too many!)' if nVerts > 4096 else '',
-            nTris, ' (Too many!)' if nTris > 8192 else '',
-            nShaders, ' (Too many!)' if nShaders > 256 else '',
+            surface.name,
+            nVerts, ' (Too many!)' if nVerts > fmt.MAX_VERTS else '',
+            nTris, ' (Too many!)' if nTris > fmt.MAX_TRIANGLES else '',
+            nShaders, ' (Too many!)' if nShaders > fmt.MAX_SHADERS else '',
         ))
 
         return fmt.Surface.pack(
             magic=fmt.MAGIC,
-            name=prepare_name(obj.name),
+            name=surface.name,
             flags=0,  # ignored
             nFrames=self.nFrames,
             nShaders=nShaders,
             nVerts=nVerts,
             nTris=nTris,
-            **f.getoffsets()
-        ) + f.getvalue()
-
-    def get_frame_data(self, i):
-        center = mathutils.Vector((0.0, 0.0, 0.0))
-        x1, x2, y1, y2, z1, z2 = [0.0] * 6
-        first = True
-        for co in self.mesh_vco[i]:
-            if first:
-                x1, x2 = co.x, co.x
-                y1, y2 = co.y, co.y
-                z1, z2 = co.z, co.z
-            else:
-                x1, y1, z1 = min(co.x, x1), min(co.y, y1), min(co.z, z1)
-                x2, y2, z2 = max(co.x, x2), max(co.y, y2), max(co.z, z2)
-            first = False
-            center += co
-        if len(self.mesh_vco[i]):  # issue #9
-            center /= len(self.mesh_vco[i])  # TODO: can be very distorted
-        r = 0.0
-        for co in self.mesh_vco[i]:
-            r = max(r, (co - center).length_squared)
-        r = sqrt(r)
-        return {
-            'minBounds': (x1, y1, z1),
-            'maxBounds': (x2, y2, z2),
-            'radius': r,  # TODO: not sure the radius is measured from center, and not localOrigin
-        }
+            **surface.offsets
+        )
 
     def pack_frame(self, i):
         return fmt.Frame.pack(
-            localOrigin=(0.0, 0.0, 0.0),
             name='',  # frame name, ignored, TODO:
-            **self.get_frame_data(i)
+            **self.frames_data[i]
         )
 
     def __call__(self, filename):
         self.nFrames = self.scene.frame_end - self.scene.frame_start + 1
-        self.surfNames = []
+        self.surfaces = []
+        self.output_surfaces = []
+        self.layout = []
         self.tagNames = []
         for o in self.scene.objects:
             if o.hide:  # skip hidden objects
                 continue
             if o.type == 'MESH':
-                self.surfNames.append(o.name)
+                self.surfaces.append(ExportSurface(o))
             elif o.type == 'EMPTY' and o.empty_draw_type == 'ARROWS':
                 self.tagNames.append(o.name)
-        self.mesh_vco = defaultdict(list)
-
-        tags_bin = self.pack_animated_tags()
-        surfaces_bin = [self.pack_surface(name) for name in self.surfNames]
-        frames_bin = [self.pack_frame(i) for i in range(self.nFrames)]
+        self.frames_data = []
+        self.bounds_points = []
+        self.pending = deque()
+        self.max_pending = 2 * self.workers
+        self.executor = ThreadPoolExecutor(self.workers) if self.workers > 1 else SerialExecutor()
 
-        if len(surfaces_bin) == 0:
+        if len(self.surfaces) == 0:
             print("WARNING: There're no visible surfaces to export")
 
-        f = OffsetBytesIO(start_offset=fmt.Header.size)
-        f.mark('offFrames')
-        f.write(b''.join(frames_bin))
-        f.mark('offTags')
-        f.write(tags_bin)
-        f.mark('offSurfaces')
-        f.write(b''.join(surfaces_bin))
-        f.mark('offEnd')
-
-        with open(filename, 'wb') as file:
-            file.write(fmt.Header.pack(
-                magic=fmt.MAGIC,
-                version=fmt.VERSION,
-                modelname=self.scene.name,
-                flags=0,  # ignored
-                nFrames=self.nFrames,
-                nTags=len(self.tagNames),
-                nSurfaces=len(surfaces_bin),
-                nSkins=0,  # count of skins, ignored
-                **f.getoffsets()
-            ))
-            file.write(f.getvalue())
-            print('nFrames={} nSurfaces={}'.format(self.nFrames, len(surfaces_bin)))
+        with self.instrument.capture(), StreamingWriter(filename) as self.file:
+            # timeline is stepped through only once, all surfaces and tags are captured at every frame
+            try:
+                for surface in self.surfaces:
+                    surface.deforming = is_deforming(surface.obj)
+                if self.cache is not None:
+                    self.switch_frame(0)
+                    self.lookup_cache()
+                for surface in self.surfaces:
+                    surface.modifier = surface.obj.modifiers.new('Triangulate', 'TRIANGULATE')  # no 4-gons or n-gons
+                for frame in range(self.nFrames):
+                    self.capture_frame(frame)
+                while self.pending:
+                    self.write_frame(*self.pending.popleft())
+                self.flush_bounds()
+            finally:
+                self.executor.shutdown()
+                for surface in self.surfaces:
+                    if surface.mesh is not None:
+                        self.surface_end_frame(surface)
+                    if surface.modifier is not None:
+                        surface.obj.modifiers.remove(surface.modifier)
+                        surface.modifier = None
+
+            with self.instrument.phase('write'):
+                self.file.write_at(
+                    self.offsets['offFrames'], b''.join([self.pack_frame(i) for i in range(self.nFrames)]))
+                for surface in self.output_surfaces:
+                    self.file.write_at(surface.offset, self.pack_surface_header(surface))
+                self.file.write_at(0, fmt.Header.pack(
+                    magic=fmt.MAGIC,
+                    version=fmt.VERSION,
+                    modelname=self.scene.name,
+                    flags=0,  # ignored
+                    nFrames=self.nFrames,
+                    nTags=len(self.tagNames),
+                    nSurfaces=len(self.output_surfaces),
+                    nSkins=0,  # count of skins, ignored
+                    **self.offsets
+                ))
+        if self.cache is not None:
+            self.store_cache()
+        print('nFrames={} nSurfaces={}'.format(self.nFrames, len(self.output_surfaces)))
+        if self.instrument.enabled:
+            print('\n'.join(self.instrument.report_lines()))
@@ -1,16 +1,28 @@
 from math import pi, sin, cos, atan2, acos
 
-from .utils import AnyStruct
+import numpy
+
+from .utils import AnyStruct, noop
+from .normals import decode_normals, encode_normals
 
 
 def string_from_bytes(b):
     return b.rstrip(b'\0').decode('utf-8', errors='ignore')
 
 
+def strings_from_bytes(a):
+    # numpy bytes arrays already have trailing zeros stripped
+    return numpy.char.decode(a, 'utf-8', 'ignore')
+
+
 def string_to_bytes(s):
     return s.encode('utf-8')
 
 
+def strings_to_bytes(a):
+    return numpy.char.encode(numpy.asarray(a, dtype=str), 'utf-8')
+
+
 def decode_normal(b):
     lat = b[0] / 255.0 * 2 * pi
     lon = b[1] / 255.0 * 2 * pi
@@ -40,14 +52,27 @@ def encode_vertex(v):
     return int(v * VERTEX_SCALE)
 
 
+def encode_vertex_array(v):
+    return numpy.trunc(numpy.asarray(v, dtype=numpy.float64) * VERTEX_SCALE)
+
+
 def texcoord_inverted(v):
     return 1.0 - v
 
 
+# columns are widened before inverting, so arrays hold the same values as scalar unpack
+def texcoord_array(v):
+    return numpy.asarray(v, dtype=numpy.float64)
+
+
+def texcoord_inverted_array(v):
+    return 1.0 - numpy.asarray(v, dtype=numpy.float64)
+
+
 Header = AnyStruct('Header', (
     ('magic', '4s'),
     ('version', 'i'),
-    ('modelname', '64s', 1, string_from_bytes, string_to_bytes),
+    ('modelname', '64s', 1, string_from_bytes, string_to_bytes, strings_from_bytes, strings_to_bytes),
     ('flags', 'i'),
     ('nFrames', 'i'),
     ('nTags', 'i'),
@@ -61,7 +86,7 @@ Header = AnyStruct('Header', (
 
 Surface = AnyStruct('Surface', (
     ('magic', '4s'),
-    ('name', '64s', 1, string_from_bytes, string_to_bytes),
+    ('name', '64s', 1, string_from_bytes, string_to_bytes, strings_from_bytes, strings_to_bytes),
     ('flags', 'i'),
     ('nFrames', 'i'),
     ('nShaders', 'i'),
@@ -79,17 +104,17 @@ Frame = AnyStruct('Frame', (
     ('maxBounds', '3f', 3),
     ('localOrigin', '3f', 3),
     ('radius', 'f'),
-    ('name', '16s', 1, string_from_bytes, string_to_bytes),
+    ('name', '16s', 1, string_from_bytes, string_to_bytes, strings_from_bytes, strings_to_bytes),
 ))
 
 Tag = AnyStruct('Tag', (
-    ('name', '64s', 1, string_from_bytes, string_to_bytes),
+    ('name', '64s', 1, string_from_bytes, string_to_bytes, strings_from_bytes, strings_to_bytes),
     ('origin', '3f', 3),
     ('axis', '9f', 9),
 ))
 
 Shader = AnyStruct('Shader', (
-    ('name', '64s', 1, string_from_bytes, string_to_bytes),
+    ('name', '64s', 1, string_from_bytes, string_to_bytes, strings_from_bytes, strings_to_bytes),
     ('index', 'i'),
 ))
 
@@ -100,17 +125,26 @@ Triangle = AnyStruct('Triangle', (
 ))
 
 TexCoord = AnyStruct('TexCoord', (
-    ('s', 'f'),
-    ('t', 'f', 1, texcoord_inverted, texcoord_inverted),
+    ('s', 'f', 1, noop, noop, texcoord_array),
+    ('t', 'f', 1, texcoord_inverted, texcoord_inverted, texcoord_inverted_array),
 ))
 
 Vertex = AnyStruct('Vertex', (
-    ('x', 'h', 1, decode_vertex, encode_vertex),
-    ('y', 'h', 1, decode_vertex, encode_vertex),
-    ('z', 'h', 1, decode_vertex, encode_vertex),
-    ('normal', '2s', 1, decode_normal, encode_normal),
+    ('x', 'h', 1, decode_vertex, encode_vertex, decode_vertex, encode_vertex_array),
+    ('y', 'h', 1, decode_vertex, encode_vertex, decode_vertex, encode_vertex_array),
+    ('z', 'h', 1, decode_vertex, encode_vertex, decode_vertex, encode_vertex_array),
+    ('normal', '2B', 2, decode_normal, encode_normal, decode_normals, encode_normals),
 ))
 
 
 MAGIC = b'IDP3'
 VERSION = 15
+
+# engine limits
+MAX_FRAMES = 1024
+MAX_TAGS = 16
+MAX_SURFACES = 32
+MAX_SHADERS = 256
+MAX_VERTS = 4096
+MAX_TRIANGLES = 8192
+MAX_QPATH = 64  # size of name fields, including terminating zero
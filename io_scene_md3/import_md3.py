@@ -5,29 +5,19 @@
 
 import bpy
 import mathutils
+import numpy
 import os.path
+import posixpath
+import re
 
 from . import fmt_md3 as fmt
-
-
-def guess_texture_filepath(modelpath, imagepath):
-    fileexts = ('', '.png', '.tga', '.jpg', '.jpeg')
-    modelpath = os.path.normpath(os.path.normcase(modelpath))
-    modeldir, _ = os.path.split(modelpath)
-    imagedir, imagename = os.path.split(os.path.normpath(os.path.normcase(imagepath)))
-    previp = None
-    ip = imagedir
-    while ip != previp:
-        if ip in modeldir:
-            pos = modeldir.rfind(ip)
-            nameguess = os.path.join(modeldir[:pos + len(ip)], imagedir[len(ip):], imagename)
-            for ext in fileexts:
-                yield nameguess + ext
-        previp = ip
-        ip, _ = os.path.split(ip)
-    nameguess = os.path.join(modeldir, imagename)
-    for ext in fileexts:
-        yield nameguess + ext
+from .animation import ANIMATION_CFG, find_sequences, model_sequences, parse_animation_cfg, select_frames
+from .cache import load_model
+from .instrument import Instrumentation
+from .md3file import MD3File
+from .pk3 import archive_indexes, split_archive_path
+from .pointcache import write_mdd, write_pc2
+from .textures import directory_index
 
 
 def get_tag_matrix_basis(data):
@@ -38,26 +28,92 @@ def get_tag_matrix_basis(data):
     return basis
 
 
+def get_tag_quaternions(axis):
+    '''
+    Vectorized equivalent of assigning tag matrices to matrix_basis
+    of an object in quaternion rotation mode, returns (N, 4) array of (w, x, y, z)
+    '''
+    m = axis.reshape((-1, 3, 3)).astype(numpy.float64)  # m[i, column, row] like blender's float[3][3]
+    norms = numpy.sqrt((m * m).sum(axis=2))
+    norms[norms == 0.0] = 1.0
+    m /= norms[:, :, numpy.newaxis]
+    m[numpy.linalg.det(m) < 0.0] *= -1.0  # same as mat4_to_loc_rot_size does
+
+    q = numpy.empty((len(m), 4))
+    tr = 0.25 * (1.0 + m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2])
+
+    # branches follow mat3_normalized_to_quat
+    c = tr > 1e-4
+    s = numpy.sqrt(tr[c])
+    q[c, 0] = s
+    s = 1.0 / (4.0 * s)
+    q[c, 1] = (m[c, 1, 2] - m[c, 2, 1]) * s
+    q[c, 2] = (m[c, 2, 0] - m[c, 0, 2]) * s
+    q[c, 3] = (m[c, 0, 1] - m[c, 1, 0]) * s
+    rest = ~c
+
+    c = rest & (m[:, 0, 0] > m[:, 1, 1]) & (m[:, 0, 0] > m[:, 2, 2])
+    s = 2.0 * numpy.sqrt(1.0 + m[c, 0, 0] - m[c, 1, 1] - m[c, 2, 2])
+    q[c, 1] = 0.25 * s
+    s = 1.0 / s
+    q[c, 0] = (m[c, 1, 2] - m[c, 2, 1]) * s
+    q[c, 2] = (m[c, 1, 0] + m[c, 0, 1]) * s
+    q[c, 3] = (m[c, 2, 0] + m[c, 0, 2]) * s
+    rest &= ~c
+
+    c = rest & (m[:, 1, 1] > m[:, 2, 2])
+    s = 2.0 * numpy.sqrt(1.0 + m[c, 1, 1] - m[c, 0, 0] - m[c, 2, 2])
+    q[c, 2] = 0.25 * s
+    s = 1.0 / s
+    q[c, 0] = (m[c, 2, 0] - m[c, 0, 2]) * s
+    q[c, 1] = (m[c, 1, 0] + m[c, 0, 1]) * s
+    q[c, 3] = (m[c, 2, 1] + m[c, 1, 2]) * s
+    c = rest & ~c
+
+    s = 2.0 * numpy.sqrt(1.0 + m[c, 2, 2] - m[c, 0, 0] - m[c, 1, 1])
+    q[c, 3] = 0.25 * s
+    s = 1.0 / s
+    q[c, 0] = (m[c, 0, 1] - m[c, 1, 0]) * s
+    q[c, 1] = (m[c, 2, 0] + m[c, 0, 2]) * s
+    q[c, 2] = (m[c, 2, 1] + m[c, 1, 2]) * s
+
+    return q / numpy.sqrt((q * q).sum(axis=1))[:, numpy.newaxis]
+
+
+def fill_fcurve(fcurve, frames, values):
+    'Inserts all keyframes at once, equivalent of keyframe_insert for every frame'
+    points = fcurve.keyframe_points
+    points.add(len(frames))
+    points.foreach_set('co', numpy.column_stack((frames, values)).astype(numpy.float32).ravel())
+    fcurve.update()  # sorting and handles recalculation
+
+
 class MD3Importer:
-    def __init__(self, context):
+    def __init__(self, context, instrument=None, cache=None, frame_start=0, frame_end=-1, frame_stride=1,
+                 sequences='', vertex_animation='SHAPE_KEYS'):
+        '''
+        instrument: Instrumentation, by default configured from environment
+        cache: DecodeCache of decoded models, None to decode the file every time
+        frame_start, frame_end, frame_stride: frames to import, negative end counts from the last frame
+        sequences: comma separated animation names from animation.cfg next to the model, e.g. "LEGS_RUN, LEGS_JUMP".
+            Other frames are not decoded, imported ones keep their numbers on the timeline.
+        vertex_animation: 'SHAPE_KEYS', or 'PC2' and 'MDD' to write frames to point cache files
+            next to the model, read by Mesh Cache modifiers
+        '''
         self.context = context
+        self.instrument = instrument if instrument is not None else Instrumentation.from_environ()
+        self.cache = cache
+        self.frame_start = frame_start
+        self.frame_end = frame_end
+        self.frame_stride = frame_stride
+        self.sequences = sequences
+        self.vertex_animation = vertex_animation
 
     @property
     def scene(self):
         return self.context.scene
 
-    def read_n_items(self, n, offset, func):
-        self.file.seek(offset)
-        return [func(i) for i in range(n)]
-
-    def unpack(self, rtype):
-        return rtype.funpack(self.file)
-
-    def read_frame(self, i):
-        return self.unpack(fmt.Frame)
-
-    def create_tag(self, i):
-        data = self.unpack(fmt.Tag)
+    def create_tag(self, data):
         bpy.ops.object.add(type='EMPTY')
         tag = bpy.context.object
         tag.name = data.name
@@ -66,145 +122,278 @@ class MD3Importer:
         tag.matrix_basis = get_tag_matrix_basis(data)
         return tag
 
-    def read_tag_frame(self, i):
-        tag = self.tags[i % self.header.nTags]
-        data = self.unpack(fmt.Tag)
-        tag.matrix_basis = get_tag_matrix_basis(data)
-        frame = i // self.header.nTags
-        tag.keyframe_insert('location', frame=frame, group='LocRot')
-        tag.keyframe_insert('rotation_quaternion', frame=frame, group='LocRot')
-
-    def read_surface_triangle(self, i):
-        data = self.unpack(fmt.Triangle)
-        ls = i * 3
-        self.mesh.loops[ls].vertex_index = data.a
-        self.mesh.loops[ls + 1].vertex_index = data.c  # swapped
-        self.mesh.loops[ls + 2].vertex_index = data.b  # swapped
-        self.mesh.polygons[i].loop_start = ls
-        self.mesh.polygons[i].loop_total = 3
-        self.mesh.polygons[i].use_smooth = True
-
-    def read_surface_vert(self, i):
-        data = self.unpack(fmt.Vertex)
-        self.verts[i].co = mathutils.Vector((data.x, data.y, data.z))
-        # ignoring data.normal here
-
-    def read_surface_normals(self, i):
-        data = self.unpack(fmt.Vertex)
-        self.mesh.vertices[i].normal = mathutils.Vector(data.normal)
-
-    def read_mesh_animation(self, obj, data, start_pos):
+    def read_tag_animation(self, data):
+        'data contains tags of all frames'
+        nTags = self.header.nTags
+        frames = numpy.array(self.frame_numbers, dtype=numpy.float32)
+        quats = get_tag_quaternions(data.axis)
+        for t, tag in enumerate(self.tags):
+            tag.animation_data_create()
+            action = bpy.data.actions.new(tag.name + 'Action')
+            tag.animation_data.action = action
+            for i in range(3):
+                fill_fcurve(action.fcurves.new('location', i, 'LocRot'), frames, data.origin[t::nTags, i])
+            for i in range(4):
+                fill_fcurve(action.fcurves.new('rotation_quaternion', i, 'LocRot'), frames, quats[t::nTags, i])
+
+    def set_surface_triangles(self, tris):
+        'Returns vertex index of every loop'
+        n = len(tris.a)
+        loops = numpy.column_stack((tris.a, tris.c, tris.b)).ravel()  # swapped c/b
+        self.mesh.loops.foreach_set('vertex_index', loops)
+        self.mesh.polygons.foreach_set('loop_start', numpy.arange(0, n * 3, 3, dtype=numpy.int32))
+        self.mesh.polygons.foreach_set('loop_total', numpy.full(n, 3, dtype=numpy.int32))
+        self.mesh.polygons.foreach_set('use_smooth', [True] * n)
+        return loops
+
+    def set_surface_verts(self, verts, cos):
+        verts.foreach_set('co', cos.ravel())
+        # ignoring normals here
+
+    def read_mesh_animation(self, obj, positions):
         obj.shape_key_add(name=self.frames[0].name)  # adding first frame, which is already loaded
         self.mesh.shape_keys.use_relative = False
         # TODO: ensure MD3 has linear frame interpolation
-        for frame in range(1, data.nFrames):  # first frame skipped
-            shape_key = obj.shape_key_add(name=self.frames[frame].name)
-            self.verts = shape_key.data
-            self.read_n_items(
-                data.nVerts,
-                start_pos + data.offVerts + frame * fmt.Vertex.size * data.nVerts,
-                self.read_surface_vert)
+        for frame in range(1, len(positions)):  # first frame skipped
+            # from_mix=False: mixing all previous keys is useless, data is overwritten anyway
+            shape_key = obj.shape_key_add(name=self.frames[frame].name, from_mix=False)
+            self.set_surface_verts(shape_key.data, positions[frame])
         self.scene.objects.active = obj
         self.context.object.active_shape_key_index = 0
         bpy.ops.object.shape_key_retime()
-        for frame in range(data.nFrames):
-            self.mesh.shape_keys.eval_time = 10.0 * (frame + 1)
-            self.mesh.shape_keys.keyframe_insert('eval_time', frame=frame)
-
-    def read_surface_ST(self, i):
-        data = self.unpack(fmt.TexCoord)
-        return (data.s, data.t)
-
-    def make_surface_UV_map(self, uv, uvdata):
-        for poly in self.mesh.polygons:
-            for i in range(poly.loop_start, poly.loop_start + poly.loop_total):
-                vidx = self.mesh.loops[i].vertex_index
-                uvdata[i].uv = uv[vidx]
 
-    def read_surface_shader(self, i):
-        data = self.unpack(fmt.Shader)
-
-        texture = bpy.data.textures.new(data.name, 'IMAGE')
+        shape_keys = self.mesh.shape_keys
+        shape_keys.animation_data_create()
+        shape_keys.animation_data.action = bpy.data.actions.new(shape_keys.name + 'Action')
+        keys = numpy.arange(len(positions), dtype=numpy.float32)
+        fill_fcurve(
+            shape_keys.animation_data.action.fcurves.new('eval_time'),
+            numpy.array(self.frame_numbers, dtype=numpy.float32), 10.0 * (keys + 1))
+
+    def get_mesh_cache_path(self, index, name):
+        'Next to the model, models inside archives use the same path as if they were extracted'
+        directory, basename = os.path.split(self.texture_modelpath)
+        return os.path.join(directory, '{}_{}_{}.{}'.format(
+            os.path.splitext(basename)[0], index, re.sub(r'[^\w.-]', '_', name), self.vertex_animation.lower()))
+
+    def read_mesh_cache(self, obj, positions, index):
+        'Frames go to a point cache file, Mesh Cache modifier streams them from disk'
+        filepath = self.get_mesh_cache_path(index, obj.name)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        if self.vertex_animation == 'MDD':
+            write_mdd(filepath, positions, numpy.array(self.frame_numbers) / float(self.scene.render.fps))
+        else:
+            write_pc2(filepath, positions, self.frame_numbers[0])
+        self.instrument.count('point cache bytes', os.path.getsize(filepath))
+
+        modifier = obj.modifiers.new('MeshCache', 'MESH_CACHE')
+        modifier.cache_format = self.vertex_animation
+        modifier.filepath = filepath
+        modifier.forward_axis = 'POS_Y'  # no axis conversion
+        modifier.up_axis = 'POS_Z'
+        modifier.interpolation = 'LINEAR'
+        modifier.time_mode = 'FRAME'
+        modifier.play_mode = 'CUSTOM'
+        # like eval_time of shape keys, frame is keyed at its number on the timeline
+        obj.animation_data_create()
+        obj.animation_data.action = bpy.data.actions.new(obj.name + 'Action')
+        fill_fcurve(
+            obj.animation_data.action.fcurves.new('modifiers["{}"].eval_frame'.format(modifier.name)),
+            numpy.array(self.frame_numbers, dtype=numpy.float32),
+            numpy.arange(len(positions), dtype=numpy.float32))
+
+    def make_surface_UV_map(self, uv, uvdata, loops):
+        # float32 buffer is copied directly, other types go through slow per-item conversion
+        uvdata.foreach_set('uv', uv[loops].ravel().astype(numpy.float32))
+
+    def get_image(self, filepath):
+        image = self.images.get(filepath)
+        if image is None:
+            image = self.images[filepath] = bpy.data.images.load(filepath)
+            self.instrument.count('images loaded')
+        return image
+
+    def get_archive_image(self, archive, member):
+        'Image is packed into .blend, its filepath points into the archive'
+        filepath = os.path.join(archive.path, member)
+        image = self.images.get(filepath)
+        if image is None:
+            data = bytes(archive.read(member))
+            image = self.images[filepath] = bpy.data.images.new(posixpath.basename(member), 1, 1)
+            image.pack(data=data, data_len=len(data))
+            image.source = 'FILE'
+            image.filepath_raw = filepath
+            self.instrument.count('images loaded')
+        return image
+
+    def find_image(self, name):
+        'Archives of the game directory are searched first, then files on disk, like the engine does'
+        if self.archives is not None:
+            found = self.archives.find(name)
+            if found is None:  # some models refer to textures by name only
+                found = self.archives.find(posixpath.join(
+                    posixpath.dirname(self.member), posixpath.basename(name.replace('\\', '/'))))
+            if found is not None:
+                return self.get_archive_image(*found)
+        scans = directory_index.scans
+        filepath = directory_index.find_texture(self.texture_modelpath, name)
+        self.instrument.count('directory scans', directory_index.scans - scans)
+        if filepath is not None:
+            return self.get_image(filepath)
+        return None
+
+    def get_texture(self, name):
+        'Textures are shared by all surfaces and imports using the same shader name'
+        texture = bpy.data.textures.get(name)
+        if texture is not None and texture.type == 'IMAGE':
+            return texture
+        texture = bpy.data.textures.new(name, 'IMAGE')
+        image = self.find_image(name)
+        if image is not None:
+            texture.image = image
+        return texture
+
+    def read_surface_shader(self, i, data):
         texture_slot = self.material.texture_slots.create(i)
         texture_slot.uv_layer = 'UVMap'
         texture_slot.use = True
         texture_slot.texture_coords = 'UV'
-        texture_slot.texture = texture
-
-        for fname in guess_texture_filepath(self.filename, data.name):
-            if '\0' in fname:  # preventing ValueError: embedded null byte
-                continue
-            if os.path.isfile(fname):
-                image = bpy.data.images.load(fname)
-                texture.image = image
-                break
-
-    def read_surface(self, i):
-        start_pos = self.file.tell()
+        texture_slot.texture = self.get_texture(data.name)
 
-        data = self.unpack(fmt.Surface)
-        assert data.magic == b'IDP3'
+    def read_surface(self, surface, index=0):
+        data = surface.header
         assert data.nFrames == self.header.nFrames
-        assert data.nShaders <= 256
-        if data.nVerts > 4096:
+        assert data.nShaders <= fmt.MAX_SHADERS
+        if data.nVerts > fmt.MAX_VERTS:
             print('Warning: md3 surface contains too many vertices')
-        if data.nTris > 8192:
+        if data.nTris > fmt.MAX_TRIANGLES:
             print('Warning: md3 surface contains too many triangles')
 
-        self.mesh = bpy.data.meshes.new(data.name)
-        self.mesh.vertices.add(count=data.nVerts)
-        self.mesh.polygons.add(count=data.nTris)
-        self.mesh.loops.add(count=data.nTris * 3)
+        instrument = self.instrument
+        instrument.count('surfaces')
+        tris = surface.triangles
+        positions = surface.positions()
+        instrument.count('vertices', data.nVerts * len(positions))
+        st = surface.texcoords
 
-        self.read_n_items(data.nTris, start_pos + data.offTris, self.read_surface_triangle)
-        self.verts = self.mesh.vertices
-        self.read_n_items(data.nVerts, start_pos + data.offVerts, self.read_surface_vert)
+        with instrument.phase('mesh'):
+            self.mesh = bpy.data.meshes.new(data.name)
+            self.mesh.vertices.add(count=data.nVerts)
+            self.mesh.polygons.add(count=data.nTris)
+            self.mesh.loops.add(count=data.nTris * 3)
 
-        self.mesh.validate()
-        self.mesh.calc_normals()
+            loops = self.set_surface_triangles(tris)
+            self.set_surface_verts(self.mesh.vertices, positions[0])
 
-        self.material = bpy.data.materials.new('Main')
-        self.mesh.materials.append(self.material)
+            self.mesh.validate()
+            self.mesh.calc_normals()
 
-        self.mesh.uv_textures.new('UVMap')
-        self.make_surface_UV_map(
-            self.read_n_items(data.nVerts, start_pos + data.offST, self.read_surface_ST),
-            self.mesh.uv_layers['UVMap'].data)
+            self.material = bpy.data.materials.new('Main')
+            self.mesh.materials.append(self.material)
 
-        self.read_n_items(data.nShaders, start_pos + data.offShaders, self.read_surface_shader)
+            self.mesh.uv_textures.new('UVMap')
+            self.make_surface_UV_map(
+                numpy.column_stack((st.s, st.t)),
+                self.mesh.uv_layers['UVMap'].data,
+                loops)
+
+        with instrument.phase('textures'):
+            for i, shader in enumerate(surface.shaders):
+                self.read_surface_shader(i, shader)
 
         obj = bpy.data.objects.new(data.name, self.mesh)
         self.scene.objects.link(obj)
 
-        if data.nFrames > 1:
-            self.read_mesh_animation(obj, data, start_pos)
-
-        self.file.seek(start_pos + data.offEnd)
+        if len(positions) > 1 and self.vertex_animation != 'SHAPE_KEYS':
+            with instrument.phase('mesh_cache'):
+                self.read_mesh_cache(obj, positions, index)
+        elif len(positions) > 1:
+            with instrument.phase('shape_keys'):
+                self.read_mesh_animation(obj, positions)
 
     def post_settings(self):
-        self.scene.frame_set(0)
+        self.scene.frame_set(self.frame_numbers[0])
         self.scene.game_settings.material_mode = 'GLSL'  # TODO: questionable
         bpy.ops.object.lamp_add(type='SUN')  # TODO: questionable
 
+    def open_archive(self, filename):
+        '''
+        When the model is inside a .pk3, indexes archives of its game directory
+        and returns contents of the model, otherwise returns None
+        '''
+        self.archives = None
+        self.member = None
+        self.texture_modelpath = filename
+        archive_path, member = split_archive_path(filename)
+        if archive_path is None:
+            return None
+        game_directory = os.path.dirname(archive_path)
+        self.archives = archive_indexes.get(game_directory)
+        archive = self.archives.get_archive(archive_path)
+        if archive is None:
+            raise ValueError('Can not read archive {}'.format(archive_path))
+        self.member = member
+        # loose files are searched as if the archive was extracted to the game directory
+        self.texture_modelpath = os.path.join(game_directory, member)
+        return archive.read(member)
+
+    def read_animation_cfg(self):
+        'Text of animation.cfg next to the model'
+        if self.member is not None:
+            found = self.archives.find(posixpath.join(posixpath.dirname(self.member), ANIMATION_CFG), ('',))
+            if found is not None:
+                return bytes(found[0].read(found[1])).decode('latin-1')
+        filepath = os.path.join(os.path.dirname(self.texture_modelpath), ANIMATION_CFG)
+        try:
+            with open(filepath, 'rb') as f:
+                return f.read().decode('latin-1')
+        except OSError:
+            raise ValueError('{} is not found next to the model'.format(ANIMATION_CFG))
+
+    def select_frames(self, filename, nFrames):
+        'Numbers of frames to import, None means all'
+        sequences = ()
+        if self.sequences.strip():
+            sequences = find_sequences(
+                model_sequences(parse_animation_cfg(self.read_animation_cfg()), filename), self.sequences)
+        frames = select_frames(nFrames, self.frame_start, self.frame_end, self.frame_stride, sequences)
+        return None if frames == list(range(nFrames)) else frames
+
     def __call__(self, filename):
         self.filename = filename
-        with open(filename, 'rb') as file:
-            self.file = file
-
-            self.header = self.unpack(fmt.Header)
-            assert self.header.magic == fmt.MAGIC
-            assert self.header.version == fmt.VERSION
+        self.images = {
+            os.path.normpath(bpy.path.abspath(image.filepath)): image
+            for image in bpy.data.images if image.filepath}
+        instrument = self.instrument
+        with instrument.capture():
+            with instrument.phase('decode'):
+                buffer = self.open_archive(filename)
+                with MD3File(filename, buffer) as md3:
+                    frames = self.select_frames(filename, md3.header.nFrames)
+                hits = self.cache.hits if self.cache is not None else 0
+                md3 = load_model(filename, self.cache, buffer, frames)
+                if self.cache is not None:
+                    instrument.count('cache hits', self.cache.hits - hits)
+                if isinstance(buffer, memoryview):
+                    buffer.release()  # lets the archive be closed later
+            self.header = md3.header
+            self.frame_numbers = md3.frame_numbers
+            instrument.count('frames', len(self.frame_numbers))
 
             bpy.ops.scene.new()
             self.scene.name = self.header.modelname
             # TODO: start from 1?
-            self.scene.frame_start = 0
-            self.scene.frame_end = self.header.nFrames - 1
-
-            self.frames = self.read_n_items(self.header.nFrames, self.header.offFrames, self.read_frame)
-            self.tags = self.read_n_items(self.header.nTags, self.header.offTags, self.create_tag)
-            if self.header.nFrames > 1:
-                self.read_n_items(self.header.nTags * self.header.nFrames, self.header.offTags, self.read_tag_frame)
-            self.read_n_items(self.header.nSurfaces, self.header.offSurfaces, self.read_surface)
-
-        self.post_settings()
+            self.scene.frame_start = self.frame_numbers[0]
+            self.scene.frame_end = self.frame_numbers[-1]
+
+            self.frames = md3.frames
+            with instrument.phase('tags'):
+                self.tags = [self.create_tag(data) for data in md3.frame_tags(0)]
+                if len(self.frame_numbers) > 1:
+                    self.read_tag_animation(md3.tags)
+            for i, surface in enumerate(md3.surfaces):
+                self.read_surface(surface, i)
+
+            self.post_settings()
+        if instrument.enabled:
+            print('\n'.join(instrument.report_lines()))
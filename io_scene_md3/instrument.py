@@ -0,0 +1,174 @@
+'''
+Instrumentation of import and export: named phase timers, counters,
+optional cProfile and tracemalloc capture.
+
+Turned on by the operator option or by environment variables:
+
+    MD3_PROFILE=timers,cprofile,tracemalloc  (any subset, 1 means timers)
+    MD3_PROFILE_JSON=/path/to/report.json    (JSON dump of every run)
+'''
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+FEATURES = ('timers', 'cprofile', 'tracemalloc')
+
+
+def features_from_environ(environ=os.environ):
+    value = environ.get('MD3_PROFILE', '').strip().lower()
+    if value in ('', '0', 'no', 'off'):
+        return set()
+    if value in ('1', 'yes', 'on'):
+        return {'timers'}
+    features = {f.strip() for f in value.split(',') if f.strip()}
+    unknown = features - set(FEATURES)
+    if unknown:
+        raise ValueError('Unknown MD3_PROFILE features: {}'.format(', '.join(sorted(unknown))))
+    return features
+
+
+class Instrumentation:
+    '''
+    Phase timings and counters of one import or export.
+    Phases may be nested, time of a phase includes its nested phases.
+    When disabled, phase() and count() do nothing.
+    '''
+
+    def __init__(self, features=(), json_path=None, top=20):
+        self.features = set(features)
+        if self.features:
+            self.features.add('timers')  # everything else is reported along with timers
+        self.enabled = bool(self.features)
+        self.json_path = json_path
+        self.top = top
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+        self.started = None
+        self.total = None
+        self.profile = None
+        self.profile_stats = None
+        self.memory = None
+
+    @classmethod
+    def from_environ(cls, features=(), environ=os.environ):
+        'Features from the operator are extended with ones from environment'
+        return cls(set(features) | features_from_environ(environ), environ.get('MD3_PROFILE_JSON') or None)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        'Records a phase call measured elsewhere, e.g. in a worker thread'
+        if self.enabled:
+            self.times[name] = self.times.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def start(self):
+        if not self.enabled:
+            return
+        if 'tracemalloc' in self.features:
+            import tracemalloc
+            tracemalloc.start()
+        if 'cprofile' in self.features:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.started = time.perf_counter()
+
+    def stop(self):
+        'Finishes capture, writes JSON dump if requested'
+        if not self.enabled:
+            return
+        self.total = time.perf_counter() - self.started
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile_stats = self.get_profile_stats()
+        if 'tracemalloc' in self.features:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.memory = {
+                'current': current,
+                'peak': peak,
+                'top': [{
+                    'location': '{}:{}'.format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                    'size': stat.size,
+                    'count': stat.count,
+                } for stat in snapshot.statistics('lineno')[:self.top]],
+            }
+        if self.json_path:
+            self.dump(self.json_path)
+
+    @contextmanager
+    def capture(self):
+        self.start()
+        try:
+            yield self
+        finally:
+            self.stop()
+
+    def get_profile_stats(self):
+        'Functions with the largest cumulative time'
+        import pstats
+        stats = pstats.Stats(self.profile).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:self.top]
+        return [{
+            'function': '{}:{}({})'.format(*func),
+            'calls': nc,
+            'tottime': tt,
+            'cumtime': ct,
+        } for func, (cc, nc, tt, ct, callers) in rows]
+
+    def as_dict(self):
+        return {
+            'total': self.total,
+            'phases': {name: {'time': self.times[name], 'calls': self.calls[name]} for name in self.times},
+            'counters': dict(self.counters),
+            'profile': self.profile_stats,
+            'memory': self.memory,
+        }
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+
+    def summary(self):
+        'One line, suitable for operator report'
+        phases = sorted(self.times.items(), key=lambda item: item[1], reverse=True)
+        parts = ['{:.3f}s'.format(self.total or 0.0)]
+        parts.extend('{} {:.3f}s'.format(name, t) for name, t in phases)
+        parts.extend('{} {}'.format(name, n) for name, n in sorted(self.counters.items()))
+        if self.memory is not None:
+            parts.append('peak memory {:.1f} MiB'.format(self.memory['peak'] / 2.0 ** 20))
+        return ', '.join(parts)
+
+    def report_lines(self):
+        'Detailed multiline report for the console'
+        lines = ['Total: {:.3f}s'.format(self.total or 0.0)]
+        for name, t in sorted(self.times.items(), key=lambda item: item[1], reverse=True):
+            lines.append('  {:<24} {:9.3f}s {:7} calls'.format(name, t, self.calls[name]))
+        for name, n in sorted(self.counters.items()):
+            lines.append('  {:<24} {:9}'.format(name, n))
+        for row in self.profile_stats or ():
+            lines.append('  {cumtime:9.3f}s {calls:8} {function}'.format(**row))
+        if self.memory is not None:
+            lines.append('  peak memory {} bytes'.format(self.memory['peak']))
+            for row in self.memory['top']:
+                lines.append('  {size:10} {location}'.format(**row))
+        return lines
@@ -0,0 +1,168 @@
+import mmap
+import struct
+
+import numpy
+
+from . import fmt_md3 as fmt
+
+
+def concat_columns(rtype, arrays):
+    'Joins columns of several decoded lumps of the same record type'
+    return rtype.ntuple_cls._make(numpy.concatenate(columns) for columns in zip(*arrays))
+
+
+class LumpView:
+    'Lazy sequence of records stored back to back, nothing is decoded until accessed'
+
+    def __init__(self, buffer, rtype, offset, count):
+        self.buffer = buffer
+        self.rtype = rtype
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('{} index out of range'.format(self.rtype.ntuple_cls.__name__))
+        return self.rtype.unpack_from(self.buffer, self.offset + i * self.rtype.size)
+
+    def __iter__(self):
+        return self.rtype.iter_unpack(self.buffer, self.offset, self.count)
+
+    def array(self, convert=True):
+        'Decodes the whole lump into numpy columns'
+        return self.rtype.unpack_array(self.buffer, self.offset, self.count, convert=convert)
+
+
+class MD3Surface:
+    def __init__(self, buffer, offset):
+        self.buffer = buffer
+        self.offset = offset
+        try:
+            self.header = fmt.Surface.unpack_from(buffer, offset)
+        except struct.error:
+            raise ValueError('Surface at offset {} is truncated'.format(offset))
+        if self.header.magic != fmt.MAGIC:
+            raise ValueError('Surface at offset {} has wrong magic'.format(offset))
+
+    @property
+    def name(self):
+        return self.header.name
+
+    def lump(self, rtype, offset, count):
+        return LumpView(self.buffer, rtype, self.offset + offset, count)
+
+    @property
+    def shaders(self):
+        return self.lump(fmt.Shader, self.header.offShaders, self.header.nShaders)
+
+    @property
+    def triangles(self):
+        return self.lump(fmt.Triangle, self.header.offTris, self.header.nTris)
+
+    @property
+    def texcoords(self):
+        return self.lump(fmt.TexCoord, self.header.offST, self.header.nVerts)
+
+    @property
+    def vertices(self):
+        'Vertices of all frames'
+        return self.lump(fmt.Vertex, self.header.offVerts, self.header.nVerts * self.header.nFrames)
+
+    def frame_vertices(self, frame):
+        n = self.header.nVerts
+        return self.lump(fmt.Vertex, self.header.offVerts + frame * n * fmt.Vertex.size, n)
+
+    def frames_vertices(self, frames, convert=True):
+        'Vertices of given frames only, other frames are not decoded'
+        return concat_columns(fmt.Vertex, [self.frame_vertices(f).array(convert) for f in frames])
+
+    def positions(self, frames=None):
+        'Vertex positions of all or given frames, shape is (number of frames, nVerts, 3)'
+        if frames is None:
+            verts = self.vertices.array()
+            count = self.header.nFrames
+        else:
+            verts = self.frames_vertices(frames)
+            count = len(frames)
+        positions = numpy.column_stack((verts.x, verts.y, verts.z)).astype(numpy.float32)  # exact
+        return positions.reshape((count, self.header.nVerts, 3))
+
+
+class MD3File:
+    '''
+    Memory-mapped MD3 reader, works without Blender.
+    Only the header is parsed up front, lumps are decoded on access.
+    When buffer is given (e.g. archive member), it's read instead of the file.
+    '''
+
+    def __init__(self, filename, buffer=None):
+        self.filename = filename
+        self.file = None
+        self.buffer = buffer
+        try:
+            if buffer is None:
+                self.file = open(filename, 'rb')
+                self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.header = fmt.Header.unpack_from(self.buffer)
+            except struct.error:
+                raise ValueError('Truncated MD3 file: {}'.format(filename))
+            if self.header.magic != fmt.MAGIC:
+                raise ValueError('Not an MD3 file: {}'.format(filename))
+            if self.header.version != fmt.VERSION:
+                raise ValueError('Unsupported MD3 version {}'.format(self.header.version))
+        except Exception:
+            self.close()
+            raise
+        self._surfaces = None
+
+    def close(self):
+        if self.file is not None:
+            if self.buffer is not None:
+                self.buffer.close()
+            self.file.close()
+            self.file = None
+        self.buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def lump(self, rtype, offset, count):
+        return LumpView(self.buffer, rtype, offset, count)
+
+    @property
+    def frames(self):
+        return self.lump(fmt.Frame, self.header.offFrames, self.header.nFrames)
+
+    @property
+    def tags(self):
+        'Tags of all frames, nTags records per frame'
+        return self.lump(fmt.Tag, self.header.offTags, self.header.nTags * self.header.nFrames)
+
+    def frame_tags(self, frame):
+        n = self.header.nTags
+        return self.lump(fmt.Tag, self.header.offTags + frame * n * fmt.Tag.size, n)
+
+    def frames_tags(self, frames):
+        'Tags of given frames only as columns, other frames are not decoded'
+        return concat_columns(fmt.Tag, [self.frame_tags(f).array() for f in frames])
+
+    @property
+    def surfaces(self):
+        if self._surfaces is None:
+            surfaces = []
+            offset = self.header.offSurfaces
+            for i in range(self.header.nSurfaces):
+                surface = MD3Surface(self.buffer, offset)
+                surfaces.append(surface)
+                offset += surface.header.offEnd
+            self._surfaces = surfaces
+        return self._surfaces
@@ -0,0 +1,64 @@
+'''
+Array versions of MD3 normal encoding and decoding.
+Results are bit-exact with fmt_md3.encode_normal and fmt_md3.decode_normal.
+'''
+
+from math import pi, sin, cos, atan2, acos
+
+import numpy
+
+
+def build_decode_table():
+    'Returns (256, 256, 3) table of decoded normals indexed by (lat, lon) bytes'
+    # same expressions as in decode_normal, so table values are identical
+    angles = [b / 255.0 * 2 * pi for b in range(256)]
+    cos_a = numpy.array([cos(a) for a in angles])
+    sin_a = numpy.array([sin(a) for a in angles])
+    table = numpy.empty((256, 256, 3))
+    table[:, :, 0] = cos_a[:, numpy.newaxis] * sin_a[numpy.newaxis, :]
+    table[:, :, 1] = sin_a[:, numpy.newaxis] * sin_a[numpy.newaxis, :]
+    table[:, :, 2] = cos_a[numpy.newaxis, :]
+    return table
+
+
+DECODE_TABLE = build_decode_table()
+
+
+def decode_normals(b):
+    'b is (N, 2) array of (lat, lon) bytes, returns (N, 3) array of unit vectors'
+    b = numpy.asarray(b)
+    return DECODE_TABLE[b[:, 0], b[:, 1]]
+
+
+def exact_angle_bytes(values, exact_func, *args):
+    '''
+    int(value) & 255 for every value.
+    numpy trigonometry may differ from libm in the last ulp, that matters only
+    when the value is close to an integer, such values are recomputed with math module.
+    '''
+    near = numpy.abs(values - numpy.rint(values)) < 1e-6
+    for i in numpy.nonzero(near)[0].tolist():
+        values[i] = exact_func(*(float(a[i]) for a in args))
+    return numpy.trunc(values).astype(numpy.int64) & 255
+
+
+def encode_normals(n):
+    '''
+    n is (N, 3) array of unit vectors, returns (N, 2) uint8 array of (lat, lon) bytes.
+    Unlike encode_normal z is clipped to [-1, 1] instead of raising math domain error.
+    '''
+    n = numpy.asarray(n, dtype=numpy.float64).reshape((-1, 3))
+    x, y, z = n[:, 0], n[:, 1], numpy.clip(n[:, 2], -1.0, 1.0)
+
+    lon = exact_angle_bytes(
+        numpy.arctan2(y, x) * 255 / (2 * pi),
+        lambda y, x: atan2(y, x) * 255 / (2 * pi), y, x)
+    lat = exact_angle_bytes(
+        numpy.arccos(z) * 255 / (2 * pi),
+        lambda z: acos(z) * 255 / (2 * pi), z)
+
+    result = numpy.column_stack((lat, lon)).astype(numpy.uint8)
+    pole = (x == 0) & (y == 0)
+    result[pole & (z > 0)] = (0, 0)
+    result[pole & ~(z > 0)] = (128, 0)
+    return result
@@ -0,0 +1,210 @@
+import bpy
+import os
+import struct
+from bpy.props import StringProperty, EnumProperty, IntProperty, BoolProperty
+from bpy_extras.io_utils import ImportHelper, ExportHelper
+
+from .instrument import Instrumentation
+from .pk3 import is_archive
+
+
+def profile_property():
+    return EnumProperty(
+        name="Profile",
+        description="Measure where the time goes, details are printed to the console "
+                    "(also MD3_PROFILE and MD3_PROFILE_JSON environment variables)",
+        items=(
+            ('TIMERS', "Timers", "Phase timers and counters"),
+            ('CPROFILE', "cProfile", "Functions with the largest cumulative time"),
+            ('TRACEMALLOC', "Memory", "Peak memory and largest allocations by tracemalloc"),
+        ),
+        options={'ENUM_FLAG'},
+        default=set(),
+    )
+
+
+def get_instrumentation(operator):
+    return Instrumentation.from_environ(f.lower() for f in operator.profile)
+
+
+def report_instrumentation(operator, instrument):
+    if instrument.enabled:
+        operator.report({'INFO'}, instrument.summary())
+
+
+def vertex_cache_summary(stats):
+    'Averages over all triangles of all surfaces'
+    nTris = sum(n for _, n, _, _ in stats) or 1
+    before = [sum(n * b[i] for _, n, b, _ in stats) / nTris for i in range(2)]
+    after = [sum(n * a[i] for _, n, _, a in stats) / nTris for i in range(2)]
+    return "Vertex cache: ACMR {:.3f} -> {:.3f}, ATVR {:.3f} -> {:.3f}".format(
+        before[0], after[0], before[1], after[1])
+
+
+class ImportMD3(bpy.types.Operator, ImportHelper):
+    '''Import a Quake 3 Model MD3 file'''
+    bl_idname = "import_scene.md3"
+    bl_label = 'Import MD3'
+    filename_ext = ".md3"
+    filter_glob = StringProperty(default="*.md3;*.pk3", options={'HIDDEN'})
+    member = StringProperty(
+        name="Archive Member",
+        description="Path of the model inside selected .pk3 archive, e.g. models/weapons2/shotgun/shotgun.md3",
+    )
+    use_cache = BoolProperty(
+        name="Use Cache",
+        description="Keep decoded models on disk, so repeated imports of the same file are faster "
+                    "(MD3_CACHE_DIR and MD3_CACHE_SIZE environment variables)",
+        default=True,
+    )
+    frame_start = IntProperty(
+        name="First Frame",
+        description="First frame to import",
+        default=0,
+        min=0,
+    )
+    frame_end = IntProperty(
+        name="Last Frame",
+        description="Last frame to import, negative values count from the last frame of the model",
+        default=-1,
+    )
+    frame_stride = IntProperty(
+        name="Frame Stride",
+        description="Import every n-th frame only",
+        default=1,
+        min=1,
+    )
+    sequences = StringProperty(
+        name="Sequences",
+        description="Comma separated animations from animation.cfg next to the model to import, "
+                    "e.g. LEGS_RUN, LEGS_JUMP. Empty means all frames",
+    )
+    vertex_animation = EnumProperty(
+        name="Vertex Animation",
+        description="How frames of surfaces are stored",
+        items=(
+            ('SHAPE_KEYS', "Shape Keys", "Shape key for every frame, stored in .blend"),
+            ('PC2', "Mesh Cache (PC2)", "Point cache file next to the model, streamed by Mesh Cache modifier"),
+            ('MDD', "Mesh Cache (MDD)", "Point cache file next to the model, streamed by Mesh Cache modifier"),
+        ),
+        default='SHAPE_KEYS',
+    )
+    profile = profile_property()
+
+    def execute(self, context):
+        from .cache import DecodeCache
+        from .import_md3 import MD3Importer
+        instrument = get_instrumentation(self)
+        cache = DecodeCache.from_environ() if self.use_cache else None
+        filepath = self.properties.filepath
+        if is_archive(filepath):
+            if not self.member:
+                self.report({'ERROR'}, "Set Archive Member to the path of the model inside the archive")
+                return {'CANCELLED'}
+            filepath = os.path.join(filepath, self.member)
+        try:
+            MD3Importer(
+                context,
+                instrument=instrument,
+                cache=cache,
+                frame_start=self.frame_start,
+                frame_end=self.frame_end,
+                frame_stride=self.frame_stride,
+                sequences=self.sequences,
+                vertex_animation=self.vertex_animation,
+            )(filepath)
+        except struct.error:
+            # lumps are read lazily, a short read past the end of the file surfaces here
+            self.report({'ERROR'}, "File is truncated: {}".format(filepath))
+            return {'CANCELLED'}
+        except (ValueError, KeyError, OSError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        report_instrumentation(self, instrument)
+        return {'FINISHED'}
+
+
+class ExportMD3(bpy.types.Operator, ExportHelper):
+    '''Export a Quake 3 Model MD3 file'''
+    bl_idname = "export_scene.md3"
+    bl_label = 'Export MD3'
+    filename_ext = ".md3"
+    filter_glob = StringProperty(default="*.md3", options={'HIDDEN'})
+    local_origin = EnumProperty(
+        name="Local Origin",
+        description="Center of the frame bounding sphere used by the engine for culling",
+        items=(
+            ('SPHERE', "Bounding Sphere", "Center of tight bounding sphere of every frame"),
+            ('ORIGIN', "Model Origin", "Model origin, radius is measured from (0, 0, 0)"),
+        ),
+        default='SPHERE',
+    )
+    merge_surfaces = BoolProperty(
+        name="Merge Surfaces",
+        description="Objects with the same textures become one surface named after the first object, "
+                    "so the engine draws them at once. Surfaces exceeding MD3 limits are split anyway",
+        default=False,
+    )
+    vertex_cache = BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorder triangles and vertices for the GPU vertex cache, ACMR/ATVR are reported",
+        default=False,
+    )
+    incremental = BoolProperty(
+        name="Incremental",
+        description="Reuse results of previous exports for objects which have not changed "
+                    "(MD3_EXPORT_CACHE_DIR and MD3_EXPORT_CACHE_SIZE environment variables)",
+        default=False,
+    )
+    workers = IntProperty(
+        name="Threads",
+        description="Threads encoding frames, 1 is serial, output is the same for any value",
+        default=1,
+        min=1,
+    )
+    profile = profile_property()
+
+    def execute(self, context):
+        try:
+            from .export_cache import session_cache
+            from .export_md3 import MD3Exporter
+            instrument = get_instrumentation(self)
+            exporter = MD3Exporter(
+                context,
+                local_origin=None if self.local_origin == 'SPHERE' else (0.0, 0.0, 0.0),
+                instrument=instrument,
+                workers=self.workers,
+                vertex_cache=self.vertex_cache,
+                merge_surfaces=self.merge_surfaces,
+                cache=session_cache() if self.incremental else None,
+            )
+            exporter(self.properties.filepath)
+            if exporter.vertex_cache_stats:
+                self.report({'INFO'}, vertex_cache_summary(exporter.vertex_cache_stats))
+            report_instrumentation(self, instrument)
+            return {'FINISHED'}
+        except struct.error:
+            self.report({'ERROR'}, "Mesh does not fit within the MD3 model space. Vertex axies locations must be below 512 blender units.")
+        except ValueError as e:
+            self.report({'ERROR'}, str(e))
+        return {'CANCELLED'}
+
+
+def menu_func_import(self, context):
+    self.layout.operator(ImportMD3.bl_idname, text="Quake 3 Model (.md3)")
+
+
+def menu_func_export(self, context):
+    self.layout.operator(ExportMD3.bl_idname, text="Quake 3 Model (.md3)")
+
+
+def register():
+    bpy.utils.register_module(__name__)
+    bpy.types.INFO_MT_file_import.append(menu_func_import)
+    bpy.types.INFO_MT_file_export.append(menu_func_export)
+
+
+def unregister():
+    bpy.utils.unregister_module(__name__)
+    bpy.types.INFO_MT_file_import.remove(menu_func_import)
+    bpy.types.INFO_MT_file_export.remove(menu_func_export)
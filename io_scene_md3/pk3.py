@@ -0,0 +1,190 @@
+'''
+Reading models and textures straight from .pk3 (zip) archives.
+
+Models inside archives are addressed by paths going through the archive:
+    /games/quake3/baseq3/pak0.pk3/models/weapons2/shotgun/shotgun.md3
+
+Like the engine, all archives of the game directory are searched,
+archives sorted later by name take priority (pak8.pk3 overrides pak0.pk3).
+'''
+
+import mmap
+import os
+import zipfile
+from struct import Struct
+
+from .textures import IMAGE_EXTENSIONS, name_candidates
+
+ARCHIVE_EXTENSION = '.pk3'
+# zip local file header, its name and extra field lengths may differ from central directory ones
+LOCAL_HEADER = Struct('<4sHHHHHIIIHH')
+LOCAL_HEADER_MAGIC = b'PK\x03\x04'
+
+
+def split_archive_path(path):
+    '''
+    Returns (archive path, member name) when path goes through a .pk3 file,
+    otherwise (None, path)
+    '''
+    parts = path.replace('\\', '/').split('/')
+    for i, part in enumerate(parts[:-1]):
+        if part.lower().endswith(ARCHIVE_EXTENSION):
+            archive = os.path.normpath('/'.join(parts[:i + 1]) or '/')
+            if os.path.isfile(archive):
+                return archive, '/'.join(parts[i + 1:])
+    return None, path
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSION) and os.path.isfile(path)
+
+
+class Archive:
+    'One pk3 file, contents are indexed by lowercase member names'
+
+    def __init__(self, path):
+        self.path = path
+        self.zipfile = zipfile.ZipFile(path)
+        self.members = {
+            info.filename.lower(): info
+            for info in self.zipfile.infolist() if not info.filename.endswith('/')}
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def close(self):
+        self.zipfile.close()
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.close()
+            except BufferError:
+                pass  # members are still referenced, mapping goes away with them
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_info(self, name):
+        info = self.members.get(name.replace('\\', '/').lower())
+        if info is None:
+            raise KeyError('{} is not found in {}'.format(name, self.path))
+        return info
+
+    def read(self, name):
+        '''
+        Contents of the member. Stored (not compressed) members are returned
+        as a memoryview of the mapped archive, without copying.
+        '''
+        info = self.get_info(name)
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:  # encrypted
+            return self.zipfile.read(info)
+        fields = LOCAL_HEADER.unpack_from(self.buffer, info.header_offset)
+        if fields[0] != LOCAL_HEADER_MAGIC:
+            raise zipfile.BadZipFile('Bad local header of {} in {}'.format(name, self.path))
+        start = info.header_offset + LOCAL_HEADER.size + fields[9] + fields[10]
+        if start + info.file_size > len(self.buffer):
+            raise zipfile.BadZipFile('{} is truncated in {}'.format(name, self.path))
+        return memoryview(self.buffer)[start:start + info.file_size]
+
+
+class ArchiveIndex:
+    '''
+    Contents of several archives, every name is resolved to the archive
+    with the highest priority containing it. Archives are indexed once.
+    '''
+
+    def __init__(self, paths=()):
+        self.archives = []  # priority order, highest first
+        self.members = {}  # lowercase name -> archive
+        for path in paths:
+            self.add(path)
+
+    @classmethod
+    def for_directory(cls, directory):
+        'All archives of the game directory in engine order'
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        index = cls()
+        for name in sorted((name for name in names if name.lower().endswith(ARCHIVE_EXTENSION)), key=str.lower):
+            try:
+                index.add(os.path.join(directory, name))
+            except (OSError, zipfile.BadZipFile) as e:
+                print('Warning: skipping archive {}: {}'.format(name, e))
+        return index
+
+    def add(self, path):
+        'Added archive takes priority over all previously added ones'
+        archive = Archive(path)
+        self.archives.insert(0, archive)
+        for name in archive.members:
+            self.members[name] = archive
+
+    def close(self):
+        for archive in self.archives:
+            archive.close()
+        self.archives = []
+        self.members = {}
+
+    def get_archive(self, path):
+        for archive in self.archives:
+            if os.path.samefile(archive.path, path):
+                return archive
+        return None
+
+    def find(self, nameguess, extensions=IMAGE_EXTENSIONS):
+        '''
+        Looks for nameguess with one of extensions appended, or with its own extension replaced.
+        Returns (archive, member name) or None.
+        '''
+        nameguess = nameguess.replace('\\', '/').lstrip('/')
+        for candidate in name_candidates(nameguess, extensions):
+            archive = self.members.get(candidate)
+            if archive is not None:
+                return archive, archive.get_info(candidate).filename
+        return None
+
+
+class ArchiveIndexCache:
+    'ArchiveIndex for every game directory, rebuilt when archives change'
+
+    def __init__(self):
+        self.indexes = {}
+
+    @staticmethod
+    def signature(directory):
+        result = []
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            return ()
+        for name in names:
+            if name.lower().endswith(ARCHIVE_EXTENSION):
+                st = os.stat(os.path.join(directory, name))
+                result.append((name, st.st_size, st.st_mtime))
+        return tuple(result)
+
+    def get(self, directory):
+        directory = os.path.normpath(directory)
+        signature = self.signature(directory)
+        entry = self.indexes.get(directory)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        if entry is not None:
+            entry[1].close()
+        index = ArchiveIndex.for_directory(directory)
+        self.indexes[directory] = (signature, index)
+        return index
+
+    def clear(self):
+        for _, index in self.indexes.values():
+            index.close()
+        self.indexes.clear()
+
+
+# shared between imports during the session
+archive_indexes = ArchiveIndexCache()
@@ -0,0 +1,52 @@
+'''
+Point cache files read by Blender's Mesh Cache modifier, vertex positions of every frame
+are written in one go, so frames are streamed from disk instead of shape keys.
+
+    PC2  little-endian: 'POINTCACHE2\\0', version, points, start frame, sample rate, samples,
+         then float xyz of every point of every sample
+    MDD  big-endian: frames, points, time of every frame, then float xyz like PC2
+'''
+
+from struct import Struct
+
+import numpy
+
+PC2_SIGNATURE = b'POINTCACHE2\0'
+PC2_HEADER = Struct('<12siiffi')
+MDD_HEADER = Struct('>ii')
+
+
+def write_pc2(filename, positions, start=0.0, rate=1.0):
+    'positions is (nFrames, nPoints, 3) array'
+    positions = numpy.ascontiguousarray(positions, dtype='<f4')
+    with open(filename, 'wb') as f:
+        f.write(PC2_HEADER.pack(PC2_SIGNATURE, 1, positions.shape[1], start, rate, positions.shape[0]))
+        f.write(positions.tobytes())
+
+
+def read_pc2(filename):
+    'Returns (positions, start frame, sample rate)'
+    with open(filename, 'rb') as f:
+        signature, version, nPoints, start, rate, nSamples = PC2_HEADER.unpack(f.read(PC2_HEADER.size))
+        if signature != PC2_SIGNATURE:
+            raise ValueError('Not a PC2 file: {}'.format(filename))
+        positions = numpy.fromfile(f, dtype='<f4', count=nSamples * nPoints * 3)
+    return positions.reshape((nSamples, nPoints, 3)), start, rate
+
+
+def write_mdd(filename, positions, times):
+    'positions is (nFrames, nPoints, 3) array, times are in seconds'
+    positions = numpy.ascontiguousarray(positions, dtype='>f4')
+    with open(filename, 'wb') as f:
+        f.write(MDD_HEADER.pack(positions.shape[0], positions.shape[1]))
+        f.write(numpy.asarray(times, dtype='>f4').tobytes())
+        f.write(positions.tobytes())
+
+
+def read_mdd(filename):
+    'Returns (positions, times)'
+    with open(filename, 'rb') as f:
+        nFrames, nPoints = MDD_HEADER.unpack(f.read(MDD_HEADER.size))
+        times = numpy.fromfile(f, dtype='>f4', count=nFrames)
+        positions = numpy.fromfile(f, dtype='>f4', count=nFrames * nPoints * 3)
+    return positions.reshape((nFrames, nPoints, 3)), times
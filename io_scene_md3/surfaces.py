@@ -0,0 +1,78 @@
+'''
+Layout of exported surfaces: merging mesh objects with the same shaders
+and splitting surfaces that exceed MD3 limits, every surface is a draw call for the engine.
+'''
+
+import numpy
+
+from . import fmt_md3 as fmt
+
+
+def group_by_shaders(shader_lists):
+    '''
+    Groups indices of shader lists, equal non-empty lists go to one group.
+    Empty lists are never merged, their shaders come from .skin files by surface name.
+    Groups are ordered by their first member.
+    '''
+    groups = []
+    by_shaders = {}
+    for i, shaders in enumerate(shader_lists):
+        key = tuple(shaders)
+        if not key:
+            groups.append([i])
+        elif key in by_shaders:
+            by_shaders[key].append(i)
+        else:
+            by_shaders[key] = group = [i]
+            groups.append(group)
+    return groups
+
+
+def merge_triangles(tris_list, vert_counts):
+    'Concatenates triangles of several surfaces, vertex indices are shifted accordingly'
+    offsets = numpy.cumsum([0] + list(vert_counts[:-1]))
+    return numpy.vstack([numpy.asarray(tris).reshape((-1, 3)) + offset for tris, offset in zip(tris_list, offsets)])
+
+
+def fits_limits(tris, nVerts, max_verts=fmt.MAX_VERTS, max_tris=fmt.MAX_TRIANGLES):
+    return nVerts <= max_verts and len(tris) <= max_tris
+
+
+def split_triangles(tris, max_verts=fmt.MAX_VERTS, max_tris=fmt.MAX_TRIANGLES):
+    '''
+    Splits triangles into consecutive runs fitting into the limits.
+    Returns list of (vertex ids, local tris): vertex ids are input vertex numbers in order of first use,
+    local tris index them. Runs follow triangle order, so coherent meshes split into few parts.
+    '''
+    chunks = []
+    ids = []
+    used = {}
+    local = []
+    for tri in numpy.asarray(tris).reshape((-1, 3)).tolist():
+        new = len(set(v for v in tri if v not in used))
+        if local and (len(local) == max_tris or len(ids) + new > max_verts):
+            chunks.append((numpy.array(ids, dtype=numpy.int64), numpy.array(local, dtype=numpy.int64)))
+            ids = []
+            used = {}
+            local = []
+        for v in tri:
+            if v not in used:
+                used[v] = len(ids)
+                ids.append(v)
+        local.append([used[v] for v in tri])
+    if local:
+        chunks.append((numpy.array(ids, dtype=numpy.int64), numpy.array(local, dtype=numpy.int64)))
+    return chunks
+
+
+def part_names(name, count, size=fmt.MAX_QPATH - 1):
+    '''
+    Names of parts of a split surface: name_1, name_2 and so on.
+    The name is shortened, so that every result fits into size bytes of UTF-8.
+    '''
+    names = []
+    for i in range(1, count + 1):
+        suffix = '_{}'.format(i)
+        base = name.encode('utf-8')[:size - len(suffix)].decode('utf-8', 'ignore')
+        names.append(base + suffix)
+    return names
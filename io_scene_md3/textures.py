@@ -0,0 +1,137 @@
+'''
+Texture file lookup. Quake 3 paths are case-insensitive and shaders often
+name .tga images which are shipped as .jpg, so lookups go through an index
+of directory listings instead of probing file names one by one.
+'''
+
+import os
+
+IMAGE_EXTENSIONS = ('', '.png', '.tga', '.jpg', '.jpeg')
+
+
+def guess_texture_names(modelpath, imagepath):
+    'Yields candidate paths (without added extension) of the image, most specific first'
+    modelpath = os.path.normpath(os.path.normcase(modelpath))
+    modeldir, _ = os.path.split(modelpath)
+    imagedir, imagename = os.path.split(os.path.normpath(os.path.normcase(imagepath)))
+    previp = None
+    ip = imagedir
+    while ip != previp:
+        if ip in modeldir:
+            pos = modeldir.rfind(ip)
+            yield os.path.join(modeldir[:pos + len(ip)], imagedir[len(ip):].lstrip(os.sep), imagename)
+        previp = ip
+        ip, _ = os.path.split(ip)
+    yield os.path.join(modeldir, imagename)
+
+
+def guess_texture_filepath(modelpath, imagepath):
+    for nameguess in guess_texture_names(modelpath, imagepath):
+        for ext in IMAGE_EXTENSIONS:
+            yield nameguess + ext
+
+
+def name_candidates(name, extensions=IMAGE_EXTENSIONS):
+    'Lowercase names to look for: name with one of extensions appended, or with its own extension replaced'
+    name = name.lower()
+    stem, ext = os.path.splitext(name)
+    candidates = [name + e for e in extensions]
+    if ext in extensions:
+        candidates.extend(stem + e for e in extensions if e and e != ext)
+    return candidates
+
+
+def scan_directory(directory):
+    'Returns (files, dirs) dicts mapping lowercase name to real name, None if directory is missing'
+    files = {}
+    dirs = {}
+    try:
+        if hasattr(os, 'scandir'):
+            for entry in os.scandir(directory):
+                (dirs if entry.is_dir() else files)[entry.name.lower()] = entry.name
+        else:  # python < 3.5
+            for name in os.listdir(directory):
+                is_dir = os.path.isdir(os.path.join(directory, name))
+                (dirs if is_dir else files)[name.lower()] = name
+    except OSError:
+        return None
+    return files, dirs
+
+
+def directory_mtime(directory):
+    try:
+        return os.stat(directory).st_mtime
+    except OSError:
+        return None
+
+
+class DirectoryIndex:
+    '''
+    Case-insensitive index of directory contents,
+    every directory is listed once and reused until its modification time changes.
+    Missing directories are looked up again when their parent changes.
+    '''
+
+    def __init__(self):
+        self.listings = {}  # directory: (checked directory, its mtime, listing)
+        self.scans = 0
+
+    def clear(self):
+        self.listings.clear()
+
+    def listing(self, directory):
+        'Returns (real directory path, files, dirs) or None'
+        cached = self.listings.get(directory)
+        if cached is not None:
+            checked, mtime, result = cached
+            if directory_mtime(checked) == mtime:
+                return result
+        parent, name = os.path.split(directory)
+        # times are taken before listing, so changes during the scan are seen by the next lookup
+        mtime = directory_mtime(directory)
+        listing = scan_directory(directory)
+        self.scans += 1
+        if listing is not None:
+            entry = (directory, mtime, (directory,) + listing)
+        else:
+            entry = (directory, mtime, None)
+            # directory may exist with different letter case
+            if name and parent != directory:
+                parent_listing = self.listing(parent)
+                # checked the way the parent is, it changes when the directory appears
+                entry = self.listings[parent][:2] + (None,)
+                if parent_listing is not None:
+                    real_name = parent_listing[2].get(name.lower())
+                    if real_name is not None:
+                        real_directory = os.path.join(parent_listing[0], real_name)
+                        result = self.listing(real_directory)
+                        if result is not None:
+                            entry = (real_directory, self.listings[real_directory][1], result)
+        self.listings[directory] = entry
+        return entry[2]
+
+    def find(self, nameguess, extensions=IMAGE_EXTENSIONS):
+        'Looks for nameguess with one of extensions appended, or with its own extension replaced'
+        if '\0' in nameguess:
+            return None
+        directory, name = os.path.split(nameguess)
+        listing = self.listing(directory)
+        if listing is None:
+            return None
+        real_directory, files, _ = listing
+        for candidate in name_candidates(name, extensions):
+            real_name = files.get(candidate)
+            if real_name is not None:
+                return os.path.join(real_directory, real_name)
+        return None
+
+    def find_texture(self, modelpath, imagepath):
+        for nameguess in guess_texture_names(modelpath, imagepath):
+            path = self.find(nameguess)
+            if path is not None:
+                return path
+        return None
+
+
+# shared between imports during the session
+directory_index = DirectoryIndex()
@@ -1,6 +1,10 @@
-from struct import Struct
+import os
+import re
+import tempfile
+from struct import Struct, error as struct_error
 from collections import namedtuple
-from io import BytesIO
+
+import numpy
 
 
 def get_index_of_tuples(ts, index, default):
@@ -11,63 +15,261 @@ def noop(value):
     return value
 
 
+NUMPY_TYPES = {
+    'b': 'i1', 'B': 'u1',
+    'h': 'i2', 'H': 'u2',
+    'i': 'i4', 'I': 'u4',
+    'f': 'f4', 'd': 'f8',
+}
+field_format = re.compile(r'^(\d*)([a-zA-Z])$')
+
+
+def numpy_field_type(fmt):
+    count, code = field_format.match(fmt).groups()
+    count = int(count) if count else 1
+    if code == 's':
+        return ('S{}'.format(count),)
+    if count == 1:
+        return ('<' + NUMPY_TYPES[code],)
+    return ('<' + NUMPY_TYPES[code], (count,))
+
+
 class AnyStruct:
+    '''
+    Fields are tuples (name, format, tupling, frombin, tobin, frombin_array, tobin_array).
+    *_array functions convert a whole numpy column at once, when omitted
+    frombin/tobin is applied to the column directly (works for arithmetic converters).
+    Scalar pack/unpack functions are generated for every record layout,
+    so converters are called only for fields which have them.
+    '''
     def __init__(self, name, fields):
         self.ntuple_cls = namedtuple(name, [f[0] for f in fields])
         self.struct = Struct('<' + ''.join([f[1] for f in fields]))
         self.tupling = get_index_of_tuples(fields, 2, 1)
         self.frombin = get_index_of_tuples(fields, 3, noop)
         self.tobin = get_index_of_tuples(fields, 4, noop)
+        self.frombin_array = tuple(
+            f[5] if len(f) > 5 else frombin
+            for f, frombin in zip(fields, self.frombin))
+        self.tobin_array = tuple(
+            f[6] if len(f) > 6 else tobin
+            for f, tobin in zip(fields, self.tobin))
+        self.dtype = numpy.dtype([(f[0],) + numpy_field_type(f[1]) for f in fields])
+        assert self.dtype.itemsize == self.struct.size
+        self.from_plain, self.unpack, self.unpack_from, self.pack = self.generate_functions()
 
-    @property
-    def size(self):
-        return self.struct.size
+    def generate_functions(self):
+        '''
+        Returns (from_plain, unpack, unpack_from, pack) specialized for the fields.
+        For Tag (name with converter, 3 floats, 9 floats) unpack is like:
+            def unpack(bs):
+                pt = struct_unpack(bs)
+                return make(cls, (frombin_0(pt[0]), (pt[1], pt[2], pt[3]), (pt[4], ...)))
+        '''
+        namespace = {
+            'cls': self.ntuple_cls,
+            'make': tuple.__new__,
+            'struct_pack': self.struct.pack,
+            'struct_unpack': self.struct.unpack,
+            'struct_unpack_from': self.struct.unpack_from,
+        }
+        fields = self.ntuple_cls._fields
+        values = []
+        packed = []
+        checks = []
+        i = 0
+        for j, (field, sz, frombin, tobin) in enumerate(zip(fields, self.tupling, self.frombin, self.tobin)):
+            if sz == 1:
+                value = 'pt[{}]'.format(i)
+            else:
+                value = '({},)'.format(', '.join('pt[{}]'.format(i + k) for k in range(sz)))
+            if frombin is not noop:
+                namespace['frombin_{}'.format(j)] = frombin
+                value = 'frombin_{}({})'.format(j, value)
+            values.append(value)
 
-    def unpack(self, bs):
-        pt = self.struct.unpack(bs)
-        t = []
-        pti = iter(pt)
-        for sz, conv_func in zip(self.tupling, self.frombin):
+            if tobin is not noop:
+                namespace['tobin_{}'.format(j)] = tobin
+                checks.append('    {0} = tobin_{1}({0})'.format(field, j))
             if sz == 1:
-                value = next(pti)
+                packed.append(field)
             else:
-                value = tuple(next(pti) for i in range(sz))
-            t.append(conv_func(value))
-        return self.ntuple_cls._make(t)
+                checks.append('    assert len({}) == {}'.format(field, sz))
+                packed.extend('{}[{}]'.format(field, k) for k in range(sz))
+            i += sz
+
+        record = 'make(cls, ({},))'.format(', '.join(values))
+        source = '\n'.join([
+            'def from_plain(pt):',
+            '    return ' + record,
+            'def unpack(bs):',
+            '    pt = struct_unpack(bs)',
+            '    return ' + record,
+            'def unpack_from(buffer, offset=0):',
+            '    pt = struct_unpack_from(buffer, offset)',
+            '    return ' + record,
+            'def pack({}):'.format(', '.join(fields)),
+        ] + checks + [
+            '    return struct_pack({})'.format(', '.join(packed)),
+        ])
+        exec(compile(source, '<{} record functions>'.format(self.ntuple_cls.__name__), 'exec'), namespace)
+        return namespace['from_plain'], namespace['unpack'], namespace['unpack_from'], namespace['pack']
+
+    @property
+    def size(self):
+        return self.struct.size
 
     def funpack(self, f):
         return self.unpack(f.read(self.size))
 
-    def pack(self, *a, **kw):
-        t = self.ntuple_cls(*a, **kw)
-        pt = []
-        for value, sz, conv_func in zip(t, self.tupling, self.tobin):
-            value = conv_func(value)
-            if sz == 1:
-                pt.append(value)
-            else:
-                assert len(value) == sz
-                pt.extend(value)
-        return self.struct.pack(*pt)
+    def unpack_array(self, buffer, offset=0, count=-1, convert=True):
+        '''
+        Decode count consecutive records into a namedtuple of numpy columns.
+        convert=False returns raw stored values.
+        '''
+        records = numpy.frombuffer(buffer, dtype=self.dtype, count=count, offset=offset)
+        columns = []
+        for name, conv_func in zip(self.ntuple_cls._fields, self.frombin_array):
+            # copying detaches columns from the buffer, they also become contiguous
+            column = numpy.array(records[name])
+            columns.append(conv_func(column) if convert else column)
+        return self.ntuple_cls._make(columns)
+
+    def funpack_array(self, f, count):
+        return self.unpack_array(f.read(self.size * count), 0, count)
+
+    def iter_unpack(self, buffer, offset=0, count=-1):
+        'Yields count consecutive records one by one, -1 means till the end of buffer'
+        if count < 0:
+            count = (len(buffer) - offset) // self.size
+        view = memoryview(buffer)[offset:offset + count * self.size]
+        from_plain = self.from_plain
+        try:
+            for pt in self.struct.iter_unpack(view):
+                yield from_plain(pt)
+        finally:
+            view.release()
 
     def fpack(self, f, *a, **kw):
         return f.write(self.pack(*a, **kw))
 
+    def pack_array(self, *a, **kw):
+        '''
+        Encodes columns (sequences of equal length) into consecutive records.
+        convert=False keyword argument takes raw values, as returned by unpack_array(convert=False).
+        '''
+        convert = kw.pop('convert', True)
+        t = self.ntuple_cls(*a, **kw)
+        records = None
+        for name, value, conv_func in zip(t._fields, t, self.tobin_array):
+            value = numpy.asarray(value)
+            if convert:
+                value = numpy.asarray(conv_func(value))
+            if records is None:
+                records = numpy.empty(len(value), dtype=self.dtype)
+            ftype = self.dtype.fields[name][0].base
+            if ftype.kind in 'iu' and value.size:
+                limits = numpy.iinfo(ftype)
+                if value.min() < limits.min or value.max() > limits.max:
+                    raise struct_error('{}.{} is out of range'.format(self.ntuple_cls.__name__, name))
+            records[name] = value
+        return records.tobytes()
+
+
+def unique_first_seen(keys):
+    '''
+    Deduplicates rows of (N, M) array comparing them bitwise.
+    Returns indices of the first occurrence of every unique row in order of appearance,
+    and for every row index of its unique row.
+    '''
+    keys = numpy.ascontiguousarray(keys)
+    rows = keys.view(numpy.dtype((numpy.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+    _, first, inverse = numpy.unique(rows, return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+    return first[order], rank[inverse.ravel()]
+
+
+def loop_vertex_keys(vertex_index, normals, uvs=None):
+    '''
+    Packs (vertex index, normal, uv) of every loop into bitwise-comparable rows for unique_first_seen.
+    Adding zero turns -0.0 into 0.0, they must be considered equal.
+    '''
+    keys = [
+        numpy.asarray(vertex_index, dtype=numpy.int32).view(numpy.uint32).reshape((-1, 1)),
+        (numpy.asarray(normals, dtype=numpy.float32).reshape((-1, 3)) + numpy.float32(0.0)).view(numpy.uint32),
+    ]
+    if uvs is not None:
+        keys.append((numpy.asarray(uvs, dtype=numpy.float32).reshape((-1, 2)) + numpy.float32(0.0)).view(numpy.uint32))
+    return numpy.hstack(keys)
+
+
+def _read_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
 
-class OffsetBytesIO:
-    def __init__(self, start_offset=0):
-        self.shift = start_offset
-        self.file = BytesIO(b'')
-        self.offsets = {}
 
-    def mark(self, name):
-        self.offsets[name] = self.file.tell() + self.shift
+# read once on load: os.umask can only be read by setting it, which races with other threads
+UMASK = _read_umask()
+
+
+class StreamingWriter:
+    '''
+    Writes data straight to a temporary file next to the target,
+    regions can be reserved and filled (patched) later in any order.
+    The target is replaced only on successful close, so failed export
+    never leaves a truncated file behind.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        directory, name = os.path.split(os.path.abspath(filename))
+        fd, self.tmpname = tempfile.mkstemp(prefix='.{}.'.format(name), suffix='.tmp', dir=directory)
+        self.file = os.fdopen(fd, 'wb')
+        self.end = 0
+        # mkstemp creates private files, give the result usual permissions
+        os.chmod(self.tmpname, 0o666 & ~UMASK)
+
+    def tell(self):
+        return self.end
+
+    def reserve(self, size):
+        'Returns offset of reserved region, it must be filled by write_at later'
+        offset = self.end
+        self.end += size
+        return offset
 
     def write(self, data):
+        'Appends data, returns its offset'
+        offset = self.end
+        self.write_at(offset, data)
+        return offset
+
+    def write_at(self, offset, data):
+        if self.file.tell() != offset:
+            self.file.seek(offset)
         self.file.write(data)
+        self.end = max(self.end, offset + len(data))
+
+    def commit(self):
+        self.file.truncate(self.end)
+        # data must reach the disk before the rename, or a crash can leave an empty target
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmpname, self.filename)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmpname)
 
-    def getvalue(self):
-        return self.file.getvalue()
+    def __enter__(self):
+        return self
 
-    def getoffsets(self):
-        return self.offsets.copy()
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
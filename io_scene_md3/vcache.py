@@ -0,0 +1,118 @@
+'''
+Triangle order optimization for the post-transform vertex cache,
+following Tom Forsyth's "Linear-Speed Vertex Cache Optimisation".
+'''
+
+import numpy
+
+# tuning constants from the paper
+CACHE_DECAY_POWER = 1.5
+LAST_TRI_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+OPTIMIZER_CACHE_SIZE = 32
+# FIFO cache used to measure results, like the one of typical hardware
+METRIC_CACHE_SIZE = 16
+
+
+def vertex_score(position, valence, cache_size=OPTIMIZER_CACHE_SIZE):
+    'position is place of the vertex in LRU cache, -1 when not cached; valence is number of unemitted triangles'
+    if valence == 0:
+        return -1.0
+    if position < 0:
+        score = 0.0
+    elif position < 3:
+        # vertices of the last triangle are used by the next one anyway, should not be favored
+        score = LAST_TRI_SCORE
+    else:
+        score = (1.0 - (position - 3) / (cache_size - 3)) ** CACHE_DECAY_POWER
+    return score + VALENCE_BOOST_SCALE * valence ** -VALENCE_BOOST_POWER
+
+
+def forsyth_order(tris, nVerts, cache_size=OPTIMIZER_CACHE_SIZE):
+    '''
+    tris is (nTris, 3) array of vertex indices.
+    Returns the new order of triangles, triangles themselves are not changed.
+    '''
+    tri_verts = numpy.asarray(tris, dtype=numpy.int64).reshape((-1, 3)).tolist()
+    nTris = len(tri_verts)
+    vert_tris = [[] for _ in range(nVerts)]
+    for t, vs in enumerate(tri_verts):
+        for v in vs:
+            vert_tris[v].append(t)
+
+    position = [-1] * nVerts
+    vscore = [vertex_score(-1, len(ts), cache_size) for ts in vert_tris]
+    tscore = numpy.array([vscore[a] + vscore[b] + vscore[c] for a, b, c in tri_verts])
+    cache = []
+    order = []
+    best = int(tscore.argmax()) if nTris else -1
+    while len(order) < nTris:
+        if best < 0:
+            # no triangles around cached vertices, starting anywhere else
+            best = int(tscore.argmax())
+        order.append(best)
+        tscore[best] = -numpy.inf
+        vs = tri_verts[best]
+        for v in vs:
+            vert_tris[v].remove(best)
+
+        new_cache = list(dict.fromkeys(vs))
+        new_cache.extend(v for v in cache if v not in new_cache)
+        for v in new_cache[cache_size:]:
+            position[v] = -1
+        cache = new_cache[:cache_size]
+        for i, v in enumerate(cache):
+            position[v] = i
+        for v in new_cache:
+            vscore[v] = vertex_score(position[v], len(vert_tris[v]), cache_size)
+
+        best = -1
+        best_score = -1.0
+        for v in new_cache:
+            for t in vert_tris[v]:
+                a, b, c = tri_verts[t]
+                score = vscore[a] + vscore[b] + vscore[c]
+                tscore[t] = score
+                if position[v] >= 0 and score > best_score:
+                    best = t
+                    best_score = score
+    return numpy.array(order, dtype=numpy.int64)
+
+
+def renumber_vertices(tris, nVerts):
+    '''
+    Numbers vertices in order of first use by triangles, unused vertices go last.
+    Returns (renumbered tris, order), order[new index] is the old index.
+    '''
+    tris = numpy.asarray(tris, dtype=numpy.int64).reshape((-1, 3))
+    flat = tris.ravel()
+    used, first = numpy.unique(flat, return_index=True)
+    order = numpy.concatenate((used[numpy.argsort(first, kind='mergesort')],
+                               numpy.setdiff1d(numpy.arange(nVerts), used)))
+    inverse = numpy.empty(nVerts, dtype=numpy.int64)
+    inverse[order] = numpy.arange(nVerts)
+    return inverse[tris], order
+
+
+def cache_stats(tris, cache_size=METRIC_CACHE_SIZE):
+    '''
+    Simulates FIFO vertex cache, returns (ACMR, ATVR):
+    vertex transforms per triangle and per used vertex, 1.0 is the best possible ATVR
+    '''
+    flat = numpy.asarray(tris, dtype=numpy.int64).ravel().tolist()
+    if not flat:
+        return 0.0, 0.0
+    cached = {}
+    fifo = []
+    head = 0
+    misses = 0
+    for v in flat:
+        if v not in cached:
+            misses += 1
+            cached[v] = True
+            fifo.append(v)
+            if len(fifo) - head > cache_size:
+                del cached[fifo[head]]
+                head += 1
+    return misses / (len(flat) // 3), misses / len(set(flat))
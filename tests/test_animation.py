@@ -0,0 +1,65 @@
+import pytest
+
+from io_scene_md3.animation import find_sequences, model_sequences, parse_animation_cfg, select_frames
+
+ANIMATION_CFG = '''// animation config file
+
+sex m
+footsteps normal
+headoffset 0 0 0
+
+0	30	0	25		// BOTH_DEATH1
+29	1	0	25		// BOTH_DEAD1
+30	30	0	25		// BOTH_DEATH2
+59	1	0	25		// BOTH_DEAD2
+60	30	0	25		// BOTH_DEATH3
+89	1	0	25		// BOTH_DEAD3
+
+90	40	0	20		// TORSO_GESTURE
+130	6	0	15		// TORSO_ATTACK
+136	6	0	15		// TORSO_ATTACK2
+142	5	0	20		// TORSO_DROP
+147	4	0	20		// TORSO_RAISE
+151	1	0	15		// TORSO_STAND
+152	1	0	15		// TORSO_STAND2
+
+153	8	8	20		// LEGS_WALKCR
+161	12	12	20		// LEGS_WALK
+173	9	9	18		// LEGS_RUN
+'''
+
+
+def test_parse_animation_cfg():
+    sequences = parse_animation_cfg(ANIMATION_CFG)
+    assert len(sequences) == 16
+    assert sequences[0] == ('BOTH_DEATH1', 0, 30, 0, 25)
+    assert sequences[-1] == ('LEGS_RUN', 173, 9, 9, 18)
+    with pytest.raises(ValueError):
+        parse_animation_cfg('0 30 0')
+
+
+def test_model_sequences_of_player_parts():
+    sequences = parse_animation_cfg(ANIMATION_CFG)
+    lower = {s.name: s for s in model_sequences(sequences, 'models/players/sarge/lower.md3')}
+    # legs frames follow both frames in lower.md3
+    assert lower['LEGS_WALKCR'].first == 90
+    assert lower['LEGS_RUN'].first == 110
+    assert lower['BOTH_DEAD3'].first == 89
+    assert 'TORSO_ATTACK' not in lower
+    upper = {s.name: s for s in model_sequences(sequences, 'upper_2.md3')}
+    assert upper['TORSO_ATTACK'].first == 130
+    assert 'LEGS_RUN' not in upper
+
+
+def test_select_frames():
+    assert select_frames(10) == list(range(10))
+    assert select_frames(10, 2, -3, 3) == [2, 5]
+    assert select_frames(10, end=100) == list(range(10))
+    sequences = parse_animation_cfg(ANIMATION_CFG)
+    chosen = find_sequences(sequences, 'torso_attack, TORSO_STAND')
+    assert select_frames(200, sequences=chosen) == [130, 131, 132, 133, 134, 135, 151]
+    assert select_frames(200, stride=2, sequences=chosen) == [130, 132, 134, 151]
+    with pytest.raises(ValueError):
+        select_frames(100, sequences=chosen)  # beyond the model
+    with pytest.raises(ValueError):
+        find_sequences(sequences, 'LEGS_FLY')
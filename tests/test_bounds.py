@@ -0,0 +1,67 @@
+import numpy
+
+from io_scene_md3.bounds import aabb, frame_bounds, ritter_spheres
+
+
+def random_frames(seed, shape=(8, 500, 3)):
+    rnd = numpy.random.RandomState(seed)
+    return (rnd.normal(size=shape) * rnd.uniform(0.1, 50.0, size=(shape[0], 1, 3))).astype(numpy.float32)
+
+
+def assert_encloses(points, centers, radii):
+    # exactly the way engine sees it: float32 center and radius
+    p = points.astype(numpy.float64)
+    c = centers.astype(numpy.float32).astype(numpy.float64)[:, numpy.newaxis]
+    dist = numpy.sqrt(((p - c) ** 2).sum(axis=2)).max(axis=1)
+    assert (dist <= radii.astype(numpy.float32)).all()
+
+
+def test_ritter_sphere_encloses_every_vertex():
+    for seed in range(10):
+        points = random_frames(seed)
+        centers, radii = ritter_spheres(points)
+        assert_encloses(points, centers, radii)
+
+
+def test_ritter_sphere_is_tight():
+    # points on a unit sphere, optimal radius is 1
+    points = random_frames(1, (4, 3000, 3)).astype(numpy.float64)
+    points /= numpy.sqrt((points ** 2).sum(axis=2))[:, :, numpy.newaxis]
+    centers, radii = ritter_spheres(points)
+    assert_encloses(points, centers, radii)
+    assert (radii < 1.05).all()
+
+
+def test_fixed_local_origin():
+    points = random_frames(2)
+    data = frame_bounds(points, local_origin=(1.0, -2.0, 3.0))
+    assert (data['localOrigin'] == (1.0, -2.0, 3.0)).all()
+    assert_encloses(points, data['localOrigin'], data['radius'])
+
+
+def test_aabb():
+    points = random_frames(3)
+    mins, maxs = aabb(points)
+    for f in range(len(points)):
+        assert mins[f].tolist() == [min(p[i] for p in points[f]) for i in range(3)]
+        assert maxs[f].tolist() == [max(p[i] for p in points[f]) for i in range(3)]
+
+
+def test_degenerate_frames():
+    data = frame_bounds(numpy.zeros((3, 0, 3)))
+    assert (data['radius'] == 0).all()
+    assert (data['minBounds'] == 0).all()
+    data = frame_bounds(numpy.ones((2, 1, 3)))
+    assert (data['localOrigin'] == 1.0).all()
+    assert (data['radius'] == 0).all()
+
+
+def test_batched_frames_match_single_frames():
+    # export computes bounds of several frames at once, results must not depend on the batch
+    points = random_frames(4, (12, 300, 3))
+    for local_origin in (None, (0.0, 0.0, 0.0)):
+        batched = frame_bounds(points, local_origin)
+        for f in range(len(points)):
+            single = frame_bounds(points[f:f + 1], local_origin)
+            for key, values in single.items():
+                assert batched[key][f].tolist() == values[0].tolist()
@@ -0,0 +1,120 @@
+import os
+
+import numpy
+import pytest
+
+from io_scene_md3 import cache as md3cache
+from io_scene_md3.cache import DecodeCache, file_key, load_model
+from io_scene_md3.md3file import MD3File
+
+from test_md3file import build_md3
+
+
+@pytest.fixture
+def cache(tmpdir, request):
+    return DecodeCache(str(tmpdir / ('cache_' + request.node.name)))
+
+
+def write_model(tmpdir, name, **kw):
+    path = tmpdir / name
+    path.write_bytes(build_md3(**kw))
+    return str(path)
+
+
+def assert_same_model(a, b):
+    assert a.header == b.header
+    assert a.frames == b.frames
+    assert a.frame_tags(1) == b.frame_tags(1)
+    for x, y in zip(a.tags, b.tags):
+        assert numpy.array_equal(x, y)
+    assert len(a.surfaces) == len(b.surfaces)
+    for sa, sb in zip(a.surfaces, b.surfaces):
+        assert sa.header == sb.header
+        assert sa.shaders == sb.shaders
+        for x, y in zip(sa.triangles + sa.texcoords, sb.triangles + sb.texcoords):
+            assert numpy.array_equal(x, y)
+        assert numpy.array_equal(sa.positions(), sb.positions())
+        assert numpy.array_equal(sa.normals, sb.normals)
+
+
+def test_decoded_model_matches_md3file(tmpdir):
+    path = write_model(tmpdir, 'decoded.md3')
+    model = load_model(path)
+    with MD3File(path) as md3:
+        assert list(model.frame_tags(2)) == list(md3.frame_tags(2))
+        surface = md3.surfaces[1]
+        assert numpy.array_equal(model.surfaces[1].positions(), surface.positions())
+        assert model.surfaces[1].shaders == list(surface.shaders)
+        # normals are kept as stored bytes and decoded the way fmt_md3 does
+        assert model.surfaces[1].normal_bytes.dtype == numpy.uint8
+        normals = surface.vertices.array().normal.astype(numpy.float32)
+        assert numpy.array_equal(model.surfaces[1].normals.reshape((-1, 3)), normals)
+
+
+def test_repeated_load_hits_cache(tmpdir, cache):
+    path = write_model(tmpdir, 'cached.md3')
+    first = load_model(path, cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    second = load_model(path, cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert not second.surfaces[0].positions().flags.owndata  # mapped from file
+    assert_same_model(first, second)
+
+
+def test_key_depends_on_contents_and_version(tmpdir, monkeypatch):
+    path = write_model(tmpdir, 'key.md3')
+    key = file_key(path)
+    assert file_key(write_model(tmpdir, 'key_copy.md3')) == key
+    assert file_key(write_model(tmpdir, 'key_other.md3', nFrames=4)) != key
+    monkeypatch.setattr(md3cache, 'CACHE_VERSION', 'other')
+    assert file_key(path) != key
+
+
+def test_damaged_entry_is_a_miss(tmpdir, cache):
+    path = write_model(tmpdir, 'damaged.md3')
+    load_model(path, cache)
+    with open(os.path.join(cache.entry_path(file_key(path)), 'arrays.bin'), 'r+b') as f:
+        f.truncate(100)
+    assert cache.get(file_key(path)) is None
+
+
+def test_least_recently_used_are_evicted(tmpdir, cache):
+    paths = [write_model(tmpdir, 'lru{}.md3'.format(i), nFrames=i + 1) for i in range(3)]
+    for path in paths:
+        load_model(path, cache)
+    assert len(cache.entries()) == 3
+
+    key0, key1, key2 = (file_key(path) for path in paths)
+    # key1 is the least recently used, key0 is used after key2
+    os.utime(os.path.join(cache.entry_path(key1), 'meta.json'), (0, 0))
+    os.utime(os.path.join(cache.entry_path(key2), 'meta.json'), (1, 1))
+    cache.get(key0)
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    assert not os.path.exists(cache.entry_path(key1))
+    assert cache.get(key0) is not None and cache.get(key2) is not None
+
+
+def test_disabled_by_environment():
+    assert DecodeCache.from_environ({'MD3_CACHE_SIZE': '0'}) is None
+    cache = DecodeCache.from_environ({'MD3_CACHE_SIZE': '1', 'MD3_CACHE_DIR': '/somewhere'})
+    assert cache.directory == '/somewhere' and cache.max_bytes == 1 << 20
+
+
+def test_partial_load_matches_full(tmpdir, cache):
+    path = write_model(tmpdir, 'partial.md3', nFrames=5)
+    frames = [1, 3, 4]
+    direct = load_model(path, frames=frames)
+    load_model(path, cache, frames=frames)
+    assert cache.entries() == []  # partial models are not cached
+    load_model(path, cache)
+    selected = load_model(path, cache, frames=frames)
+    for model in (direct, selected):
+        assert model.frame_numbers == frames
+        assert [f.name for f in model.frames] == ['frame_1', 'frame_3', 'frame_4']
+        assert model.frame_tags(1)[0].origin == (3.0, 0.0, 0.0)
+    for x, y in zip(direct.tags, selected.tags):
+        assert numpy.array_equal(x, y)
+    for sa, sb in zip(direct.surfaces, selected.surfaces):
+        assert numpy.array_equal(sa.positions(), sb.positions())
+        assert numpy.array_equal(sa.normals, sb.normals)
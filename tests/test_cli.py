@@ -0,0 +1,66 @@
+import json
+
+from io_scene_md3 import cli
+
+from test_md3file import build_md3
+
+
+def run(capsys, *argv):
+    code = cli.main(['--jobs', '2'] + list(argv))
+    return code, [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_info_and_validate(tmpdir, capsys):
+    d = tmpdir / 'cli_models'
+    (d / 'sub').mkdir(parents=True)
+    (d / 'a.md3').write_bytes(build_md3())
+    (d / 'sub' / 'b.MD3').write_bytes(build_md3(nFrames=1, nTags=0))
+
+    code, results = run(capsys, 'info', str(d))
+    assert code == 0
+    assert [r['path'] for r in results] == [str(d / 'a.md3'), str(d / 'sub' / 'b.MD3')]
+    assert results[0]['frames'] == ['frame_0', 'frame_1', 'frame_2']
+    assert results[0]['tags'] == ['tag_0', 'tag_1']
+    assert results[0]['surfaces'][0] == {'name': 'body', 'nVerts': 4, 'nTris': 2, 'shaders': ['textures/skin']}
+    assert results[1]['tags'] == []
+
+    code, results = run(capsys, 'validate', str(d))
+    assert code == 0
+    assert all(r['valid'] and not r['errors'] for r in results)
+
+
+def test_validate_broken(tmpdir, capsys):
+    data = bytearray(build_md3())
+    data[-20:] = b''  # truncated vertices
+    path = tmpdir / 'broken.md3'
+    path.write_bytes(bytes(data))
+    code, (result,) = run(capsys, 'validate', str(path))
+    assert code == 1
+    assert not result['valid']
+    assert any('offEnd' in e for e in result['errors'])
+
+
+def test_validate_truncated_header(tmpdir, capsys):
+    path = tmpdir / 'short.md3'
+    path.write_bytes(build_md3()[:50])
+    code, (result,) = run(capsys, 'validate', str(path))
+    assert code == 1
+    assert result['path'] == str(path)
+    assert not result['valid']
+    assert result['errors'] == ['Truncated MD3 file: {}'.format(path)]
+
+
+def test_common_base():
+    assert cli.common_base(['/m/bc/a.md3', '/m/bd/b.md3']) == '/m'
+    assert cli.common_base(['/m/b/a.md3', '/m/b/c/d.md3']) == '/m/b'
+    assert cli.common_base(['/x/a.md3', '/y/b.md3']) == '/'
+    assert cli.common_base([]) == ''
+
+
+def test_reencode_is_lossless(tmpdir, capsys):
+    d = tmpdir / 'cli_reencode'
+    d.mkdir()
+    (d / 'a.md3').write_bytes(build_md3())
+    code, (result,) = run(capsys, 'reencode', '--output-dir', str(d / 'out'), str(d / 'a.md3'))
+    assert code == 0
+    assert (d / 'out' / 'a.md3').read_bytes() == (d / 'a.md3').read_bytes()
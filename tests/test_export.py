@@ -1,5 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import bpy
-from io_scene_md3.export_md3 import MD3Exporter
+from io_scene_md3 import export_md3
+from io_scene_md3.export_cache import ExportCache
+from io_scene_md3.export_md3 import MD3Exporter, SerialExecutor
+from io_scene_md3.instrument import Instrumentation
+from io_scene_md3.md3file import MD3File
+from io_scene_md3.surfaces import group_by_shaders
+
+
+def visible_meshes():
+    return [o for o in bpy.context.scene.objects if o.type == 'MESH' and not o.hide]
 
 
 def test_export_doesnt_crash(tmpdir, simple_blend):
@@ -7,3 +18,80 @@ def test_export_doesnt_crash(tmpdir, simple_blend):
     MD3Exporter(bpy.context)(str(fname))
     assert fname.exists()
     assert fname.stat().st_size > 0
+
+
+def test_rigid_surfaces_match_full_evaluation(tmpdir, simple_blend, monkeypatch):
+    rigid_objects = sum(not export_md3.is_deforming(o) for o in visible_meshes())
+    fast = tmpdir / 'rigid.md3'
+    fast_stats = Instrumentation({'timers'})
+    MD3Exporter(bpy.context, instrument=fast_stats)(str(fast))
+    monkeypatch.setattr(export_md3, 'is_deforming', lambda obj: True)
+    full = tmpdir / 'full.md3'
+    full_stats = Instrumentation({'timers'})
+    MD3Exporter(bpy.context, instrument=full_stats)(str(full))
+    assert fast.read_bytes() == full.read_bytes()
+
+    with MD3File(str(full)) as md3:
+        nFrames = md3.header.nFrames
+    # rigid objects are evaluated at the first frame only, later frames just move them
+    assert fast_stats.counters.get('rigid surface frames', 0) == rigid_objects * (nFrames - 1)
+    assert 'rigid surface frames' not in full_stats.counters
+    assert full_stats.counters['meshes evaluated'] == len(visible_meshes()) * nFrames
+    evaluated = full_stats.counters['meshes evaluated'] - rigid_objects * (nFrames - 1)
+    assert fast_stats.counters['meshes evaluated'] == evaluated
+
+
+def test_parallel_encoding_matches_serial(tmpdir, simple_blend):
+    serial = tmpdir / 'serial.md3'
+    serial_stats = Instrumentation({'timers'})
+    serial_exporter = MD3Exporter(bpy.context, workers=1, instrument=serial_stats)
+    serial_exporter(str(serial))
+    assert isinstance(serial_exporter.executor, SerialExecutor)
+    parallel = tmpdir / 'parallel.md3'
+    parallel_stats = Instrumentation({'timers'})
+    parallel_exporter = MD3Exporter(bpy.context, workers=4, instrument=parallel_stats)
+    parallel_exporter(str(parallel))
+    assert isinstance(parallel_exporter.executor, ThreadPoolExecutor)
+    assert serial.read_bytes() == parallel.read_bytes()
+    # encoding is timed in both modes, one job per frame
+    with MD3File(str(serial)) as md3:
+        nFrames = md3.header.nFrames
+    assert serial_stats.calls['encode'] == parallel_stats.calls['encode'] == nFrames
+    # serial mode is the default
+    assert MD3Exporter(bpy.context).workers == 1
+
+
+def test_merged_surfaces_keep_geometry(tmpdir, simple_blend):
+    separate = tmpdir / 'separate.md3'
+    MD3Exporter(bpy.context)(str(separate))
+    merged = tmpdir / 'merged.md3'
+    MD3Exporter(bpy.context, merge_surfaces=True)(str(merged))
+    with MD3File(str(separate)) as a, MD3File(str(merged)) as b:
+        groups = group_by_shaders([[shader.name for shader in s.shaders] for s in a.surfaces])
+        assert b.header.nSurfaces == len(groups)
+        assert [s.name for s in b.surfaces] == [a.surfaces[group[0]].name for group in groups]
+        assert sum(s.header.nTris for s in b.surfaces) == sum(s.header.nTris for s in a.surfaces)
+        assert sum(s.header.nVerts for s in b.surfaces) == sum(s.header.nVerts for s in a.surfaces)
+        assert list(b.frames) == list(a.frames)
+
+
+def test_incremental_export_matches_full(tmpdir, simple_blend):
+    full = tmpdir / 'full.md3'
+    MD3Exporter(bpy.context)(str(full))
+    with MD3File(str(full)) as md3:
+        surface_frames = md3.header.nSurfaces * md3.header.nFrames
+    cache = ExportCache(str(tmpdir / 'cache'))
+    for name in ('first.md3', 'second.md3'):
+        stats = Instrumentation({'timers'})
+        MD3Exporter(bpy.context, cache=cache, instrument=stats)(str(tmpdir / name))
+        assert (tmpdir / name).read_bytes() == full.read_bytes()
+    # second export takes every frame of every object from the cache
+    assert stats.counters['cached surface frames'] == surface_frames
+    assert 'meshes evaluated' not in stats.counters
+    assert cache.hits == len(cache.entries) > 0
+    # entries on disk are used by a new session
+    restarted = ExportCache(str(tmpdir / 'cache'))
+    MD3Exporter(bpy.context, cache=restarted)(str(tmpdir / 'third.md3'))
+    assert (tmpdir / 'third.md3').read_bytes() == full.read_bytes()
+    assert restarted.misses == 0
+    assert restarted.hits == len(cache.entries)
@@ -0,0 +1,70 @@
+import numpy
+import pytest
+
+from io_scene_md3 import export_cache
+from io_scene_md3.export_cache import ExportCache, SurfaceEntry
+
+
+def make_entry(nVerts=4, nFrames=3, seed=0):
+    rnd = numpy.random.RandomState(seed)
+    entry = SurfaceEntry(
+        shader_list=['models/test/skin'],
+        tris=numpy.array([(0, 2, 1), (1, 2, 3)]),
+        uv=rnd.rand(nVerts, 2).astype(numpy.float32),
+        md3vert_to_loop=list(range(nVerts)),
+    )
+    for frame in range(nFrames):
+        entry.states.append(rnd.rand(16))
+        entry.co.append(rnd.rand(nVerts, 3).astype(numpy.float32))
+        entry.blocks.append(rnd.bytes(nVerts * 8))
+    return entry
+
+
+def assert_same_entry(a, b):
+    assert a.shader_list == b.shader_list
+    assert numpy.array_equal(a.tris, b.tris)
+    assert numpy.array_equal(a.uv, b.uv)
+    assert list(a.md3vert_to_loop) == list(b.md3vert_to_loop)
+    assert a.blocks == b.blocks
+    for x, y in zip(a.states + list(a.co), b.states + list(b.co)):
+        assert numpy.array_equal(x, y)
+
+
+def test_memory_cache():
+    cache = ExportCache()
+    entry = make_entry()
+    assert cache.get('a') is None
+    cache.put('a', entry)
+    assert cache.get('a') is entry
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_cache_survives_restart(tmpdir):
+    entry = make_entry()
+    ExportCache(str(tmpdir)).put('a', entry)
+    loaded = ExportCache(str(tmpdir)).get('a')
+    assert loaded.complete(3)
+    assert_same_entry(loaded, entry)
+
+
+def test_damaged_or_old_entries_are_misses(tmpdir, monkeypatch):
+    cache = ExportCache(str(tmpdir))
+    cache.put('a', make_entry())
+    (tmpdir / 'b.npz').write_bytes(b'garbage')
+    monkeypatch.setattr(export_cache, 'ENTRY_VERSION', 'other')
+    fresh = ExportCache(str(tmpdir))
+    assert fresh.get('a') is None
+    assert fresh.get('b') is None
+
+
+@pytest.mark.parametrize('directory', [False, True])
+def test_least_recently_used_are_evicted(tmpdir, directory):
+    entries = [make_entry(nVerts=64, seed=i) for i in range(3)]
+    cache = ExportCache(str(tmpdir) if directory else None, max_bytes=entries[0].nbytes * 2)
+    cache.put('a', entries[0])
+    cache.put('b', entries[1])
+    cache.get('a')
+    cache.put('c', entries[2])
+    assert list(cache.entries) == ['a', 'c']
+    if directory:
+        assert len(cache.disk_entries()) <= 2
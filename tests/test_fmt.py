@@ -0,0 +1,78 @@
+import struct
+from math import pi
+
+import numpy
+import pytest
+
+from io_scene_md3 import fmt_md3 as fmt
+
+
+def make_vertices():
+    return b''.join(
+        fmt.Vertex.pack(x / 3.0, -x / 5.0, x / 7.0, normal=(0.0, 0.0, 1.0) if x % 2 else (0.6, 0.0, 0.8))
+        for x in range(-50, 50))
+
+
+def test_unpack_array_matches_unpack():
+    bs = make_vertices()
+    arr = fmt.Vertex.unpack_array(bs, fmt.Vertex.size * 3, 50)
+    for i in range(50):
+        v = fmt.Vertex.unpack(bs[fmt.Vertex.size * (i + 3):fmt.Vertex.size * (i + 4)])
+        assert (arr.x[i], arr.y[i], arr.z[i]) == (v.x, v.y, v.z)
+        assert numpy.allclose(arr.normal[i], v.normal)
+
+
+def test_unpack_array_strings_and_tuples():
+    bs = b''.join(
+        fmt.Tag.pack(name='tag_{}'.format(i), origin=(i, 0.5, -i), axis=(1.0, 0, 0, 0, 1.0, 0, 0, 0, pi))
+        for i in range(4))
+    arr = fmt.Tag.unpack_array(bs, 0, 4)
+    assert arr.name.tolist() == ['tag_0', 'tag_1', 'tag_2', 'tag_3']
+    assert arr.origin.shape == (4, 3)
+    assert arr.axis.shape == (4, 9)
+    assert arr.origin[2].tolist() == [2.0, 0.5, -2.0]
+
+
+def test_unpack_array_texcoords():
+    bs = b''.join(fmt.TexCoord.pack(i / 10.0, i / 20.0) for i in range(10))
+    arr = fmt.TexCoord.unpack_array(bs)
+    assert numpy.allclose(arr.s, [i / 10.0 for i in range(10)])
+    assert numpy.allclose(arr.t, [i / 20.0 for i in range(10)])
+
+
+def test_unpack_array_texcoords_match_unpack():
+    bs = b''.join(fmt.TexCoord.pack(i / 7.0, 1.0 - i / 9.0) for i in range(10))
+    arr = fmt.TexCoord.unpack_array(bs)
+    assert arr.s.dtype == arr.t.dtype == numpy.float64
+    assert list(zip(arr.s.tolist(), arr.t.tolist())) == list(fmt.TexCoord.iter_unpack(bs))
+
+
+def test_scalar_pack_unpack():
+    bs = fmt.Tag.pack('tag_head', origin=(1.0, 2.0, 3.0), axis=range(9))
+    assert bs == fmt.Tag.struct.pack(b'tag_head', 1.0, 2.0, 3.0, *range(9))
+    tag = fmt.Tag.unpack(bs)
+    assert type(tag) is fmt.Tag.ntuple_cls
+    assert tag == ('tag_head', (1.0, 2.0, 3.0), tuple(float(i) for i in range(9)))
+    assert fmt.Tag.unpack_from(b'\0' + bs, 1) == tag
+    assert fmt.Tag.from_plain(fmt.Tag.struct.unpack(bs)) == tag
+    assert fmt.TexCoord.unpack(fmt.TexCoord.pack(t=0.25, s=0.5)) == (0.5, 0.25)
+
+
+def test_scalar_pack_errors():
+    with pytest.raises(TypeError):
+        fmt.Triangle.pack(1, 2)
+    with pytest.raises(TypeError):
+        fmt.Triangle.pack(1, 2, 3, d=4)
+    with pytest.raises(AssertionError):
+        fmt.Tag.pack('tag', origin=(1.0, 2.0), axis=range(9))
+    with pytest.raises(struct.error):
+        fmt.Triangle.pack(1, 2, 2 ** 40)
+
+
+def test_iter_unpack():
+    bs = make_vertices()
+    size = fmt.Vertex.size
+    assert list(fmt.Vertex.iter_unpack(bs, size * 3, 50)) == [
+        fmt.Vertex.unpack_from(bs, size * i) for i in range(3, 53)]
+    assert len(list(fmt.Vertex.iter_unpack(bs))) == 100
+    assert list(fmt.Vertex.iter_unpack(bs, len(bs))) == []
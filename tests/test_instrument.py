@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from io_scene_md3.instrument import Instrumentation, features_from_environ
+
+
+def test_features_from_environ():
+    assert features_from_environ({}) == set()
+    assert features_from_environ({'MD3_PROFILE': '1'}) == {'timers'}
+    assert features_from_environ({'MD3_PROFILE': 'cprofile, tracemalloc'}) == {'cprofile', 'tracemalloc'}
+    with pytest.raises(ValueError):
+        features_from_environ({'MD3_PROFILE': 'timers,nope'})
+
+
+def test_disabled_records_nothing():
+    instrument = Instrumentation()
+    with instrument.capture():
+        with instrument.phase('work'):
+            instrument.count('items', 3)
+    assert not instrument.enabled
+    assert instrument.times == {} and instrument.counters == {}
+
+
+def test_phases_counters_and_dump(tmpdir):
+    path = str(tmpdir / 'profile.json')
+    instrument = Instrumentation.from_environ(
+        ['cprofile'], {'MD3_PROFILE': 'tracemalloc', 'MD3_PROFILE_JSON': path})
+    with instrument.capture():
+        for i in range(3):
+            with instrument.phase('outer'):
+                with instrument.phase('inner'):
+                    instrument.count('items', 2)
+                    data = [bytes(1000) for _ in range(100)]
+    del data
+    assert instrument.calls == {'outer': 3, 'inner': 3}
+    assert instrument.times['outer'] >= instrument.times['inner']
+    assert instrument.counters == {'items': 6}
+    assert 'items 6' in instrument.summary()
+
+    with open(path) as f:
+        report = json.load(f)
+    assert report['counters'] == {'items': 6}
+    assert report['phases']['inner']['calls'] == 3
+    assert report['profile'] and report['memory']['peak'] >= 100000
+
+
+def test_add_time():
+    instrument = Instrumentation({'timers'})
+    instrument.add_time('encode', 0.25)
+    instrument.add_time('encode', 0.5)
+    assert instrument.times == {'encode': 0.75}
+    assert instrument.calls == {'encode': 2}
+    disabled = Instrumentation()
+    disabled.add_time('encode', 0.25)
+    assert disabled.times == {}
@@ -0,0 +1,92 @@
+import pytest
+
+from io_scene_md3 import fmt_md3 as fmt
+from io_scene_md3.md3file import MD3File
+
+
+def build_md3(nFrames=3, nTags=2, nVerts=4, nTris=2):
+    tags = b''.join(
+        fmt.Tag.pack(name='tag_{}'.format(t), origin=(f, t, 0.0), axis=(1.0, 0, 0, 0, 1.0, 0, 0, 0, 1.0))
+        for f in range(nFrames) for t in range(nTags))
+    frames = b''.join(
+        fmt.Frame.pack(
+            minBounds=(0.0, 0.0, 0.0), maxBounds=(1.0, 1.0, 1.0), localOrigin=(0.0, 0.0, 0.0),
+            radius=1.0, name='frame_{}'.format(f))
+        for f in range(nFrames))
+    shaders = fmt.Shader.pack(name='textures/skin', index=0)
+    tris = b''.join(fmt.Triangle.pack(i, i + 1, i + 2) for i in range(nTris))
+    st = b''.join(fmt.TexCoord.pack(i * 0.25, 0.5) for i in range(nVerts))
+    verts = b''.join(
+        fmt.Vertex.pack(f, i, -i, normal=(0.0, 0.0, 1.0))
+        for f in range(nFrames) for i in range(nVerts))
+    offShaders = fmt.Surface.size
+    offTris = offShaders + len(shaders)
+    offST = offTris + len(tris)
+    offVerts = offST + len(st)
+    offEnd = offVerts + len(verts)
+    surface = fmt.Surface.pack(
+        magic=fmt.MAGIC, name='body', flags=0, nFrames=nFrames, nShaders=1, nVerts=nVerts, nTris=nTris,
+        offTris=offTris, offShaders=offShaders, offST=offST, offVerts=offVerts, offEnd=offEnd,
+    ) + shaders + tris + st + verts
+    offFrames = fmt.Header.size
+    offTags = offFrames + len(frames)
+    offSurfaces = offTags + len(tags)
+    offEnd = offSurfaces + 2 * len(surface)
+    header = fmt.Header.pack(
+        magic=fmt.MAGIC, version=fmt.VERSION, modelname='test', flags=0,
+        nFrames=nFrames, nTags=nTags, nSurfaces=2, nSkins=0,
+        offFrames=offFrames, offTags=offTags, offSurfaces=offSurfaces, offEnd=offEnd)
+    return header + frames + tags + surface + surface
+
+
+@pytest.fixture
+def md3_path(tmpdir):
+    path = tmpdir / 'reader.md3'
+    path.write_bytes(build_md3())
+    return path
+
+
+def test_header_and_lumps(md3_path):
+    with MD3File(str(md3_path)) as md3:
+        assert md3.header.modelname == 'test'
+        assert [f.name for f in md3.frames] == ['frame_0', 'frame_1', 'frame_2']
+        assert len(md3.tags) == 6
+        assert [t.name for t in md3.frame_tags(1)] == ['tag_0', 'tag_1']
+        assert md3.frame_tags(2)[1].origin == (2.0, 1.0, 0.0)
+        assert len(md3.surfaces) == 2
+        surface = md3.surfaces[1]
+        assert surface.name == 'body'
+        assert surface.shaders[0].name == 'textures/skin'
+        assert surface.triangles[-1] == (1, 2, 3)
+        assert surface.frame_vertices(2)[3][:3] == (2.0, 3.0, -3.0)
+        positions = surface.positions()
+        assert positions.shape == (3, 4, 3)
+        assert positions[1, 2].tolist() == [1.0, 2.0, -2.0]
+
+
+def test_rejects_garbage(tmpdir):
+    path = tmpdir / 'garbage.md3'
+    path.write_bytes(b'\0' * 200)
+    with pytest.raises(ValueError):
+        MD3File(str(path))
+
+
+def test_rejects_truncated(tmpdir):
+    data = build_md3()
+    path = tmpdir / 'truncated.md3'
+    path.write_bytes(data[:fmt.Header.size // 2])
+    with pytest.raises(ValueError):
+        MD3File(str(path))
+    path.write_bytes(data[:fmt.Header.size + 10])
+    with MD3File(str(path)) as md3:
+        with pytest.raises(ValueError):
+            md3.surfaces
+
+
+def test_selected_frames_only(md3_path):
+    with MD3File(str(md3_path)) as md3:
+        surface = md3.surfaces[0]
+        assert surface.positions([2, 0]).tolist() == surface.positions()[[2, 0]].tolist()
+        tags = md3.frames_tags([1, 2])
+        assert tags.name.tolist() == ['tag_0', 'tag_1'] * 2
+        assert tags.origin[:, 0].tolist() == [1.0, 1.0, 2.0, 2.0]
@@ -0,0 +1,45 @@
+import random
+from math import sqrt
+
+import numpy
+
+from io_scene_md3 import fmt_md3 as fmt
+from io_scene_md3.normals import decode_normals, encode_normals
+
+
+def random_normals(n, seed=0):
+    rnd = random.Random(seed)
+    result = [
+        (0.0, 0.0, 1.0), (0.0, 0.0, -1.0), (-0.0, 0.0, 0.5), (1.0, 0.0, 0.0),
+        (-1.0, 0.0, 0.0), (0.0, -1.0, 0.0), (0.0, 1.0, 0.0),
+    ]
+    while len(result) < n:
+        v = [rnd.gauss(0.0, 1.0) for i in range(3)]
+        length = sqrt(sum(c * c for c in v))
+        # loop normals come from blender as float32
+        result.append(tuple(numpy.float32(c / length).item() for c in v))
+    return result
+
+
+def test_decode_is_exact():
+    b = numpy.array([(lat, lon) for lat in range(256) for lon in range(256)], dtype=numpy.uint8)
+    decoded = decode_normals(b)
+    for i in range(len(b)):
+        assert tuple(decoded[i]) == fmt.decode_normal(b[i].tolist())
+
+
+def test_encode_is_exact():
+    normals = random_normals(20000)
+    encoded = encode_normals(numpy.array(normals, dtype=numpy.float32))
+    for n, e in zip(normals, encoded):
+        assert bytes(e.tolist()) == fmt.encode_normal(n)
+
+
+def test_vertex_pack_array():
+    normals = random_normals(500, seed=1)
+    co = numpy.random.RandomState(2).uniform(-500, 500, (500, 3)).astype(numpy.float32)
+    expected = b''.join(fmt.Vertex.pack(*c, normal=n) for c, n in zip(co.tolist(), normals))
+    got = fmt.Vertex.pack_array(co[:, 0], co[:, 1], co[:, 2], normal=normals)
+    assert got == expected
+    arr = fmt.Vertex.unpack_array(got)
+    assert numpy.allclose(numpy.column_stack((arr.x, arr.y, arr.z)), co, atol=1.0 / 64)
@@ -0,0 +1,90 @@
+import os
+import zipfile
+
+import pytest
+
+from io_scene_md3.cache import load_model
+from io_scene_md3.md3file import MD3File
+from io_scene_md3.pk3 import Archive, ArchiveIndex, ArchiveIndexCache, split_archive_path
+
+from test_md3file import build_md3
+
+
+def write_pk3(path, members, compression=zipfile.ZIP_STORED):
+    with zipfile.ZipFile(str(path), 'w', compression) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+
+
+@pytest.fixture(scope='module')
+def gamedir(tmpdir):
+    d = tmpdir / 'pk3' / 'baseq3'
+    d.mkdir(parents=True)
+    write_pk3(d / 'pak0.pk3', {
+        'models/weapons/gun.md3': build_md3(),
+        'models/weapons/gun.tga': b'old',
+        'textures/base/wall.jpg': b'wall',
+    })
+    write_pk3(d / 'PAK1.pk3', {
+        'Models/Weapons/Gun.TGA': b'new',
+        'models/players/head.md3': build_md3(nFrames=1),
+    }, zipfile.ZIP_DEFLATED)
+    (d / 'readme.txt').write_bytes(b'')
+    return d
+
+
+def test_split_archive_path(gamedir):
+    pak0 = str(gamedir / 'pak0.pk3')
+    assert split_archive_path(pak0 + '/models/weapons/gun.md3') == (pak0, 'models/weapons/gun.md3')
+    assert split_archive_path(pak0 + '\\models\\weapons\\gun.md3') == (pak0, 'models/weapons/gun.md3')
+    other = str(gamedir / 'missing.pk3' / 'gun.md3')
+    assert split_archive_path(other) == (None, other)
+
+
+def test_stored_member_is_not_copied(gamedir):
+    with Archive(str(gamedir / 'pak0.pk3')) as archive:
+        data = archive.read('MODELS/weapons/gun.md3')
+        assert isinstance(data, memoryview)
+        assert bytes(data) == build_md3()
+        data.release()
+        with pytest.raises(KeyError):
+            archive.read('models/missing.md3')
+
+
+def test_model_from_archive_buffer(gamedir):
+    path = str(gamedir / 'pak0.pk3' / 'models' / 'weapons' / 'gun.md3')
+    index = ArchiveIndex.for_directory(str(gamedir))
+    archive_path, member = split_archive_path(path)
+    buffer = index.get_archive(archive_path).read(member)
+    with MD3File(path, buffer) as md3:
+        assert md3.header.nFrames == 3
+        assert [s.name for s in md3.surfaces] == ['body', 'body']
+    model = load_model(path, buffer=buffer)
+    assert model.surfaces[0].positions().shape == (3, 4, 3)
+    buffer.release()
+    index.close()
+
+
+def test_later_archives_take_priority(gamedir):
+    index = ArchiveIndex.for_directory(str(gamedir))
+    assert [os.path.basename(a.path) for a in index.archives] == ['PAK1.pk3', 'pak0.pk3']
+    archive, member = index.find('models/weapons/gun.tga')
+    assert os.path.basename(archive.path) == 'PAK1.pk3' and member == 'Models/Weapons/Gun.TGA'
+    assert archive.read(member) == b'new'  # deflated, read through zipfile
+    archive, member = index.find('textures/base/wall.tga')  # extension is swapped
+    assert member == 'textures/base/wall.jpg'
+    assert index.find('textures/base/missing') is None
+    index.close()
+
+
+def test_index_cache_rebuilds_on_change(tmpdir):
+    d = tmpdir / 'pk3cache'
+    d.mkdir()
+    write_pk3(d / 'pak0.pk3', {'a.tga': b'a'})
+    cache = ArchiveIndexCache()
+    index = cache.get(str(d))
+    assert cache.get(str(d)) is index
+    write_pk3(d / 'pak1.pk3', {'b.tga': b'b'})
+    index = cache.get(str(d))
+    assert index.find('b') is not None and index.find('a') is not None
+    cache.clear()
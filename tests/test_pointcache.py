@@ -0,0 +1,33 @@
+import struct
+
+import numpy
+
+from io_scene_md3.pointcache import PC2_HEADER, read_mdd, read_pc2, write_mdd, write_pc2
+
+
+def random_positions(nFrames=5, nPoints=7):
+    return numpy.random.RandomState(0).normal(size=(nFrames, nPoints, 3)).astype(numpy.float32)
+
+
+def test_pc2_layout(tmpdir):
+    path = str(tmpdir / 'test.pc2')
+    positions = random_positions()
+    write_pc2(path, positions, start=10.0, rate=2.0)
+    data = (tmpdir / 'test.pc2').read_bytes()
+    assert data[:PC2_HEADER.size] == PC2_HEADER.pack(b'POINTCACHE2\0', 1, 7, 10.0, 2.0, 5)
+    assert len(data) == PC2_HEADER.size + positions.nbytes
+    loaded, start, rate = read_pc2(path)
+    assert (start, rate) == (10.0, 2.0)
+    assert numpy.array_equal(loaded, positions)
+
+
+def test_mdd_is_big_endian(tmpdir):
+    path = str(tmpdir / 'test.mdd')
+    positions = random_positions()
+    write_mdd(path, positions, numpy.arange(5) / 25.0)
+    data = (tmpdir / 'test.mdd').read_bytes()
+    assert data[:8] == b'\0\0\0\x05\0\0\0\x07'
+    assert data[-4:] == struct.pack('>f', positions[-1, -1, -1])
+    loaded, times = read_mdd(path)
+    assert numpy.array_equal(loaded, positions)
+    assert numpy.allclose(times, numpy.arange(5) / 25.0)
@@ -4,9 +4,12 @@ from math import sqrt
 from PIL import Image, ImageChops
 
 import bpy
+import numpy
 
 from io_scene_md3.export_md3 import MD3Exporter
 from io_scene_md3.import_md3 import MD3Importer
+from io_scene_md3.md3file import MD3File
+from io_scene_md3.pointcache import read_pc2
 
 
 def render_to_file(path):
@@ -72,3 +75,23 @@ def test_render(testdir, tmpdir, simple_blend):
     render_to_file(img_b)
 
     compare_images(img_a, img_b)
+
+
+def test_import_to_mesh_cache(tmpdir, simple_blend):
+    scene = bpy.context.scene
+    scene.frame_end = scene.frame_start + 2  # only animated surfaces get a point cache
+    fname = tmpdir / 'cached.md3'
+    MD3Exporter(bpy.context)(str(fname))
+    MD3Importer(bpy.context, vertex_animation='PC2')(str(fname))
+    # imported into a new scene, names of objects get numbered as exported ones still exist
+    objects = [o for o in bpy.context.scene.objects if o.type == 'MESH']
+    checked = 0
+    with MD3File(str(fname)) as md3:
+        for surface in md3.surfaces:
+            obj, = [o for o in objects if o.name == surface.name or o.name.startswith(surface.name + '.')]
+            assert obj.data.shape_keys is None
+            modifier = obj.modifiers['MeshCache']
+            positions, _, _ = read_pc2(bpy.path.abspath(modifier.filepath))
+            assert numpy.array_equal(positions, surface.positions())
+            checked += 1
+    assert checked > 0
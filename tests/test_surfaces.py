@@ -0,0 +1,55 @@
+import numpy
+
+from io_scene_md3 import fmt_md3 as fmt
+from io_scene_md3.surfaces import group_by_shaders, merge_triangles, part_names, split_triangles
+
+
+def strip_tris(n):
+    'Triangle strip over n + 2 vertices'
+    return numpy.array([(i, i + 1, i + 2) for i in range(n)])
+
+
+def test_group_by_shaders():
+    groups = group_by_shaders([['a'], [], ['b', 'c'], ['a'], [], ['b', 'c'], ['c', 'b']])
+    # empty shader lists rely on .skin files and are never merged
+    assert groups == [[0, 3], [1], [2, 5], [4], [6]]
+
+
+def test_merge_triangles_shifts_vertices():
+    merged = merge_triangles([[(0, 1, 2)], [(0, 2, 1), (1, 2, 3)]], [3, 4])
+    assert merged.tolist() == [[0, 1, 2], [3, 5, 4], [4, 5, 6]]
+
+
+def test_split_triangles_keeps_limits_and_triangles():
+    tris = strip_tris(100)
+    for max_verts, max_tris in ((4096, 30), (20, 8192), (10, 9)):
+        chunks = split_triangles(tris, max_verts, max_tris)
+        restored = numpy.vstack([ids[local] for ids, local in chunks])
+        assert (restored == tris).all()
+        for ids, local in chunks:
+            assert len(ids) <= max_verts and len(local) <= max_tris
+            assert len(set(ids.tolist())) == len(ids)
+    # consecutive strip runs share only two vertices, so the count is minimal
+    assert len(split_triangles(tris, 4096, 30)) == 4
+    assert len(split_triangles(tris, 20, 8192)) == 6
+
+
+def test_split_triangles_small():
+    assert split_triangles(numpy.zeros((0, 3), dtype=int)) == []
+    [(ids, local)] = split_triangles([(5, 3, 1), (1, 3, 0)])
+    assert ids.tolist() == [5, 3, 1, 0]
+    assert local.tolist() == [[0, 1, 2], [2, 1, 3]]
+
+
+def test_part_names_are_unique_and_fit():
+    assert part_names('body', 3) == ['body_1', 'body_2', 'body_3']
+    for name in ('x' * 70, 'h\u00e9ad' * 20):
+        names = part_names(name, 12)
+        assert len(set(names)) == 12
+        assert names[-1].endswith('_12')
+        for part in names:
+            bs = fmt.Surface.pack(
+                magic=fmt.MAGIC, name=part, flags=0, nFrames=1, nShaders=0, nVerts=0, nTris=0,
+                offTris=0, offShaders=0, offST=0, offVerts=0, offEnd=0)
+            assert fmt.Surface.unpack(bs).name == part
+            assert len(part.encode('utf-8')) < fmt.MAX_QPATH
@@ -0,0 +1,54 @@
+from io_scene_md3.textures import DirectoryIndex
+
+
+def make_tree(root):
+    model_dir = root / 'baseq3' / 'models' / 'players' / 'Sarge'
+    model_dir.mkdir(parents=True)
+    (model_dir / 'upper.md3').write_bytes(b'')
+    (model_dir / 'Band.TGA').write_bytes(b'')
+    (model_dir / 'red.jpg').write_bytes(b'')
+    (root / 'baseq3' / 'models' / 'weapons').mkdir()
+    (root / 'baseq3' / 'models' / 'weapons' / 'flash.png').write_bytes(b'')
+    return model_dir / 'upper.md3'
+
+
+def test_find_texture(tmpdir):
+    root = tmpdir / 'textures_tree'
+    model = str(make_tree(root))
+    index = DirectoryIndex()
+    sarge = root / 'baseq3' / 'models' / 'players' / 'Sarge'
+    assert index.find_texture(model, 'models/players/sarge/band') == str(sarge / 'Band.TGA')
+    # shader names .tga, file is .jpg
+    assert index.find_texture(model, 'models/players/sarge/red.tga') == str(sarge / 'red.jpg')
+    flash = root / 'baseq3' / 'models' / 'weapons' / 'flash.png'
+    assert index.find_texture(model, 'models/weapons/flash.tga') == str(flash)
+    assert index.find_texture(model, 'models/players/sarge/missing.tga') is None
+    assert index.find_texture(model, 'bad\0name') is None
+
+
+def test_directories_listed_once(tmpdir):
+    root = tmpdir / 'textures_once'
+    model = str(make_tree(root))
+    index = DirectoryIndex()
+    for i in range(10):
+        index.find_texture(model, 'models/players/sarge/red.tga')
+        index.find_texture(model, 'models/players/sarge/band')
+    scans = index.scans
+    assert scans <= 3
+    index.find_texture(model, 'models/players/sarge/band')
+    assert index.scans == scans
+
+
+def test_new_files_are_found(tmpdir):
+    root = tmpdir / 'textures_new'
+    model = str(make_tree(root))
+    index = DirectoryIndex()
+    sarge = root / 'baseq3' / 'models' / 'players' / 'Sarge'
+    assert index.find_texture(model, 'models/players/sarge/blue.tga') is None
+    (sarge / 'blue.tga').write_bytes(b'')
+    assert index.find_texture(model, 'models/players/sarge/blue.tga') == str(sarge / 'blue.tga')
+    # missing directory is not remembered once it's created
+    assert index.find_texture(model, 'models/players/sarge/skins/green.tga') is None
+    (sarge / 'Skins').mkdir()
+    (sarge / 'Skins' / 'green.png').write_bytes(b'')
+    assert index.find_texture(model, 'models/players/sarge/skins/green.tga') == str(sarge / 'Skins' / 'green.png')
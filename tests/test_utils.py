@@ -0,0 +1,51 @@
+import os
+
+import numpy
+import pytest
+
+from io_scene_md3.utils import UMASK, StreamingWriter, loop_vertex_keys, unique_first_seen
+
+
+def test_streaming_writer_patches(tmpdir):
+    fname = tmpdir / 'stream.bin'
+    with StreamingWriter(str(fname)) as f:
+        header = f.reserve(4)
+        assert f.write(b'abc') == 4
+        gap = f.reserve(2)
+        assert f.write(b'xyz') == 9
+        f.write_at(gap, b'--')
+        f.write_at(header, b'HEAD')
+    assert fname.read_bytes() == b'HEADabc--xyz'
+
+
+def test_streaming_writer_is_atomic(tmpdir):
+    fname = tmpdir / 'atomic.bin'
+    fname.write_bytes(b'previous')
+    with pytest.raises(RuntimeError):
+        with StreamingWriter(str(fname)) as f:
+            f.write(b'partial')
+            raise RuntimeError
+    assert fname.read_bytes() == b'previous'
+    assert sorted(p.name for p in tmpdir.iterdir() if 'atomic' in p.name) == ['atomic.bin']
+
+
+def test_streaming_writer_keeps_umask(tmpdir, monkeypatch):
+    def umask(mask):
+        raise AssertionError('umask changed during export')
+    monkeypatch.setattr(os, 'umask', umask)
+    fname = tmpdir / 'mode.bin'
+    with StreamingWriter(str(fname)) as f:
+        f.write(b'data')
+    assert os.stat(str(fname)).st_mode & 0o777 == 0o666 & ~UMASK
+
+
+def test_loop_vertex_keys_dedup():
+    vertex_index = [0, 1, 0, 0, 1]
+    normals = [[0.0, 0.0, 1.0], [1.0, 0.0, 0.0], [-0.0, 0.0, 1.0], [0.0, 1.0, 0.0], [1.0, 0.0, 0.0]]
+    uvs = [[0.5, 0.5], [0.0, 0.0], [0.5, 0.5], [0.5, 0.5], [0.0, 1.0]]
+    first, rank = unique_first_seen(loop_vertex_keys(vertex_index, normals, uvs))
+    assert first.tolist() == [0, 1, 3, 4]
+    assert rank.tolist() == [0, 1, 0, 2, 3]
+    first, rank = unique_first_seen(loop_vertex_keys(numpy.array(vertex_index), normals))
+    assert first.tolist() == [0, 1, 3]
+    assert rank.tolist() == [0, 1, 0, 2, 1]
@@ -0,0 +1,41 @@
+import numpy
+
+from io_scene_md3.vcache import cache_stats, forsyth_order, renumber_vertices
+
+
+def grid_tris(n):
+    'Triangulated n x n quad grid, (n + 1) ** 2 vertices'
+    tris = []
+    for y in range(n):
+        for x in range(n):
+            a = y * (n + 1) + x
+            tris.append((a, a + 1, a + n + 1))
+            tris.append((a + 1, a + n + 2, a + n + 1))
+    return numpy.array(tris), (n + 1) ** 2
+
+
+def test_cache_stats_simple():
+    assert cache_stats([]) == (0.0, 0.0)
+    # every vertex is transformed once
+    assert cache_stats([(0, 1, 2), (2, 1, 0)]) == (1.5, 1.0)
+    # cache of 3 vertices forgets 0 by the time it's used again
+    assert cache_stats([(0, 1, 2), (3, 4, 5), (0, 1, 2)], cache_size=3) == (3.0, 1.5)
+
+
+def test_forsyth_order_improves_shuffled_grid():
+    tris, nVerts = grid_tris(16)
+    tris = tris[numpy.random.RandomState(0).permutation(len(tris))]
+    order = forsyth_order(tris, nVerts)
+    assert sorted(order.tolist()) == list(range(len(tris)))
+    acmr, atvr = cache_stats(tris[order])
+    assert acmr < 0.8 < cache_stats(tris)[0]
+    assert atvr < 1.5
+
+
+def test_renumber_vertices_first_use():
+    tris = numpy.array([(5, 3, 1), (1, 3, 0)])
+    new_tris, order = renumber_vertices(tris, 7)
+    assert new_tris.tolist() == [[0, 1, 2], [2, 1, 3]]
+    # unused vertices go last, winding is kept
+    assert order.tolist() == [5, 3, 1, 0, 2, 4, 6]
+    assert (order[new_tris] == tris).all()